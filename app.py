@@ -1,9 +1,20 @@
-import traceback
-from flask import render_template, request, redirect, url_for
+import time
+from types import SimpleNamespace
+from flask import Response, g, render_template, request, redirect, url_for, jsonify
 import logging.config
 from flask import Flask
-from ingest import Boardgame
+from src.schema import Boardgame, ClusterTopGame, DataVersion, GameNeighbour, TOP_GAME_COLUMNS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
+from src.filters import filters_key, parse_filters
+from src.search import NameIndex, normalize_name
+from src.cache import TTLCache
+from src.catalog import Catalog, ReloadingCatalog
+from src.db import engine_options, instrument_engine, pool_status
+from src.ranking import load_ranking_weights
+from src.registry import ModelRegistry
+from src.similarity import SimilarityIndex
+from src import metrics, profiling, recommend
 
 # Initialize the Flask application
 app = Flask('Boardgame_Recommendations_App', static_folder='app/static' ,template_folder="app/templates")
@@ -13,16 +24,317 @@ app.config.from_pyfile('config/flaskconfig.py')
 
 # Define LOGGING_CONFIG in flask_config.py - path to config file for setting
 # up the logger (e.g. config/logging/local.conf)
-logging.config.fileConfig(app.config["LOGGING_CONFIG"])
+logging.config.fileConfig(app.config["LOGGING_CONFIG"], disable_existing_loggers=False)
 logger = logging.getLogger(app.config["APP_NAME"])
 logger.debug('Test log')
 
-# Initialize the database
+# Initialize the database with the pool settings shared with ingest.py (see config/flaskconfig.py and src/db.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 db = SQLAlchemy(app)
+with app.app_context():
+    instrument_engine(db.engine)
+    metrics.instrument_queries(db.engine)
+metrics.instrument_templates(app)
+
+
+# In-process name search index; built from the boardgames table on the first name query
+name_index = None
+
+# Read-through cache for cluster lookups, top N lists and the rendered index page
+cache = TTLCache(maxsize=app.config["CACHE_MAX_SIZE"], ttl=app.config["CACHE_TTL_SECONDS"])
+data_version = None
+data_version_checked_at = float('-inf')
+
+# Columns handed to the template; cached games are stored as plain dictionaries so they outlive the DB session
+DISPLAY_COLUMNS = TOP_GAME_COLUMNS + ['cluster']
+
+# Optional in-memory backend (SERVING_BACKEND = 'memory'): the whole catalog is held in NumPy arrays and
+# all queries are answered without touching the database. It reloads itself when a new snapshot appears.
+catalog = None
+
+
+def load_catalog_from_db():
+    """Builds the in-memory catalog from the boardgames table"""
+    with app.app_context():
+        return Catalog.from_session(db.session, ranking_weights)
+
+
+def catalog_version_from_db():
+    """Returns the data version stamp written by ingest.py, which tells the catalog when to reload"""
+    with app.app_context():
+        return db.session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+
+
+if app.config["SERVING_BACKEND"] == 'memory':
+    # Snapshots without scores (games_clustered.json) are ranked with the same weights ingest.py scores the database with
+    ranking_weights = load_ranking_weights(app.config["RANKING_CONFIG_PATH"])
+    if app.config["MODEL_REGISTRY_PATH"]:
+        catalog = ReloadingCatalog.from_registry(ModelRegistry(app.config["MODEL_REGISTRY_PATH"]),
+                                                 app.config["MODEL_VERSION"], app.config["CATALOG_CHECK_SECONDS"],
+                                                 ranking_weights)
+    elif app.config["CATALOG_SNAPSHOT_PATH"]:
+        catalog = ReloadingCatalog.from_json(app.config["CATALOG_SNAPSHOT_PATH"], app.config["CATALOG_CHECK_SECONDS"],
+                                             ranking_weights)
+    else:
+        catalog = ReloadingCatalog(load_catalog_from_db, catalog_version_from_db, app.config["CATALOG_CHECK_SECONDS"])
+    try:
+        with profiling.stage('catalog_startup_load'):
+            catalog.reload()  # Load at startup rather than on the first request
+    except Exception as e:
+        logger.error(f"Could not load the catalog at startup, will retry on the first request. Got error: {e}")
+
+
+# "Games like this one" are read from the game_neighbours table (precomputed by src/neighbours.py), unless
+# SIMILARITY_INDEX_PATH points to a similarity index (see src/similarity.py) to search at request time
+similarity_index = None
+if app.config["SIMILARITY_INDEX_PATH"]:
+    try:
+        similarity_index = SimilarityIndex.load(app.config["SIMILARITY_INDEX_PATH"])
+    except (OSError, KeyError, ValueError) as e:
+        logger.error(f"Could not load the similarity index, /api/similar is disabled. Got error: {e}")
+
+
+# Query parameters (or form fields) that select the recommendations, in the order the views check them
+QUERY_TYPES = ('game_id', 'game_name', 'cluster_id')
+
+# Shown instead of recommendations for a game which exists but has no cluster
+UNCLUSTERED_MESSAGE = "This game isn't part of any cluster, so the Guru can't recommend similar games."
+
+
+def query_type():
+    """The kind of recommendation query of the current request (for recommendation_queries_total), or None"""
+    if request.endpoint == 'api_recommendations_batch':
+        return 'batch'
+    if request.endpoint not in ('show_cluster_or_id', 'api_recommendations'):
+        return None
+    values = request.form if request.method == 'POST' else request.args
+    return next((name for name in QUERY_TYPES if values.get(name)), 'cluster_id')
+
+
+def metric_samples():
+    """Cache and connection pool counters of this worker, read when the metrics are collected"""
+    cache_stats = cache.stats()
+    with app.app_context():
+        pool = pool_status(db.engine)
+    return [('cache_hits_total', {}, cache_stats['hits']),
+            ('cache_misses_total', {}, cache_stats['misses']),
+            ('cache_evictions_total', {}, cache_stats['evictions']),
+            ('cache_entries', {}, cache_stats['size']),
+            ('db_pool_checkouts_total', {}, pool['checkouts']),
+            ('db_pool_connects_total', {}, pool['connects']),
+            ('db_pool_invalidations_total', {}, pool['invalidations']),
+            ('db_pool_wait_seconds_total', {}, pool['wait_seconds_total']),
+            ('db_pool_checked_out', {}, pool.get('checked_out', pool['checkouts'] - pool['checkins']))]
+
+
+# Request metrics for /metrics; with several workers each one shares its metrics through METRICS_DIR (see src/metrics.py)
+metrics_collector = None
+if app.config["METRICS_DIR"]:
+    metrics_collector = metrics.MultiprocessCollector(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_SECONDS"],
+                                                      [metric_samples])
+
+
+@app.before_request
+def start_request_timer():
+    """Notes when the request started, for /profile_stats and /metrics"""
+    g.request_started = (time.perf_counter(), time.process_time())
+    metrics.start_request()
+
+
+@app.after_request
+def record_request_time(response):
+    """Records the time of the request under its method and route (see src/profiling.py and src/metrics.py)"""
+    if 'request_started' in g:
+        wall_start, cpu_start = g.request_started
+        seconds = time.perf_counter() - wall_start
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        profiling.recorder.record(f'{request.method} {route}', seconds, time.process_time() - cpu_start,
+                                  profiling.peak_rss_mb(), 0.0)
+        metrics.finish_request(route, request.method, response.status_code, seconds, query_type(), g.get('error', False))
+        if metrics_collector is not None:
+            metrics_collector.start()
+    return response
+
+
+def error_page():
+    """Logs the exception being handled and returns the error page (counted in http_request_errors_total)"""
+    logger.exception("Not able to display boardgames, error page returned")
+    g.error = True
+    return render_template('error.html')
+
+
+@app.before_request
+def check_data_version():
+    """Drops the cache and name index when ingest.py has stamped a new data version.
+
+    The data_version table is polled at most every DATA_VERSION_CHECK_SECONDS, so cached requests don't hit the DB.
+    """
+    global data_version, data_version_checked_at, name_index
+    if catalog is not None:  # The in-memory catalog tracks its own snapshot version and doesn't use the cache
+        return
+    now = time.monotonic()
+    if now - data_version_checked_at < app.config["DATA_VERSION_CHECK_SECONDS"]:
+        return
+    data_version_checked_at = now
+
+    try:
+        latest_version = db.session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+    except SQLAlchemyError as e:
+        logger.debug(f"Could not read data version, keeping the cache as is. Got error: {e}")
+        db.session.rollback()
+        return
+
+    if latest_version != data_version:
+        logger.info(f"Data version changed from {data_version} to {latest_version}; clearing cache")
+        cache.clear()
+        name_index = None
+        data_version = latest_version
+
+
+def get_name_index():
+    """Returns the name search index, building it from the boardgames table if it doesn't exist yet"""
+    global name_index
+    if name_index is None:
+        games = db.session.query(Boardgame.game_id, Boardgame.name, Boardgame.cluster,
+                                 Boardgame.number_of_users_own).all()
+        name_index = NameIndex(games)
+    return name_index
+
+
+def cluster_of_game_id(game_id):
+    """Returns the cluster of the game with the given id; raises an error if there is no such game"""
+    if catalog is not None:
+        return catalog.get().cluster_of_game_id(game_id)
+
+    def lookup():
+        row = db.session.query(Boardgame.cluster).filter(Boardgame.game_id == game_id).first()
+        if row is None:
+            raise LookupError(f'No game with game_id {game_id}')
+        return row[0]
+    return cache.get_or_compute(('game_id', game_id), lookup)
+
+
+def clusters_of_game_ids(game_ids):
+    """Returns {game_id: cluster} for many games at once; unknown ids are left out
+
+    Ids which are not cached are resolved with a single IN query (in chunks, to stay below driver parameter limits).
+    """
+    game_ids = [str(game_id) for game_id in game_ids]
+    if catalog is not None:
+        return catalog.get().clusters_of_game_ids(game_ids)
+
+    not_cached = object()  # None is a valid cached cluster (an unclustered game)
+    clusters = {}
+    missing = []
+    for game_id in game_ids:
+        cluster = cache.get(('game_id', game_id), not_cached)
+        if cluster is not_cached:
+            missing.append(game_id)
+        else:
+            clusters[game_id] = cluster
+    for start in range(0, len(missing), 500):
+        rows = db.session.query(Boardgame.game_id, Boardgame.cluster).filter(Boardgame.game_id.in_(missing[start:start + 500])).all()
+        for game_id, cluster in rows:
+            cache.set(('game_id', game_id), cluster)
+            clusters[game_id] = cluster
+    return clusters
+
+
+def cluster_of_game_name(game_name):
+    """Returns the cluster of the best matching game name (ranked by relevance, then popularity); raises an error if nothing matches"""
+    if catalog is not None:
+        return catalog.get().cluster_of_game_name(game_name)
+
+    def lookup():
+        return get_name_index().search(game_name, limit=1)[0].cluster
+    return cache.get_or_compute(('game_name', normalize_name(game_name)), lookup)
+
+
+def top_games_in_cluster(cluster, limit=None, offset=0, filters=None):
+    """Returns the top games in a cluster from the precomputed cluster_top_games table
+
+    The table answers every page within its first CLUSTER_TOP_N games, and every page of clusters with fewer games
+    than that (it holds them all). Falls back to sorting the cluster in the boardgames table if cluster_top_games
+    hasn't been built yet, or if the requested page goes beyond the games materialized in it.
+    filters ({column: (low, high)}, see src/filters.py) are answered from the in-memory filter bitmaps
+    with SERVING_BACKEND = 'memory', and with WHERE clauses on the boardgames table otherwise.
+    """
+    limit = limit or app.config["MAX_ROWS_SHOW"]
+    if catalog is not None:
+        return catalog.get().top_games_in_cluster(cluster, limit, offset, filters)
+
+    def lookup():
+        top_n = app.config["CLUSTER_TOP_N"]
+        if not filters and offset < top_n:
+            games = db.session.query(ClusterTopGame).filter(ClusterTopGame.cluster == cluster).order_by(ClusterTopGame.rank).offset(offset).limit(limit).all()
+            # A short page is complete if the table ran out before top_n games, i.e. it holds the whole cluster;
+            # no rows at all means cluster_top_games hasn't been built (yet)
+            if games and (len(games) == limit or offset + len(games) < top_n):
+                return [{column: getattr(game, column) for column in DISPLAY_COLUMNS} for game in games]
+        query = db.session.query(Boardgame).filter(Boardgame.cluster == cluster)
+        for column, (low, high) in (filters or {}).items():
+            query = query.filter(getattr(Boardgame, column).isnot(None))
+            if low is not None:
+                query = query.filter(getattr(Boardgame, column) >= low)
+            if high is not None:
+                query = query.filter(getattr(Boardgame, column) <= high)
+        games = query.order_by(Boardgame.score.desc(), Boardgame.game_id).offset(offset).limit(limit).all()
+        return [{column: getattr(game, column) for column in DISPLAY_COLUMNS} for game in games]
+    return cache.get_or_compute(('cluster', cluster, offset, limit, filters_key(filters)), lookup)
+
+
+def games_by_ids(game_ids):
+    """Returns the games with the given ids in the same order; unknown ids are left out"""
+    game_ids = [str(game_id) for game_id in game_ids]
+    if catalog is not None:
+        return catalog.get().games_by_ids(game_ids)
+
+    def lookup():
+        games = {game.game_id: game for game in db.session.query(Boardgame).filter(Boardgame.game_id.in_(game_ids)).all()}
+        return [{column: getattr(games[game_id], column) for column in DISPLAY_COLUMNS} for game_id in game_ids if game_id in games]
+    return cache.get_or_compute(('games',) + tuple(game_ids), lookup)
+
+
+def neighbours_from_db(game_ids, k, nprobe=None):
+    """Returns {game_id: [(similar game_id, distance), ...]} with at most k games each from the game_neighbours table
+
+    Same interface as `SimilarityIndex.neighbours()`; nprobe is ignored because the neighbours are precomputed.
+    """
+    def lookup(game_id):
+        rows = db.session.query(GameNeighbour.neighbour_id, GameNeighbour.distance).filter(GameNeighbour.game_id == game_id).order_by(GameNeighbour.rank).limit(k).all()
+        return [(neighbour_id, distance) for neighbour_id, distance in rows]
+
+    neighbours = {}
+    for game_id in map(str, game_ids):
+        game_neighbours = cache.get_or_compute(('neighbours', game_id, k), lambda: lookup(game_id))
+        if game_neighbours:
+            neighbours[game_id] = game_neighbours
+    return neighbours
+
+
+# Backend for the JSON API handlers shared with asgi.py (see src/recommend.py).
+# The functions above already dispatch to the in-memory catalog when SERVING_BACKEND = 'memory'
+backend = SimpleNamespace(cluster_of_game_id=cluster_of_game_id,
+                          cluster_of_game_name=cluster_of_game_name,
+                          clusters_of_game_ids=clusters_of_game_ids,
+                          top_games_in_cluster=top_games_in_cluster,
+                          games_by_ids=games_by_ids)
+
+
+def api_response(payload, status=200):
+    """Returns payload as compact JSON with an ETag, answering 304 Not Modified if the client's copy is current"""
+    response = jsonify(payload)
+    response.status_code = status
+    if status == 200:
+        response.add_etag()
+        response.headers['Cache-Control'] = f'public, max-age={app.config["API_CACHE_MAX_AGE"]}'
+        response.make_conditional(request)
+    return response
+
 
 @app.route('/')
 def index():
-    """Main view that lists top 10 boardgames by rating in the database.
+    """Main view that lists top 10 boardgames by ranking score in the database.
 
     Create view into index page that uses data queried from Track database and
     inserts it into the msiapp/templates/index.html template.
@@ -31,13 +343,17 @@ def index():
         rendered html template
     """
     try:
-        games = db.session.query(Boardgame).order_by(Boardgame.average_user_rating.desc()).limit(app.config["MAX_ROWS_SHOW"]).all()
+        if catalog is not None:
+            logger.debug("Index page accessed")
+            return render_template('index.html', games=catalog.get().top_games(app.config["MAX_ROWS_SHOW"]))
+
+        def render_index():
+            games = db.session.query(Boardgame).order_by(Boardgame.score.desc(), Boardgame.game_id).limit(app.config["MAX_ROWS_SHOW"]).all()
+            return render_template('index.html', games=games)
         logger.debug("Index page accessed")
-        return render_template('index.html', games=games)
+        return cache.get_or_compute(('index',), render_index)
     except:
-        traceback.print_exc()
-        logger.warning("Not able to display boardgames, error page returned")
-        return render_template('error.html')
+        return error_page()
 
 
 @app.route('/add', methods=['POST'])
@@ -46,44 +362,103 @@ def show_cluster_or_id():
 
     User can input game_id, game_name, or cluster_Id.
     In each case, the Guru will retur the top 10 games in the cluster related to the entity specified by the user input.
+    Optional age, min_year/max_year and min_complexity/max_complexity fields filter those games (see src/filters.py).
 
     :return: redirect to index page
     """
-    # If game_id is provided => find the cluster for that game and return top 10 games by user rating in that cluster
+    # If game_id is provided => find the cluster for that game and return top 10 games by ranking score in that cluster
     if request.form.get('game_id'):
         try:
-            cluster = db.session.query(Boardgame.cluster).filter(Boardgame.game_id == request.form['game_id']).all()
-            cluster = cluster[0][0]
-            games = db.session.query(Boardgame).filter(Boardgame.cluster == cluster).order_by(Boardgame.average_user_rating.desc()).limit(app.config["MAX_ROWS_SHOW"]).all()
+            cluster = cluster_of_game_id(request.form['game_id'].strip())
+            if cluster is None:  # The game exists but wasn't clustered, so there is nothing to recommend
+                return render_template('index.html', games=[], message=UNCLUSTERED_MESSAGE)
+            games = top_games_in_cluster(cluster, filters=parse_filters(request.form))
             logger.debug("Returning 10 games")
             return render_template('index.html', games=games)
         except:
-            traceback.print_exc()
-            logger.warning("Not able to display boardgames, error page returned")
-            return render_template('error.html')
-    # If game_name is provided => find the cluster for the first game with a name LIKE the provided one. Return top 10 games by user rating in that cluster
+            return error_page()
+    # If game_name is provided => find the cluster for the best matching game name (ranked by relevance, then popularity). Return top 10 games by ranking score in that cluster
     elif request.form.get('game_name'):
         try:
-            search_name = f"%{request.form.get('game_name')}%"
-            cluster = db.session.query(Boardgame.cluster).filter(Boardgame.name.like(search_name)).first()
-            cluster = cluster[0]
-            games = db.session.query(Boardgame).filter(Boardgame.cluster == cluster).order_by(Boardgame.average_user_rating.desc()).limit(app.config["MAX_ROWS_SHOW"]).all()
+            cluster = cluster_of_game_name(request.form['game_name'])
+            if cluster is None:  # The game exists but wasn't clustered, so there is nothing to recommend
+                return render_template('index.html', games=[], message=UNCLUSTERED_MESSAGE)
+            games = top_games_in_cluster(cluster, filters=parse_filters(request.form))
             logger.debug("Returning 10 games")
             return render_template('index.html', games=games)
         except:
-            traceback.print_exc()
-            logger.warning("Not able to display boardgames, error page returned")
-            return render_template('error.html')
+            return error_page()
     # Finally, if game_cluster is provided, then return top 10 games in that cluster
     else:
         try:
-            games = db.session.query(Boardgame).filter(Boardgame.cluster == request.form['cluster_id']).order_by(Boardgame.average_user_rating.desc()).limit(app.config["MAX_ROWS_SHOW"]).all()
+            games = top_games_in_cluster(int(request.form['cluster_id']), filters=parse_filters(request.form))
             logger.debug("Returning 10 games")
             return render_template('index.html', games=games)
         except:
-            traceback.print_exc()
-            logger.warning("Not able to display boardgames, error page returned")
-            return render_template('error.html')
+            return error_page()
+
+
+@app.route('/api/recommendations')
+def api_recommendations():
+    """JSON version of /add for a single game_id, game_name or cluster_id query parameter, with the same optional filters
+
+    Returns the cluster and one page (page, per_page query parameters) of its top games by ranking score.
+    """
+    return api_response(*recommend.recommendations(backend, request.args, app.config))
+
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def api_recommendations_batch():
+    """Recommendations for many games in one request
+
+    Expects a JSON body like {"game_ids": ["13", "822"], "per_page": 10}. All clusters are resolved at once and
+    the top games of every distinct cluster are returned only once, keyed by cluster.
+    """
+    return api_response(*recommend.batch_recommendations(backend, request.get_json(silent=True), app.config))
+
+
+@app.route('/api/similar')
+def api_similar():
+    """The k games most similar to a game_id (k query parameter), by distance in the model's feature space
+
+    Unlike /api/recommendations the results are not restricted to the game's cluster.
+    """
+    index = similarity_index or (catalog is not None and catalog.get().neighbour_index)  # Registry versions bring their own
+    index = index or SimpleNamespace(neighbours=neighbours_from_db)
+    return api_response(*recommend.similar_games(backend, index, request.args, app.config))
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Returns the cache hit/miss counters and the current data version as JSON"""
+    return jsonify(data_version=data_version, cache=cache.stats())
+
+
+@app.route('/profile_stats')
+def profile_stats():
+    """Returns the calls, wall/CPU time and peak memory of this worker by endpoint as JSON
+
+    CPU time is that of the whole worker process, so with threaded workers it includes concurrent requests.
+    """
+    return jsonify(peak_rss_mb=profiling.peak_rss_mb(), endpoints=profiling.recorder.as_dict())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request latency histograms (total, SQL and template time), query counts, cache and pool metrics in the
+    Prometheus text format, merged over all workers if METRICS_DIR is set"""
+    if metrics_collector is not None:
+        metrics_collector.flush()
+        text = metrics.render(metrics_collector.snapshots())
+    else:
+        text = metrics.render([metrics.registry.snapshot([metric_samples])])
+    return Response(text, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/pool_stats')
+def pool_stats():
+    """Returns the connection pool state, checkout wait times and connection churn of this worker as JSON"""
+    return jsonify(pool_status(db.engine))
 
 
 if __name__ == '__main__':
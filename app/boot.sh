@@ -1,3 +1,11 @@
 #!/usr/bin/env bash
 
-python3 app.py
\ No newline at end of file
+# SERVER=dev runs Flask's single-threaded development server; the default is gunicorn (see config/gunicorn.conf.py)
+# SERVER=asgi runs only the async JSON API (asgi.py) with uvicorn
+if [ "${SERVER}" = "dev" ]; then
+    exec python3 app.py
+elif [ "${SERVER}" = "asgi" ]; then
+    exec uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers "${UVICORN_WORKERS:-2}"
+else
+    exec gunicorn -c config/gunicorn.conf.py app:app
+fi
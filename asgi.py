@@ -0,0 +1,150 @@
+"""Async (ASGI) variant of the JSON recommendation API in app.py
+
+Handlers never wait on the database: requests are answered from the in-memory catalog (see src/catalog.py),
+loaded from the active version of MODEL_REGISTRY_PATH, from CATALOG_SNAPSHOT_PATH or, if neither is set, from the
+boardgames table. A background task checks for new snapshots every CATALOG_CHECK_SECONDS in a thread, so the event
+loop is never blocked by a reload.
+The request handling logic (parameter parsing, pagination, batch lookups) is shared with app.py via src/recommend.py.
+
+Run with e.g.:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+
+import asyncio
+import contextlib
+import logging.config
+
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Route
+
+import config.flaskconfig as flaskconfig
+from src.schema import DataVersion
+from src import recommend
+from src.catalog import Catalog, ReloadingCatalog
+from src.db import get_engine
+from src.neighbours import PrecomputedNeighbours
+from src.ranking import load_ranking_weights
+from src.registry import ModelRegistry
+from src.similarity import SimilarityIndex
+
+logging.config.fileConfig(flaskconfig.LOGGING_CONFIG, disable_existing_loggers=False)
+logger = logging.getLogger(flaskconfig.APP_NAME + '.asgi')
+
+# Same settings as the Flask app
+config = {key: getattr(flaskconfig, key) for key in dir(flaskconfig) if key.isupper()}
+
+
+def load_catalog_from_db():
+    """Builds the in-memory catalog from the boardgames table"""
+    session = sessionmaker(bind=get_engine(config["SQLALCHEMY_DATABASE_URI"]))()
+    try:
+        return Catalog.from_session(session, ranking_weights)
+    finally:
+        session.close()
+
+
+def catalog_version_from_db():
+    """Returns the data version stamp written by ingest.py, which tells the catalog when to reload"""
+    session = sessionmaker(bind=get_engine(config["SQLALCHEMY_DATABASE_URI"]))()
+    try:
+        return session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+    finally:
+        session.close()
+
+
+# Snapshots without scores (games_clustered.json) are ranked with the same weights ingest.py scores the database with
+ranking_weights = load_ranking_weights(config["RANKING_CONFIG_PATH"])
+if config["MODEL_REGISTRY_PATH"]:
+    catalog = ReloadingCatalog.from_registry(ModelRegistry(config["MODEL_REGISTRY_PATH"]), config["MODEL_VERSION"],
+                                             config["CATALOG_CHECK_SECONDS"], ranking_weights)
+elif config["CATALOG_SNAPSHOT_PATH"]:
+    catalog = ReloadingCatalog.from_json(config["CATALOG_SNAPSHOT_PATH"], config["CATALOG_CHECK_SECONDS"],
+                                         ranking_weights)
+else:
+    catalog = ReloadingCatalog(load_catalog_from_db, catalog_version_from_db, config["CATALOG_CHECK_SECONDS"])
+
+# "Games like this one": searched in a similarity index at request time, or looked up in precomputed neighbour lists
+if config["SIMILARITY_INDEX_PATH"]:
+    similarity_index = SimilarityIndex.load(config["SIMILARITY_INDEX_PATH"])
+elif config["NEIGHBOURS_PATH"]:
+    similarity_index = PrecomputedNeighbours.from_json(config["NEIGHBOURS_PATH"])
+else:
+    similarity_index = None
+
+
+async def watch_catalog():
+    """Periodically reloads the catalog in a worker thread when a new snapshot appears (or retries a failed load)"""
+    while True:
+        await asyncio.sleep(config["CATALOG_CHECK_SECONDS"])
+        try:
+            await run_in_threadpool(catalog.get)
+        except Exception as e:  # Keep watching; requests are answered with 503 until a catalog is loaded
+            logger.error(f"Could not load the catalog, will retry in {config['CATALOG_CHECK_SECONDS']} seconds. Got error: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Loads the catalog before accepting requests and keeps it up to date while serving"""
+    try:
+        await run_in_threadpool(catalog.reload)
+    except Exception as e:
+        logger.error(f"Could not load the catalog at startup, will retry in the background. Got error: {e}")
+    watcher = asyncio.create_task(watch_catalog())
+    yield
+    watcher.cancel()
+
+
+def json_response(request, payload, status):
+    """Returns payload as compact JSON with an ETag, answering 304 Not Modified if the client's copy is current"""
+    body = recommend.dump_json(payload)
+    if status != 200:
+        return Response(body, status_code=status, media_type='application/json')
+
+    tag = recommend.etag(body)
+    headers = {'ETag': tag, 'Cache-Control': f'public, max-age={config["API_CACHE_MAX_AGE"]}'}
+    if tag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=200, media_type='application/json', headers=headers)
+
+
+def catalog_unavailable(request):
+    """503 response for requests arriving before the catalog could be loaded (the background task keeps retrying)"""
+    return json_response(request, {'error': 'The catalog is not loaded yet; try again shortly'}, 503)
+
+
+async def api_recommendations(request):
+    """Same as app.api_recommendations: one page of the top games in the cluster of a game_id, game_name or cluster_id"""
+    if catalog.catalog is None:
+        return catalog_unavailable(request)
+    payload, status = recommend.recommendations(catalog.catalog, request.query_params, config)
+    return json_response(request, payload, status)
+
+
+async def api_recommendations_batch(request):
+    """Same as app.api_recommendations_batch: recommendations for a JSON list of game_ids"""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if catalog.catalog is None:
+        return catalog_unavailable(request)
+    payload, status = recommend.batch_recommendations(catalog.catalog, body, config)
+    return json_response(request, payload, status)
+
+
+async def api_similar(request):
+    """Same as app.api_similar: the k games closest to a game_id in feature space"""
+    if catalog.catalog is None:
+        return catalog_unavailable(request)
+    index = similarity_index or catalog.catalog.neighbour_index  # Registry versions bring their own neighbour lists
+    payload, status = recommend.similar_games(catalog.catalog, index, request.query_params, config)
+    return json_response(request, payload, status)
+
+
+app = Starlette(routes=[Route('/api/recommendations', api_recommendations),
+                        Route('/api/recommendations/batch', api_recommendations_batch, methods=['POST']),
+                        Route('/api/similar', api_similar)],
+                lifespan=lifespan)
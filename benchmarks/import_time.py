@@ -0,0 +1,105 @@
+"""This module measures the cold start import time of every entry point and checks it against a budget
+
+Every entry point is imported in a fresh interpreter with `python -X importtime -c "import <module>"`, a few times
+(the best run counts, which leaves out disk cache misses), and the cumulative import time of the module (its own code
+plus everything it imports that the interpreter hadn't loaded yet) is compared with its budget in BUDGETS_MS. The
+heaviest imports of entry points over budget are listed, and the exit status is 1 if any entry point is over budget:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --entry_points ingest run --top 10
+
+The budgets leave room for slower machines; they are meant to catch a heavy import (pandas, scikit-learn, boto3)
+creeping into a module that doesn't need it, not small changes.
+"""
+
+import argparse
+import logging
+import logging.config
+import os
+import subprocess
+import sys
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+# Cold start import budget per entry point, in milliseconds
+BUDGETS_MS = {
+    'run': 250,  # run.py: the pipeline stages import pandas/scikit-learn when they run
+    'ingest': 600,  # ingest.py (create_db, ingest, rescore, ...): SQLAlchemy, but no NumPy or PyYAML
+    'src.schema': 500,  # The ORM models: SQLAlchemy only
+    'src.registry': 250,  # src/registry.py CLI (activate, rollback)
+    'app': 900,  # app.py: Flask, Flask-SQLAlchemy, the schema and NumPy, without ingest.py
+    'asgi': 900,  # asgi.py: Starlette, SQLAlchemy, the schema and NumPy
+}
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parses the `-X importtime` report into (module, self microseconds, cumulative microseconds, depth) tuples"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def import_time(module: str, repeat: int = 5) -> tuple:
+    """Best cumulative import time of module over repeat fresh interpreters
+
+    Returns:
+        (milliseconds, imports): The import time and the parsed report of the best run
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+        if result.returncode != 0:
+            raise RuntimeError(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+        imports = parse_importtime(result.stderr)
+        total = next(cumulative for name, _, cumulative, depth in imports if name == module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, imports)
+    return best[0] / 1000, best[1]
+
+
+def heaviest_imports(imports: list, module: str, top: int) -> list:
+    """The top direct imports of module by cumulative time, as (name, milliseconds)"""
+    direct = []
+    for name, _, cumulative, depth in reversed(imports):
+        if depth == 0 and name != module:
+            break  # Imports before the module's own block belong to the interpreter startup
+        if depth == 1:
+            direct.append((name, cumulative / 1000))
+    return sorted(direct, key=lambda item: -item[1])[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the cold start import time of the entry points against their budgets")
+    parser.add_argument('--entry_points', nargs='*', default=list(BUDGETS_MS), choices=list(BUDGETS_MS),
+                        help="Entry points to measure. Default: all")
+    parser.add_argument('--repeat', default=5, type=int, help="Fresh interpreters per entry point; the best counts. Default: 5")
+    parser.add_argument('--top', default=5, type=int, help="Number of heaviest imports listed per entry point over budget")
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'entry point':<16}{'import ms':>11}{'budget ms':>11}")
+    for module in args.entry_points:
+        milliseconds, imports = import_time(module, args.repeat)
+        print(f"{module:<16}{milliseconds:>11.0f}{BUDGETS_MS[module]:>11}{'  OVER BUDGET' if milliseconds > BUDGETS_MS[module] else ''}")
+        if milliseconds > BUDGETS_MS[module]:
+            over_budget.append((module, imports))
+
+    for module, imports in over_budget:
+        print(f'\nHeaviest imports of {module}:')
+        for name, milliseconds in heaviest_imports(imports, module, args.top):
+            print(f'  {name:<40}{milliseconds:>8.0f} ms')
+    if over_budget:
+        sys.exit(1)
@@ -0,0 +1,144 @@
+"""This module runs a simple HTTP load test against a running instance of the app
+
+It sends a fixed number of requests, spread over the index page and the three /add query types
+(game_id, game_name, cluster_id), with a pool of concurrent client threads. It reports throughput
+(requests/sec) and latency percentiles (p50/p95/p99), e.g. to compare the app with and without the cache
+(set CACHE_MAX_SIZE = 0 in config/flaskconfig.py for the baseline) or the development server with gunicorn:
+
+    python benchmarks/load_test.py --url http://0.0.0.0:5000 -n 2000 -c 16
+
+With --api it queries the JSON API instead, which is served by both app.py and asgi.py, e.g. to compare
+gunicorn with uvicorn at 500 concurrent clients:
+
+    python benchmarks/load_test.py --api --url http://0.0.0.0:5000 -n 10000 -c 500
+"""
+
+import argparse
+import logging
+import logging.config
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float('nan')
+    rank = max(int(round(q / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def build_requests(base_url: str, game_ids: list, game_names: list, clusters: list) -> list:
+    """Returns the (label, url, form data) request templates for the index page and the three /add query types"""
+    templates = [('index', base_url + '/', None)]
+    templates += [('game_id', base_url + '/add', {'game_id': game_id}) for game_id in game_ids]
+    templates += [('game_name', base_url + '/add', {'game_name': name}) for name in game_names]
+    templates += [('cluster_id', base_url + '/add', {'cluster_id': cluster}) for cluster in clusters]
+    return templates
+
+
+def build_api_requests(base_url: str, game_ids: list, game_names: list, clusters: list) -> list:
+    """Returns the (label, url, None) request templates for the three query types of the JSON API
+
+    Both app.py and asgi.py serve these, so this compares the Flask and the async server.
+    """
+    url = base_url + '/api/recommendations?'
+    templates = [('game_id', url + urllib.parse.urlencode({'game_id': game_id}), None) for game_id in game_ids]
+    templates += [('game_name', url + urllib.parse.urlencode({'game_name': name}), None) for name in game_names]
+    templates += [('cluster_id', url + urllib.parse.urlencode({'cluster_id': cluster}), None) for cluster in clusters]
+    return templates
+
+
+def send(url: str, form: dict, timeout: float) -> float:
+    """Sends one request and returns its latency in seconds; raises on HTTP/connection errors"""
+    data = urllib.parse.urlencode(form).encode() if form is not None else None
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, data=data, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_load_test(templates: list, n_requests: int, concurrency: int, timeout: float = 30, seed: int = 0) -> dict:
+    """Sends n_requests randomly drawn from templates using `concurrency` client threads
+
+    Returns:
+        results (`dict`): label -> list of latencies in seconds, plus 'errors' count and 'elapsed' wall time
+    """
+    rng = random.Random(seed)
+    plan = [rng.choice(templates) for _ in range(n_requests)]
+    latencies = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(request):
+        label, url, form = request
+        try:
+            latency = send(url, form, timeout)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            latencies.setdefault(label, []).append(latency)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, plan))
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        logger.warning(f'{len(errors)} requests failed, e.g. {errors[0]}')
+    return {'latencies': latencies, 'errors': len(errors), 'elapsed': elapsed}
+
+
+def summarize(results: dict) -> str:
+    """Formats throughput (requests/sec) and latency percentiles (in ms) per request type and overall"""
+    lines = [f"{'route':<12}{'count':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"]
+    all_latencies = []
+    for label, values in sorted(results['latencies'].items()) + [('ALL', None)]:
+        values = sorted(all_latencies if values is None else values)
+        if label != 'ALL':
+            all_latencies.extend(values)
+        lines.append(f"{label:<12}{len(values):>8}{len(values) / results['elapsed']:>10.1f}" +
+                     ''.join(f"{percentile(values, q) * 1000:>10.2f}" for q in (50, 95, 99, 100)))
+    completed = len(all_latencies)
+    lines.append(f"{completed} requests in {results['elapsed']:.2f}s: {completed / results['elapsed']:.1f} requests/sec, "
+                 f"{results['errors']} errors")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # Setup CLI argument parser
+    parser = argparse.ArgumentParser(description="Load tests the index page and the /add route of a running app")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', type=str, help="Base url of the running app")
+    parser.add_argument('-n', '--requests', default=1000, type=int, help="Total number of requests to send")
+    parser.add_argument('-c', '--concurrency', default=8, type=int, help="Number of concurrent client threads")
+    parser.add_argument('--game_ids', nargs='*', default=['174430', '13', '9209', '30549', '822'],
+                        help="Game ids to query via /add")
+    parser.add_argument('--game_names', nargs='*', default=['Gloomhaven', 'Catan', 'Ticket to Ride', 'Pandemic'],
+                        help="Game names to query via /add")
+    parser.add_argument('--clusters', nargs='*', default=['0', '17', '42', '101', '249'],
+                        help="Cluster ids to query via /add")
+    parser.add_argument('--timeout', default=30, type=float, help="Per-request timeout in seconds")
+    parser.add_argument('--api', default=False, action='store_true',
+                        help="Query the JSON API instead of the HTML routes, e.g. to compare app.py with asgi.py")
+    args = parser.parse_args()
+
+    build = build_api_requests if args.api else build_requests
+    templates = build(args.url.rstrip('/'), args.game_ids, args.game_names, args.clusters)
+    logger.info(f'Sending {args.requests} requests to {args.url} with {args.concurrency} concurrent clients')
+    results = run_load_test(templates, args.requests, args.concurrency, args.timeout)
+    print(summarize(results))
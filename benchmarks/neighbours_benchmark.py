@@ -0,0 +1,49 @@
+"""This module times the precomputation of neighbour lists in src/neighbours.py for growing catalogs
+
+It generates random standardized feature matrices (the real one has ~17k games and ~170 features) and reports the
+wall time and the peak size of the distance blocks for each number of games, e.g. to check that 100k games stay
+within memory and that the time grows with n^2 / n_jobs:
+
+    python -m benchmarks.neighbours_benchmark --n_games 10000 25000 50000 100000 --block_size 1024 --n_jobs 4
+"""
+
+import argparse
+import logging
+import logging.config
+import os
+import time
+
+import numpy as np
+
+from src.neighbours import top_k_neighbours
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the top K neighbour precomputation for growing numbers of games")
+    parser.add_argument('--n_games', nargs='*', default=[10000, 25000, 50000, 100000], type=int,
+                        help="Numbers of games to time")
+    parser.add_argument('--n_features', default=170, type=int, help="Number of features per game")
+    parser.add_argument('-k', default=10, type=int, help="Number of neighbours per game")
+    parser.add_argument('--block_size', default=1024, type=int, help="Number of games compared at once")
+    parser.add_argument('--n_jobs', default=None, type=int, help="Number of threads. Default: number of CPUs")
+    args = parser.parse_args()
+
+    n_jobs = args.n_jobs or os.cpu_count()
+    rng = np.random.default_rng(0)
+    print(f"{'games':>8}{'seconds':>10}{'games/s':>10}{'block MB':>10}")
+    for n_games in args.n_games:
+        X = rng.standard_normal((n_games, args.n_features), dtype=np.float32)
+        start = time.perf_counter()
+        top_k_neighbours(X, args.k, args.block_size, n_jobs)
+        seconds = time.perf_counter() - start
+        block_mb = n_jobs * min(args.block_size, n_games) ** 2 * 4 / 1e6
+        print(f"{n_games:>8}{seconds:>10.1f}{n_games / seconds:>10.0f}{block_mb:>10.1f}")
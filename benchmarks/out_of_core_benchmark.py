@@ -0,0 +1,137 @@
+"""This module benchmarks standardizing and clustering memory mapped feature matrices (run.py --memmap_dir)
+
+For each number of games it generates synthetic feature data (benchmarks/synthetic_games.generate_features()) and runs
+the out-of-core steps of model.py on it, one after the other:
+- write_feature_matrix: the features DataFrame to a float32 .npy file
+- standardize: the two streaming passes of fit_standardizer_out_of_core()
+- fit_minibatch_kmeans: MiniBatchKMeans reading random batches of the memory mapped matrix
+- centroid_distances: chunk by chunk over the matrix
+
+Per step it reports the wall time and the peak anonymous memory of the process above what it held before the step
+(sampled from /proc/self/status, so Linux only). Pages of the memory mapped files are not counted: they are page
+cache the kernel evicts when memory gets tight, which is what lets a matrix larger than RAM be clustered.
+With --compare the in-memory path (fit_standardizer() + KMeans) runs on the same data for the inertia ratio of
+MiniBatchKMeans and KMeans; use it on sizes that fit in memory.
+
+    python -m benchmarks.out_of_core_benchmark --n_games 100000 --compare
+    python -m benchmarks.out_of_core_benchmark --n_games 5000000 --k 250
+"""
+
+import argparse
+import logging
+import logging.config
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import src.model as md
+from benchmarks.synthetic_games import generate_features
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+
+def anonymous_rss_mb() -> float:
+    """Resident memory of the process that isn't backed by a file (heap, arrays) in MB, or None if unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        return None
+
+
+class MemorySampler:
+    """Samples anonymous_rss_mb() in a background thread and keeps the peak since the last reset()"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = anonymous_rss_mb() or 0.0
+        threading.Thread(target=self._sample, name='memory-sampler', daemon=True).start()
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, anonymous_rss_mb() or 0.0)
+            time.sleep(self.interval)
+
+    def reset(self) -> float:
+        """Restarts the peak at the current memory, which is returned"""
+        self.peak = anonymous_rss_mb() or 0.0
+        return self.peak
+
+
+def measure(results: list, sampler: MemorySampler, name: str, n_games: int, func):
+    """Runs func() and appends its wall time and peak extra anonymous memory to results; returns func's result"""
+    baseline = sampler.reset()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    time.sleep(2 * sampler.interval)
+    results.append({'step': name, 'n_games': n_games, 'seconds': seconds, 'extra_mb': sampler.peak - baseline})
+    logger.info(f'{name}[{n_games}]: {seconds:.1f}s, {sampler.peak - baseline:.0f} MB above {baseline:.0f} MB')
+    return result
+
+
+def benchmark(n_games: int, k: int, seed: int, batch_size: int, chunk_size: int, directory: str, compare: bool,
+              sampler: MemorySampler) -> list:
+    """Runs the out-of-core steps (and with compare the in-memory ones) on n_games synthetic games"""
+    results = []
+    features = generate_features(n_games, seed)
+    raw_X = measure(results, sampler, 'write_feature_matrix', n_games,
+                    lambda: md.write_feature_matrix(features, os.path.join(directory, 'features.npy'),
+                                                    chunk_size=chunk_size))
+    if not compare:
+        del features
+    X, _ = measure(results, sampler, 'standardize', n_games,
+                   lambda: md.fit_standardizer_out_of_core(raw_X, os.path.join(directory, 'X.npy'), chunk_size))
+    model = measure(results, sampler, 'fit_minibatch_kmeans', n_games,
+                    lambda: md.fit_minibatch_kmeans(X, k, seed, batch_size))
+    measure(results, sampler, 'centroid_distances', n_games, lambda: md.centroid_distances(X, model, chunk_size))
+
+    if compare:
+        X_in_memory, _ = measure(results, sampler, 'in_memory standardize', n_games, lambda: md.fit_standardizer(features))
+        kmeans = measure(results, sampler, 'in_memory fit_kmeans', n_games, lambda: md.fit_kmeans(X_in_memory, k, seed))
+        minibatch_inertia = float(((X_in_memory - model.cluster_centers_[model.labels_]) ** 2).sum())
+        logger.info(f'MiniBatchKMeans inertia is {minibatch_inertia / kmeans.inertia_:.3f}x the KMeans inertia')
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks out-of-core standardization and MiniBatchKMeans on memory mapped synthetic features")
+    parser.add_argument('--n_games', nargs='*', default=[100000, 1000000], type=int,
+                        help="Numbers of games to benchmark, e.g. 1000000 5000000. Default: 100000 1000000")
+    parser.add_argument('--k', default=250, type=int, help="Number of clusters. Default: 250")
+    parser.add_argument('--seed', default=28, type=int, help="Random seed of the data and the clustering")
+    parser.add_argument('--batch_size', default=4096, type=int, help="Games per MiniBatchKMeans step. Default: 4096")
+    parser.add_argument('--chunk_size', default=100000, type=int, help="Games read at once. Default: 100000")
+    parser.add_argument('--directory', default=None, type=str,
+                        help="Directory for the .npy files (needs n_games x 142 x 8 bytes). Default: a temporary directory")
+    parser.add_argument('--compare', action='store_true',
+                        help="Also run the in-memory standardization and KMeans, and compare the inertia")
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix='out-of-core-')
+    os.makedirs(directory, exist_ok=True)
+    sampler = MemorySampler()
+    results = []
+    try:
+        for n_games in args.n_games:
+            logger.info(f'Benchmarking {n_games} games')
+            results += benchmark(n_games, args.k, args.seed, args.batch_size, args.chunk_size, directory,
+                                 args.compare, sampler)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'step':<28}{'games':>10}{'seconds':>10}{'extra MB':>10}")
+    for result in results:
+        print(f"{result['step']:<28}{result['n_games']:>10}{result['seconds']:>10.1f}{result['extra_mb']:>10.0f}")
@@ -0,0 +1,190 @@
+"""This module benchmarks how the pipeline steps and the app scale with the number of games
+
+For each number of games it generates synthetic BGG-shaped games (see benchmarks/synthetic_games.py) and measures
+wall time, CPU time and the peak memory allocated by (tracemalloc, so it's per function, unlike the process' peak RSS):
+- featurize_categories, featurize_mechanics: featurize.wrapper() for the two list-valued columns
+- extract_stats: featurize.extract_stats()
+- fit_kmeans, evaluate_silhouette: model.py (the silhouette score is O(n^2) and skipped above --max_silhouette games)
+- ingest: ingest.ingest_games() into a fresh SQLite database
+- route /, route /api/recommendations, route /add: app.py requests against that database (cache cleared first)
+
+Results are printed as a table and can be saved as a JSON report (--report), which a later run compares against
+(--baseline), printing every function that got more than --threshold slower or hungrier and exiting with status 1:
+
+    python -m benchmarks.pipeline_benchmark --n_games 1000 17000 --report benchmarks/baseline.json
+    python -m benchmarks.pipeline_benchmark --n_games 1000 17000 --baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline_benchmark --n_games 100000 1000000 --functions featurize_categories extract_stats
+
+Baselines are only comparable on the same machine.
+"""
+
+import argparse
+import logging
+import logging.config
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+import pandas as pd
+import yaml
+
+from benchmarks.synthetic_games import generate_games
+from src import profiling
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+FUNCTIONS = ['featurize_categories', 'featurize_mechanics', 'extract_stats', 'fit_kmeans', 'evaluate_silhouette',
+             'ingest', 'route /', 'route /api/recommendations', 'route /add']
+
+# Compared against the baseline; peak_alloc_mb is the tracemalloc peak of the function
+METRICS = ('wall_seconds', 'cpu_seconds', 'peak_alloc_mb')
+
+
+def measure(recorder: profiling.StageRecorder, name: str, func, trace_memory: bool = True, rows: int = None):
+    """Times func() as stage name, then reruns it under tracemalloc for its peak allocation (tracing slows it down)
+
+    Returns:
+        result: return value of the timed call
+    """
+    with profiling.stage(name, rows=rows, stage_recorder=recorder):
+        result = func()
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        recorder.stages[name]['peak_alloc_mb'] = peak / 2 ** 20
+    logger.info(f"{name}: {recorder.stages[name]['wall_seconds']:.2f}s")
+    return result
+
+
+def benchmark_pipeline(recorder, n_games: int, config: dict, functions: list, max_silhouette: int,
+                       trace_memory: bool, db_path: str):
+    """Runs the selected pipeline functions on n_games synthetic games; returns the clustered games DataFrame"""
+    import ingest
+    import src.featurize as ft
+    import src.model as md
+
+    games = pd.DataFrame(generate_games(n_games))
+    index_categories = config['featurize']['index_categories']
+    index_mechanics = config['featurize']['index_mechanics']
+
+    def run(name, func):
+        if name in functions:
+            return measure(recorder, f'{name}[{n_games}]', func, trace_memory, n_games)
+        return func()
+
+    df = run('featurize_categories', lambda: ft.wrapper(games, 'categories', index_categories))
+    df = run('featurize_mechanics', lambda: ft.wrapper(df, 'mechanics', index_mechanics))
+    df = run('extract_stats', lambda: ft.extract_stats(df.copy()))
+
+    features_df = md.extract_features(df)
+    X, _ = md.fit_standardizer(features_df)
+    k = min(config['model']['kmeans']['k'], n_games)
+    model = run('fit_kmeans', lambda: md.fit_kmeans(X, k, config['model']['kmeans']['seed']))
+    if 'evaluate_silhouette' in functions:
+        if n_games <= max_silhouette:
+            run('evaluate_silhouette', lambda: md.evaluate_silhouette(X, model.labels_))
+        else:
+            logger.info(f'Skipping evaluate_silhouette for {n_games} games (more than --max_silhouette)')
+
+    clustered = md.combine_with_labels(df, model.labels_)
+    clustered['centroid_distance'] = md.centroid_distances(X, model)
+
+    def ingest_games():
+        session = ingest.get_session(engine_string=f'sqlite:///{db_path}')
+        ingest.Base.metadata.create_all(session.get_bind())
+        ingest.ingest_games(session, clustered, config.get('ranking'), truncate=True)
+        session.close()
+
+    if 'ingest' in functions or any(function.startswith('route') for function in functions):
+        run('ingest', ingest_games)
+    return clustered
+
+
+def benchmark_routes(recorder, n_games: int, clustered: pd.DataFrame, functions: list, n_requests: int):
+    """Times n_requests requests per route of app.py (via its test client) against the ingested games"""
+    import app
+
+    client = app.app.test_client()
+    app.cache.clear()
+    app.name_index = None
+    app.data_version_checked_at = float('-inf')
+    rng = random.Random(0)
+    game_ids = [str(game_id) for game_id in rng.sample(list(clustered['id']), min(n_requests, len(clustered)))]
+    names = list(clustered.set_index(clustered['id'].astype(str)).loc[game_ids, 'name'])
+    routes = {'route /': lambda: [client.get('/') for _ in range(n_requests)],
+              'route /api/recommendations': lambda: [client.get(f'/api/recommendations?game_name={name}') for name in names],
+              'route /add': lambda: [client.post('/add', data={'game_id': game_id}) for game_id in game_ids]}
+    for name, requests in routes.items():
+        if name in functions:
+            measure(recorder, f'{name}[{n_games}]', requests, trace_memory=False, rows=n_requests)
+            app.cache.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline steps and app routes on synthetic games of growing size")
+    parser.add_argument('--n_games', nargs='*', default=[1000, 17000], type=int,
+                        help="Numbers of games to benchmark, e.g. 1000 17000 100000 1000000. Default: 1000 17000")
+    parser.add_argument('--functions', nargs='*', default=FUNCTIONS, choices=FUNCTIONS, help="Functions to benchmark. Default: all")
+    parser.add_argument('-c', '--config', default='config/config.yml', type=str,
+                        help="Path to .yml (YAML) config file with the featurize and model settings. Default: config/config.yml")
+    parser.add_argument('--max_silhouette', default=20000, type=int,
+                        help="Skip the silhouette score for more games than this (it grows with n^2). Default: 20000")
+    parser.add_argument('--requests', default=200, type=int, help="Number of requests per route. Default: 200")
+    parser.add_argument('--no_memory', dest='trace_memory', action='store_false',
+                        help="Don't rerun the functions under tracemalloc to measure their peak allocation")
+    parser.add_argument('--report', default=None, type=str, help="Path to save the results as a JSON report, e.g. a new baseline")
+    parser.add_argument('--baseline', default=None, type=str, help="Path of a report of an earlier run to compare with")
+    parser.add_argument('--threshold', default=0.25, type=float,
+                        help="Relative increase that counts as a regression. Default: 0.25")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+    except FileNotFoundError as e:
+        logger.error(f"Could not load configurations file, didn't find it at {args.config} and threw error {e}")
+        logger.error('Terminating process prematurely')
+        sys.exit()
+
+    # app.py connects to the database in SQLALCHEMY_DATABASE_URI when it's imported, so every size reuses one file
+    db_path = os.path.join(tempfile.mkdtemp(prefix='benchmark-'), 'boardgames.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+
+    recorder = profiling.StageRecorder()
+    for n_games in args.n_games:
+        logger.info(f'Benchmarking {n_games} games')
+        clustered = benchmark_pipeline(recorder, n_games, config, args.functions, args.max_silhouette,
+                                       args.trace_memory, db_path)
+        benchmark_routes(recorder, n_games, clustered, args.functions, args.requests)
+
+    report = profiling.build_report({'n_games': args.n_games, 'functions': args.functions}, recorder)
+    print(f"{'function':<40}{'wall s':>9}{'cpu s':>9}{'alloc MB':>10}{'rows/s':>12}")
+    for name, stats in report['stages'].items():
+        alloc = stats.get('peak_alloc_mb')
+        print(f"{name:<40}{stats['wall_seconds']:>9.2f}{stats['cpu_seconds']:>9.2f}"
+              f"{'' if alloc is None else f'{alloc:.1f}':>10}{stats['rows'] / max(stats['wall_seconds'], 1e-9):>12.0f}")
+    if args.report:
+        profiling.write_report(args.report, report['metadata'], recorder)
+
+    if args.baseline:
+        baseline = profiling.load_report(args.baseline)
+        if baseline is None:
+            logger.error(f'Could not load the baseline report {args.baseline}')
+            sys.exit(1)
+        found = profiling.regressions(baseline, report, args.threshold, min_seconds=0.05, metrics=METRICS)
+        for regression in found:
+            print(f'REGRESSION {regression}')
+        if found:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
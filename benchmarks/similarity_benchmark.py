@@ -0,0 +1,89 @@
+"""This module benchmarks recall and latency of the "games like this one" index in src/similarity.py
+
+For exact search and a range of nprobe values (KMeans partitions scanned per query) it reports:
+- recall@k: fraction of the exact k nearest neighbours the search returns
+- p50/p99 latency of single queries, as served by /api/similar
+- throughput of batch queries (queries/sec)
+
+It runs against an index saved by model.py/run.py, or against synthetic clustered data of a given size:
+
+    python -m benchmarks.similarity_benchmark --index models/similarity.npz
+    python -m benchmarks.similarity_benchmark --n_games 17000 --n_features 170 --n_clusters 250
+"""
+
+import argparse
+import logging
+import logging.config
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from src.similarity import SimilarityIndex, recall_at_k
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+
+def synthetic_index(n_games: int, n_features: int, n_clusters: int, seed: int = 0) -> SimilarityIndex:
+    """Builds an index over standardized random data drawn around n_clusters centers, partitioned with KMeans"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, n_features))
+    X = centers[rng.integers(n_clusters, size=n_games)] + rng.normal(scale=1.0, size=(n_games, n_features))
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    start = time.perf_counter()
+    kmeans = KMeans(n_clusters=n_clusters, n_init=1, max_iter=50, random_state=seed).fit(X)
+    logger.info(f'Fitted KMeans with {n_clusters} clusters on {n_games} x {n_features} data in {time.perf_counter() - start:.1f}s')
+    return SimilarityIndex.from_kmeans(range(n_games), X, kmeans)
+
+
+def benchmark(index: SimilarityIndex, k: int, nprobes: list, n_queries: int, seed: int = 0) -> list:
+    """Returns one result dictionary (nprobe, recall, latency percentiles, batch throughput) per nprobe value"""
+    rng = np.random.default_rng(seed)
+    queries = index.X[rng.choice(len(index), size=min(n_queries, len(index)), replace=False)]
+    results = []
+    for nprobe in nprobes:
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, k, nprobe)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.search(queries, k, nprobe)
+        batch_seconds = time.perf_counter() - start
+        results.append({'nprobe': nprobe or 'exact',
+                        'recall': recall_at_k(index, queries, k, nprobe) if nprobe else 1.0,
+                        'p50_ms': np.percentile(latencies, 50) * 1000,
+                        'p99_ms': np.percentile(latencies, 99) * 1000,
+                        'batch_qps': len(queries) / batch_seconds})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks recall and latency of exact and approximate similar game search")
+    parser.add_argument('--index', default=None, type=str,
+                        help="Path to an index saved by model.py/run.py (e.g. models/similarity.npz). Default: synthetic data")
+    parser.add_argument('--n_games', default=17000, type=int, help="Number of synthetic games")
+    parser.add_argument('--n_features', default=170, type=int, help="Number of synthetic features")
+    parser.add_argument('--n_clusters', default=250, type=int, help="Number of KMeans clusters for synthetic data")
+    parser.add_argument('-k', default=10, type=int, help="Number of neighbours per query")
+    parser.add_argument('--nprobes', nargs='*', default=[1, 2, 4, 8, 16, 32, 0], type=int,
+                        help="Partitions scanned per query; 0 is exact search")
+    parser.add_argument('--queries', default=500, type=int, help="Number of query games")
+    args = parser.parse_args()
+
+    if args.index:
+        index = SimilarityIndex.load(args.index)
+    else:
+        index = synthetic_index(args.n_games, args.n_features, args.n_clusters)
+
+    print(f"{'nprobe':>8}{'recall@' + str(args.k):>12}{'p50 ms':>10}{'p99 ms':>10}{'batch q/s':>12}")
+    for result in benchmark(index, args.k, args.nprobes, args.queries):
+        print(f"{result['nprobe']:>8}{result['recall']:>12.3f}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+              f"{result['batch_qps']:>12.0f}")
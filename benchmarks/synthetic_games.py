@@ -0,0 +1,189 @@
+"""This module generates synthetic games shaped like the raw BoardGameGeek data written by src/acquire.py
+
+The games have the same keys, in the same order, as acquire.convert_game_to_dict(), so they can be fed to
+src/featurize.py, src/model.py, ingest.py or run.py in place of data/games.json. The distributions mimic the real
+data rather than being uniform:
+- categories and mechanics: lists of 1-6 (categories) or 1-8 (mechanics) values drawn from 83 categories and 51
+  mechanics with a long tail of rare ones (popularity ~ 1 / rank^0.9). Every category and mechanic is used at least
+  once, since featurize.py relies on the number of category columns (index_mechanics in config.yml)
+- stats: the nested dictionary of the BGG API (usersrated, average, bayesaverage, numweights, averageweight, owned,
+  ..., ranks), with a heavy tailed number of ratings and a bayes average shrunk towards 5.5 for rarely rated games
+- descriptions of a few hundred to a few thousand characters (log normal lengths), designers, artists, publishers
+
+Generating is deterministic for a seed. Write a file to run the pipeline on, e.g. 100k games:
+
+    python -m benchmarks.synthetic_games -n 100000 -o data/synthetic_games.json
+
+generate_features() skips the raw games and directly generates the feature data model.py clusters (the output of
+model.extract_features()) with the same distributions, vectorized, so millions of games take seconds.
+"""
+
+import argparse
+import json
+import logging
+import logging.config
+
+import numpy as np
+import pandas as pd
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+# Number of distinct values in the data the config was written for; featurize.py's index_mechanics depends on it
+N_CATEGORIES = 83
+N_MECHANICS = 51
+
+WORDS = ('players', 'game', 'cards', 'board', 'turn', 'each', 'tiles', 'dice', 'victory', 'points', 'resources',
+         'build', 'trade', 'empire', 'city', 'explore', 'ancient', 'space', 'war', 'strategy', 'cooperative',
+         'heroes', 'dungeon', 'worker', 'placement', 'deck', 'market', 'railroad', 'farm', 'castle', 'the', 'a',
+         'and', 'to', 'of', 'in', 'their', 'with', 'must', 'score', 'round', 'action', 'draw', 'play', 'win')
+
+
+def _popularity(n_values: int, exponent: float = 0.9) -> np.ndarray:
+    """Probabilities of n_values values with a long tail: the value of rank r is drawn with probability ~ 1 / r^exponent"""
+    weights = 1 / np.arange(1, n_values + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _pick_lists(rng, n_games: int, values: list, mean_length: float, max_length: int) -> list:
+    """Per game list of distinct values (1 to max_length) drawn by popularity; every value is used at least once"""
+    lengths = np.clip(1 + rng.poisson(mean_length - 1, size=n_games), 1, max_length)
+    draws = rng.choice(len(values), size=(n_games, max_length), p=_popularity(len(values)))
+    lists = [[values[i] for i in dict.fromkeys(row[:length])] for row, length in zip(draws, lengths)]
+    for i, value in enumerate(values):
+        game = lists[i % n_games]
+        if value not in game:
+            game.append(value)
+    return lists
+
+
+def generate_games(n_games: int, seed: int = 0, n_categories: int = N_CATEGORIES, n_mechanics: int = N_MECHANICS) -> list:
+    """Generates n_games raw games as dictionaries (see the module docstring)
+
+    Args:
+        n_games (`int`): Number of games
+        seed (`int`): Random seed; the same seed gives the same games
+        n_categories (`int`), n_mechanics (`int`): Number of distinct categories and mechanics
+
+    Returns:
+        games (`list`): Dictionaries with the keys of acquire.convert_game_to_dict()
+    """
+    if n_games < max(n_categories, n_mechanics):
+        logger.warning(f'{n_games} games are too few to use all {n_categories} categories and {n_mechanics} mechanics; '
+                       f'the featurize index_mechanics of config.yml won\'t match')
+    rng = np.random.default_rng(seed)
+    categories = _pick_lists(rng, n_games, [f'Category {i}' for i in range(n_categories)], 2.4, 6)
+    mechanics = _pick_lists(rng, n_games, [f'Mechanic {i}' for i in range(n_mechanics)], 2.8, 8)
+
+    users_rated = (30 + rng.lognormal(4.5, 1.5, size=n_games)).astype(int)
+    average = np.clip(rng.normal(6.8, 0.9, size=n_games), 1, 10)
+    bayes_average = (average * users_rated + 5.5 * 100) / (users_rated + 100)
+    num_weights = (users_rated * rng.uniform(0.03, 0.15, size=n_games)).astype(int)
+    average_weight = np.where(num_weights > 0, np.clip(rng.normal(2.3, 0.8, size=n_games), 1, 5), 0.0)
+    owned = (users_rated * rng.uniform(1.2, 2.5, size=n_games)).astype(int)
+    years = np.clip(2020 - rng.exponential(10, size=n_games), 1900, 2020).astype(int)
+    min_ages = rng.choice([0, 6, 8, 10, 12, 13, 14, 16, 18], p=[.05, .05, .2, .2, .25, .08, .1, .05, .02], size=n_games)
+    stddev = rng.uniform(0.8, 2.0, size=n_games)
+    ranks = np.argsort(np.argsort(-bayes_average)) + 1
+
+    # Descriptions are slices of one long text, so generating a million of them stays fast
+    corpus = ' '.join(rng.choice(WORDS, size=200000))
+    lengths = np.clip(rng.lognormal(6.8, 0.6, size=n_games), 100, 20000).astype(int)
+    starts = rng.integers(0, len(corpus) - lengths.max(), size=n_games) if len(corpus) > lengths.max() else np.zeros(n_games, int)
+
+    n_people = max(n_games // 3, 10)
+    designers = rng.integers(0, n_people, size=(n_games, 3))
+    artists = rng.integers(0, n_people, size=(n_games, 3))
+    publishers = rng.integers(0, max(n_games // 10, 10), size=(n_games, 6))
+    n_designers = rng.integers(1, 4, size=n_games)
+    n_artists = rng.integers(0, 4, size=n_games)
+    n_publishers = rng.integers(1, 7, size=n_games)
+
+    games = []
+    for i in range(n_games):
+        game_id = i + 1
+        games.append({
+            'id': game_id,
+            'name': f'Synthetic Game {game_id}',
+            'stats': {'usersrated': int(users_rated[i]), 'average': float(average[i]),
+                      'bayesaverage': float(bayes_average[i]), 'stddev': float(stddev[i]),
+                      'median': 0.0, 'owned': int(owned[i]), 'trading': int(owned[i] // 40),
+                      'wanting': int(owned[i] // 60), 'wishing': int(owned[i] // 8),
+                      'numcomments': int(users_rated[i] // 4), 'numweights': int(num_weights[i]),
+                      'averageweight': float(average_weight[i]),
+                      'ranks': [{'id': 1, 'name': 'boardgame', 'friendlyname': 'Board Game Rank',
+                                 'value': int(ranks[i])}]},
+            'image': f'https://cf.geekdo-images.com/original/img/{game_id}.jpg',
+            'thumbnail': f'https://cf.geekdo-images.com/thumb/img/{game_id}.jpg',
+            'artists': [f'Artist {j}' for j in artists[i, :n_artists[i]]],
+            'designers': [f'Designer {j}' for j in designers[i, :n_designers[i]]],
+            'year': int(years[i]),
+            'description': corpus[starts[i]:starts[i] + lengths[i]],
+            'categories': categories[i],
+            'mechanics': mechanics[i],
+            'min_age': int(min_ages[i]),
+            'publishers': [f'Publisher {j}' for j in publishers[i, :n_publishers[i]]],
+        })
+    return games
+
+
+def generate_features(n_games: int, seed: int = 0, n_categories: int = N_CATEGORIES, n_mechanics: int = N_MECHANICS,
+                      chunk_size: int = 1000000) -> pd.DataFrame:
+    """Generates the feature data of n_games games, shaped like model.extract_features() of the featurized games
+
+    Args:
+        n_games (`int`): Number of games
+        seed (`int`): Random seed; the same seed gives the same features
+        n_categories (`int`), n_mechanics (`int`): Number of distinct categories and mechanics
+        chunk_size (`int`): Games generated at once, which bounds the temporary memory
+
+    Returns:
+        features (`pd.DataFrame`): year, min_age, uint8 category and mechanic flags and the stats columns
+    """
+    rng = np.random.default_rng(seed)
+    flags = np.zeros((n_games, n_categories + n_mechanics), dtype=np.uint8)
+    for start in range(0, n_games, chunk_size):
+        end = min(start + chunk_size, n_games)
+        for offset, n_values, mean_length, max_length in ((0, n_categories, 2.4, 6), (n_categories, n_mechanics, 2.8, 8)):
+            lengths = np.clip(1 + rng.poisson(mean_length - 1, size=end - start), 1, max_length)
+            draws = rng.choice(n_values, size=(end - start, max_length), p=_popularity(n_values))
+            listed = np.arange(max_length) < lengths[:, np.newaxis]
+            flags[start + np.nonzero(listed)[0], offset + draws[listed]] = 1
+
+    users_rated = (30 + rng.lognormal(4.5, 1.5, size=n_games)).astype(np.int32)
+    average = np.clip(rng.normal(6.8, 0.9, size=n_games), 1, 10)
+    num_weights = (users_rated * rng.uniform(0.03, 0.15, size=n_games)).astype(np.int32)
+    columns = {
+        'year': np.clip(2020 - rng.exponential(10, size=n_games), 1900, 2020).astype(np.uint16),
+        'min_age': rng.choice(np.array([0, 6, 8, 10, 12, 13, 14, 16, 18], dtype=np.uint8),
+                              p=[.05, .05, .2, .2, .25, .08, .1, .05, .02], size=n_games),
+        **{f'categories_Category {i}': flags[:, i] for i in range(n_categories)},
+        **{f'mechanics_Mechanic {i}': flags[:, n_categories + i] for i in range(n_mechanics)},
+        'number_of_user_ratings': users_rated,
+        'average_user_rating': average,
+        'number_of_user_weight_ratings': num_weights,
+        'average_user_weight_rating': np.where(num_weights > 0, np.clip(rng.normal(2.3, 0.8, size=n_games), 1, 5), 0.0),
+        'bayes_average': (average * users_rated + 5.5 * 100) / (users_rated + 100),
+        'number_of_users_own': (users_rated * rng.uniform(1.2, 2.5, size=n_games)).astype(np.int32),
+    }
+    return pd.DataFrame(columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes synthetic games shaped like data/games.json")
+    parser.add_argument('-n', '--n_games', default=17000, type=int, help="Number of games. Default: 17000")
+    parser.add_argument('-o', '--output', default='data/synthetic_games.json', type=str,
+                        help="Path of the json file to write. Default: data/synthetic_games.json")
+    parser.add_argument('--seed', default=0, type=int, help="Random seed")
+    args = parser.parse_args()
+
+    games = generate_games(args.n_games, args.seed)
+    with open(args.output, 'w') as fp:
+        json.dump(games, fp)
+    logger.info(f'Saved {len(games)} synthetic games to {args.output}')
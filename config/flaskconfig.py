@@ -6,8 +6,51 @@ PORT = 5000
 APP_NAME = "Boardgame_Recommendations_App"
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 HOST = "0.0.0.0"
-SQLALCHEMY_ECHO = True  # If true, SQL for queries made will be printed
+SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO', 'false').lower() == 'true'  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 10
+CACHE_MAX_SIZE = 2048  # Max number of cached lookups/pages in app.py; 0 disables the cache
+CACHE_TTL_SECONDS = 3600
+DATA_VERSION_CHECK_SECONDS = 30  # How often app.py polls the data_version stamp written by ingest.py
+
+# JSON API (/api/recommendations)
+API_MAX_PER_PAGE = 100
+# Number of top games per cluster precomputed into cluster_top_games by ingest.py. The API asks for per_page + 1 games
+# (the extra one tells whether there is a next page), so the first page of any per_page is served from the table
+CLUSTER_TOP_N = API_MAX_PER_PAGE + 1
+API_MAX_BATCH_SIZE = 1000  # Max number of game ids in one /api/recommendations/batch request
+API_CACHE_MAX_AGE = 60  # Seconds clients may reuse a response before revalidating it with its ETag
+
+# "Games like this one" (/api/similar): app.py reads the game_neighbours table precomputed by src/neighbours.py,
+# asgi.py the neighbour lists in NEIGHBOURS_PATH (e.g. data/game_neighbours.json). If SIMILARITY_INDEX_PATH is set
+# (e.g. models/similarity.npz, saved by model.py/run.py), both search that index at request time instead
+SIMILARITY_INDEX_PATH = os.environ.get('SIMILARITY_INDEX_PATH')
+NEIGHBOURS_PATH = os.environ.get('NEIGHBOURS_PATH')
+SIMILARITY_NPROBE = int(os.environ.get('SIMILARITY_NPROBE', 8))  # KMeans partitions scanned per query; 0 searches all games exactly
+
+# Serving backend: 'sql' queries the database on cache misses; 'memory' loads the whole catalog into memory at startup
+SERVING_BACKEND = os.environ.get('SERVING_BACKEND', 'sql')
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')  # e.g. data/games_clustered.json; if not set, load from the database
+CATALOG_CHECK_SECONDS = 30  # How often the in-memory catalog checks for a new snapshot
+# The in-memory catalog scores unscored snapshots with the `ranking` weights of this file, like ingest.py does
+RANKING_CONFIG_PATH = os.environ.get('RANKING_CONFIG_PATH', 'config/config.yml')
+# With SERVING_BACKEND = 'memory', serve the active version of a model registry (see src/registry.py, e.g. models/registry)
+# instead of CATALOG_SNAPSHOT_PATH; activating another version is picked up within CATALOG_CHECK_SECONDS.
+# MODEL_VERSION pins the app to one registered version regardless of which one is active
+MODEL_REGISTRY_PATH = os.environ.get('MODEL_REGISTRY_PATH')
+MODEL_VERSION = os.environ.get('MODEL_VERSION')
+
+# Prometheus metrics at /metrics (see src/metrics.py). With several worker processes, every worker writes its metrics to
+# METRICS_DIR every METRICS_FLUSH_SECONDS and /metrics merges them; config/gunicorn.conf.py sets a default
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+
+# Connection pool settings, shared by app.py and ingest.py via src/db.py (not applied to SQLite).
+# Every gunicorn worker has its own pool, so the database sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # Replace connections older than this (keep below MySQL wait_timeout)
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'  # Transparently replace connections dropped by RDS
 
 # Connection string
 DB_HOST = os.environ.get('MYSQL_HOST')
@@ -0,0 +1,58 @@
+"""Gunicorn settings for serving app.py in production (used by app/boot.sh)
+
+Run with:
+    gunicorn -c config/gunicorn.conf.py app:app
+
+The app is preloaded in the master process, so the in-memory catalog (SERVING_BACKEND=memory) and other
+module-level data are loaded once and shared copy-on-write by all workers.
+
+Sending SIGHUP to the master (`make reload_app`) gracefully reloads the data: the master reloads the catalog,
+starts fresh workers from it and lets the old workers finish their in-flight requests.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))  # > 1 uses the gthread worker
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))  # Recycle workers after this many requests; 0 disables
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+accesslog = os.environ.get('GUNICORN_ACCESSLOG')  # e.g. '-' for stdout; off by default to keep the hot path lean
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+# Workers share their request metrics through this directory, so /metrics reports all of them (see src/metrics.py).
+# Set before the app is preloaded, which reads it from config/flaskconfig.py
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'boardgame_metrics'))
+
+
+def on_starting(server):
+    """Removes the metrics snapshots of workers of a previous server run"""
+    from src.metrics import clear_directory
+
+    clear_directory(os.environ['METRICS_DIR'])
+
+
+def on_reload(server):
+    """Reloads the in-memory catalog in the master before new workers are forked on SIGHUP"""
+    import app
+
+    if app.catalog is not None:
+        server.log.info('Reloading catalog before restarting workers')
+        app.catalog.reload()
+
+
+def post_fork(server, worker):
+    """Drops database connections inherited from the master, so workers never share a socket"""
+    import app
+
+    with app.app.app_context():
+        try:
+            app.db.engine.dispose(close=False)
+        except TypeError:  # SQLAlchemy < 1.4.33 has no close argument
+            app.db.engine.dispose()
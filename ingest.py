@@ -2,6 +2,11 @@
 
 That database can either be a local SQLite or an AWS RDS MYSQL Instance.
 
+ingest_games() and persist_neighbours() also accept data straight from memory (e.g. the clustered DataFrame of run.py),
+so the pipeline can ingest without writing and re-parsing json files.
+
+The tables are defined in src/schema.py (re-exported here). NumPy (ranking) and PyYAML are only imported by the
+commands that score games, so `python ingest.py create_db` starts quickly.
 """
 
 import json
@@ -10,56 +15,27 @@ import argparse
 import logging
 import logging.config
 import sys
+import uuid
+from datetime import datetime
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, Float
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import InterfaceError, IntegrityError, ProgrammingError, ArgumentError
-from sqlalchemy.ext.declarative import declarative_base
-
-from config.flaskconfig import SQLALCHEMY_DATABASE_URI
 
-Base = declarative_base()
+from config.flaskconfig import SQLALCHEMY_DATABASE_URI, CLUSTER_TOP_N
+from src import profiling
+from src.db import get_engine
+from src.schema import Base, Boardgame, ClusterTopGame, GameNeighbour, DataVersion, TOP_GAME_COLUMNS, migrate
 
 logging_config='config/logging/local.conf'
 try: # Set Logging configurations from file
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except: # Fallback to basic configurations
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.DEBUG)
 logger = logging.getLogger(__file__)
 
-# Defining Table Schema
-class Boardgame(Base):
-    """ Defines the data model for the table `boardgames`. """
-
-    __tablename__ = 'boardgames'
-
-    # Need to add collation argument for two of the columns to avoid odd warnings when uploading to MySQL in RDS
-    # Those warnings are most likely related to UTF-8 characters which need 4 instead of 3 bytes to be stored.
-    # SQLAlchemy Documentation: https://docs.sqlalchemy.org/en/13/core/type_basics.html#sqlalchemy.types.String.__init__
-    # MySQL Documentation: https://dev.mysql.com/doc/refman/8.0/en/charset-unicode-utf8mb4.html
-    # StackOverflow Thread: https://stackoverflow.com/questions/10957238/incorrect-string-value-when-trying-to-insert-utf-8-into-mysql-via-jdbc
-
-    game_id = Column(String(100), primary_key=True, unique=True, nullable=False)
-    name = Column(String(200), unique=False, nullable=False) # Collation Needed
-    image = Column(String(150), unique=False, nullable=True)
-    thumbnail = Column(String(100), unique=False, nullable=True)
-    description = Column(Text, unique=False, nullable=True) # Collation Needed
-    year_published = Column(Integer, unique=False, nullable=True)
-    min_age = Column(Integer, unique=False, nullable=True)
-    number_of_ratings = Column(Integer, unique=False, nullable=True)
-    average_user_rating = Column(Float, unique=False, nullable=True)
-    number_of_ratings_weight = Column(Integer, unique=False, nullable=True)
-    average_user_rating_weight = Column(Float, unique=False, nullable=True)
-    bayes_average = Column(Float, unique=False, nullable=True)
-    number_of_users_own = Column(Integer, unique=False, nullable=True)
-    cluster = Column(Integer, unique=False, nullable=True)
-
-    def __repr__(self):
-        game_repr = f"<Boardgame(game_id={self.game_id}, name={self.name})>"
-        return game_repr
-
 ##############################
 ######### VALIDATION #########
 ##############################
@@ -81,6 +57,7 @@ def validate(games: list) -> list:
     expected_schema = {'id', 'name', 'image', 'thumbnail', 'artists', 'designers', 'year', 'description', 'categories',
                        'mechanics', 'min_age', 'publishers', 'number_of_user_weight_ratings', 'average_user_weight_rating',
                        'number_of_user_ratings', 'average_user_rating', 'bayes_average', 'number_of_users_own', 'cluster'}
+    optional_schema = {'centroid_distance'}  # Written by model.py since the ranking score was introduced
     unexpected_schema_count=0
     invalid_game_id=0
     missing_name=0
@@ -95,7 +72,7 @@ def validate(games: list) -> list:
     for game in games:
 
         # Check if game schema is valid
-        if game.keys() != expected_schema:
+        if game.keys() - optional_schema != expected_schema:
             logger.debug(f"Encountered a game, which doesn't match expected schema")
             unexpected_schema_count += 1
             continue
@@ -150,6 +127,9 @@ def validate(games: list) -> list:
 def create_db(args):
     """Create a DB if it doesn't exist and a table inside based on the defined SQLAlchemy ORM
 
+    Tables of an existing database get the columns and indexes added to the ORM since they were created, see
+    schema.migrate()
+
     Args:
         args: command line arguments; expecting engine_string
 
@@ -160,13 +140,13 @@ def create_db(args):
     # Define Engine
     logger.debug(f'Creating engine from Engine String')
     try:
-        engine = create_engine(args.engine_string)
+        engine = get_engine(args.engine_string)
     except ArgumentError as e:
         logger.error(f'Could not establish engine. Is the engine string empty? Got error: {e}')
         logger.error('Terminating Process prematurely')
         sys.exit()
-    # Create Database
-    Base.metadata.create_all(engine)
+    # Create Database, or add the tables and columns introduced since it was created
+    migrate(engine)
 
 def get_session(engine_string=None):
     """Returns a session to the provided SQL database
@@ -177,9 +157,9 @@ def get_session(engine_string=None):
     Returns:
         SQLAlchemy session
     """
-    logger.debug(f'Creating engine from Engine_string')
+    logger.debug(f'Getting shared engine for Engine_string')
     try:
-        engine = create_engine(engine_string)
+        engine = get_engine(engine_string)
     except ArgumentError as e:
         logger.error(f'Could not establish engine. Is the engine string empty? Got error: {e}')
         logger.error('Terminating Process prematurely')
@@ -189,26 +169,138 @@ def get_session(engine_string=None):
 
     return session
 
+def _migrate_schema(session):
+    """Creates the tables and adds the columns introduced since the database was created (e.g. cluster_top_games,
+    boardgames.score), see schema.migrate(); existing rows are left untouched"""
+    migrate(session.get_bind())
+
 def _truncate_boardgames(session):
-    """Deletes all entries in boardgames table if rerunning and run into unique key error."""
-    session.execute('''DELETE FROM boardgames''')
+    """Deletes all entries in boardgames (and the derived cluster_top_games) table if rerunning and run into unique key error."""
+    _migrate_schema(session)  # Databases created before cluster_top_games existed don't have it
+    session.execute(text('''DELETE FROM cluster_top_games'''))
+    session.execute(text('''DELETE FROM boardgames'''))
+
+def stamp_data_version(session):
+    """Writes a new random data version stamp, which tells running apps to drop their caches"""
+    # Not session.get(), which needs SQLAlchemy 1.4, nor Query.get(), which is legacy in 2.0
+    data_version = session.query(DataVersion).filter(DataVersion.id == 1).first() or DataVersion(id=1)
+    data_version.version = uuid.uuid4().hex
+    data_version.updated_at = datetime.utcnow()
+    session.add(data_version)
+    session.commit()
+    logger.info(f'Stamped data version {data_version.version}')
+
+##############################
+####### RANKING SCORE ########
+##############################
+
+def score_boardgames(session, weights: dict = None):
+    """Computes the ranking score of every game in the boardgames table and stores it in the score column
+
+    Args:
+        session: SQLAlchemy session to the database
+        weights (`dict`): Weight per score component, see src/ranking.py. Default: DEFAULT_WEIGHTS
+
+    Returns:
+        None; updates boardgames.score
+    """
+    from src.ranking import SCORE_COLUMNS, score_games
+
+    columns = [getattr(Boardgame, column) for column in SCORE_COLUMNS]
+    games = [row._asdict() for row in session.query(*columns)]
+    scores = score_games(games, weights)
+
+    session.bulk_update_mappings(Boardgame, [{'game_id': game['game_id'], 'score': float(score)}
+                                             for game, score in zip(games, scores)])
+    session.commit()
+    logger.info(f'Persisted scores of {len(games)} games to boardgames')
+
+##############################
+#### CLUSTER TOP N TABLE #####
+##############################
+
+def rank_cluster_top_games(games: list, top_n: int) -> list:
+    """Ranks the games within each cluster by score (see src/ranking.py) and keeps the top N
+
+    Args:
+        games (`list`): Games as dictionaries with the `boardgames` column names (at least TOP_GAME_COLUMNS and cluster)
+        top_n (`int`): Number of games to keep per cluster
+
+    Returns:
+        top_games (`list`): Dictionaries with cluster, rank (starting at 1) and TOP_GAME_COLUMNS
+    """
+    clusters = {}
+    for game in games:
+        if game['cluster'] is None:
+            continue
+        clusters.setdefault(game['cluster'], []).append(game)
+
+    top_games = []
+    for cluster, cluster_games in clusters.items():
+        # Highest score first; games without a score go last; game_id keeps the order deterministic
+        cluster_games.sort(key=lambda game: (game['score'] is None,
+                                             -(game['score'] or 0),
+                                             game['game_id']))
+        for rank, game in enumerate(cluster_games[:top_n], start=1):
+            top_game = {column: game[column] for column in TOP_GAME_COLUMNS}
+            top_game.update(cluster=cluster, rank=rank)
+            top_games.append(top_game)
+
+    return top_games
+
+
+def build_cluster_top_games(session, top_n: int = CLUSTER_TOP_N):
+    """(Re)builds the cluster_top_games table from the games currently in the boardgames table
+
+    Args:
+        session: SQLAlchemy session to the database
+        top_n (`int`): Number of games to materialize per cluster
+
+    Returns:
+        None; replaces the contents of cluster_top_games
+    """
+    logger.info(f'Building cluster_top_games with the top {top_n} games per cluster')
+    columns = [getattr(Boardgame, column) for column in TOP_GAME_COLUMNS + ['cluster']]
+    games = [row._asdict() for row in session.query(*columns)]
+
+    top_games = rank_cluster_top_games(games, top_n)
+
+    session.query(ClusterTopGame).delete()
+    session.bulk_insert_mappings(ClusterTopGame, top_games)
+    session.commit()
+    logger.info(f'Persisted {len(top_games)} rows to cluster_top_games')
 
 ##############################
 ####### INGEST TO DB #########
 ##############################
 
-def ingest(args):
-    """ Ingests games via session to a database"""
-    # Parsing arguments from command line: filepath of data to be ingested & session to use for ingesting
-    try:
-        with open(args.local_filepath) as json_file:
-            games=json.load(json_file)
-            logger.info(f"Successfully loaded data from {json_file.name}")
-    except JSONDecodeError:
-        logger.error(f'Failed to open {args.local_filepath}. Not a valid JSON file')
+def records_from_frame(df) -> list:
+    """Converts a pd.DataFrame of games (e.g. the clustered games of run.py) to dictionaries of plain Python values
 
-    logger.debug(f'Creating Session to DB Engine String: {args.engine_string}')
-    session=get_session(engine_string=args.engine_string)
+    NumPy scalars become int/float and missing values (NaN) become None, so they can be bound as SQL parameters.
+    """
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+def ingest_games(session, games, weights: dict = None, top_n: int = CLUSTER_TOP_N, truncate: bool = False):
+    """Persists games to the boardgames table, scores them and rebuilds cluster_top_games
+
+    Args:
+        session: SQLAlchemy session
+        games (`list` or `pd.DataFrame`): Clustered games (as in games_clustered.json)
+        weights (`dict`): Ranking weights (see src/ranking.py). Default: ranking.DEFAULT_WEIGHTS
+        top_n (`int`): Number of top games per cluster to materialize in cluster_top_games
+        truncate (`bool`): Delete the current games first, e.g. to replace the games of a previous run
+    """
+    if hasattr(games, 'to_dict'):  # A DataFrame, without importing pandas here
+        games = records_from_frame(games)
+
+    # Databases created before the score columns, cluster_top_games and data_version existed are migrated first
+    _migrate_schema(session)
+    if truncate:
+        _truncate_boardgames(session)
+        session.commit()
+        logger.info("boardgames table truncated.")
 
     # Use the validate() function from above to check input
     games=validate(games)
@@ -237,7 +329,8 @@ def ingest(args):
                                   average_user_rating_weight=game['average_user_weight_rating'],
                                   bayes_average=game['bayes_average'],
                                   number_of_users_own=game['number_of_users_own'],
-                                  cluster=game['cluster'])
+                                  cluster=game['cluster'],
+                                  centroid_distance=game.get('centroid_distance'))
             session.add(boardgame)
             successfully_added += 1
 
@@ -273,6 +366,81 @@ def ingest(args):
 
     logger.info(f"Successfully added to session {successfully_added} games")
     logger.info(f"Failed to add to session {not_added} games")
+
+    # Score the whole catalog at once, then precompute the per-cluster top N so the app doesn't sort clusters on every request
+    with profiling.stage('score_boardgames'):
+        score_boardgames(session, weights)
+    with profiling.stage('build_cluster_top_games'):
+        build_cluster_top_games(session, top_n)
+    stamp_data_version(session)
+
+
+def ingest(args):
+    """ Ingests games via session to a database"""
+    from src.ranking import load_ranking_weights  # NumPy and PyYAML are only imported by the commands that score games
+
+    # Parsing arguments from command line: filepath of data to be ingested & session to use for ingesting
+    try:
+        with open(args.local_filepath) as json_file:
+            games=json.load(json_file)
+            logger.info(f"Successfully loaded data from {json_file.name}")
+    except JSONDecodeError:
+        logger.error(f'Failed to open {args.local_filepath}. Not a valid JSON file')
+
+    logger.debug(f'Creating Session to DB Engine String: {args.engine_string}')
+    session=get_session(engine_string=args.engine_string)
+
+    with profiling.stage('ingest', rows=len(games)):
+        ingest_games(session, games, load_ranking_weights(args.config), args.top_n)
+    session.close()
+    profiling.write_report(metadata={'script': 'ingest', 'n_games': len(games)})
+
+
+def build_top_games(args):
+    """Rebuilds cluster_top_games from the boardgames table without re-ingesting the games"""
+    session = get_session(engine_string=args.engine_string)
+    build_cluster_top_games(session, args.top_n)
+    stamp_data_version(session)
+    session.close()
+
+
+def rescore(args):
+    """Recomputes the ranking scores (e.g. after changing the weights in config.yml) and rebuilds cluster_top_games
+
+    Doesn't re-cluster or re-ingest the games.
+    """
+    from src.ranking import load_ranking_weights
+
+    session = get_session(engine_string=args.engine_string)
+    score_boardgames(session, load_ranking_weights(args.config))
+    build_cluster_top_games(session, args.top_n)
+    stamp_data_version(session)
+    session.close()
+
+
+def persist_neighbours(session, neighbours: list):
+    """Replaces the contents of game_neighbours with neighbour records (see src/neighbours.py neighbour_records())"""
+    session.query(GameNeighbour).delete()
+    for start in range(0, len(neighbours), 10000):
+        session.bulk_insert_mappings(GameNeighbour, neighbours[start:start + 10000])
+    session.commit()
+    logger.info(f'Persisted {len(neighbours)} rows to game_neighbours')
+    stamp_data_version(session)
+
+
+def ingest_neighbours(args):
+    """Replaces the contents of game_neighbours with the neighbour lists computed by src/neighbours.py"""
+    try:
+        with open(args.local_filepath) as json_file:
+            neighbours = json.load(json_file)
+            logger.info(f"Successfully loaded neighbour lists from {json_file.name}")
+    except (FileNotFoundError, JSONDecodeError) as e:
+        logger.error(f'Failed to load neighbour lists from {args.local_filepath}. Got error: {e}')
+        logger.error('Terminating Process prematurely')
+        sys.exit()
+
+    session = get_session(engine_string=args.engine_string)
+    persist_neighbours(session, neighbours)
     session.close()
 
 if __name__ == "__main__":
@@ -294,8 +462,38 @@ if __name__ == "__main__":
     sb_ingest.add_argument("-t", "--truncate", default=False, action="store_true",
                         help="If given, delete current records from boardgames table before ingesting new data "
                              "so that table can be recreated without unique id issues ")
+    sb_ingest.add_argument("-n", "--top_n", default=CLUSTER_TOP_N, type=int,
+                           help="Number of top games per cluster to materialize in cluster_top_games")
+    sb_ingest.add_argument("-c", "--config", default="./config/config.yml",
+                           help="Path to .yml (YAML) config file with the ranking weights")
     sb_ingest.set_defaults(func=ingest)
 
+    # Sub-parser for rebuilding the materialized top N games per cluster
+    sb_top_games = subparsers.add_parser("build_top_games", description="Rebuild cluster_top_games from boardgames")
+    sb_top_games.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                              help="SQLAlchemy connection URI for database")
+    sb_top_games.add_argument("-n", "--top_n", default=CLUSTER_TOP_N, type=int,
+                              help="Number of top games per cluster to materialize in cluster_top_games")
+    sb_top_games.set_defaults(func=build_top_games)
+
+    # Sub-parser for recomputing the ranking scores without re-clustering
+    sb_rescore = subparsers.add_parser("rescore", description="Recompute ranking scores and rebuild cluster_top_games")
+    sb_rescore.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                            help="SQLAlchemy connection URI for database")
+    sb_rescore.add_argument("-c", "--config", default="./config/config.yml",
+                            help="Path to .yml (YAML) config file with the ranking weights")
+    sb_rescore.add_argument("-n", "--top_n", default=CLUSTER_TOP_N, type=int,
+                            help="Number of top games per cluster to materialize in cluster_top_games")
+    sb_rescore.set_defaults(func=rescore)
+
+    # Sub-parser for ingesting the precomputed similar games
+    sb_neighbours = subparsers.add_parser("ingest_neighbours", description="Replace game_neighbours with precomputed neighbour lists")
+    sb_neighbours.add_argument("-lfp", "--local_filepath", default="./data/game_neighbours.json",
+                               help="Path to neighbour lists computed by src/neighbours.py")
+    sb_neighbours.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                               help="SQLAlchemy connection URI for database")
+    sb_neighbours.set_defaults(func=ingest_neighbours)
+
     args = parser.parse_args()
 
     # Avoid error when using the create_db sub command
@@ -1,22 +1,39 @@
-""" This module combines steps from download.py, featurize.py, and model.py
+""" This module combines steps from download.py, featurize.py, model.py, and neighbours.py
 so that the model pipeline can be executed with a single docker run command.
 
 Data is downloaded from S3 bucket, features are created,
 and finally a KMeans algorithm is fit, generates labels, and is evaluated.
+The top K similar games of every game are precomputed in the model's feature space.
+
+The steps are stages of a pipeline DAG (see src/pipeline.py). Stage outputs are cached in --cache_dir, so a rerun only
+repeats the stages whose inputs or settings changed (e.g. changing k in config.yml skips the download and
+featurization), and independent stages run concurrently. A timing summary per stage is logged at the end.
+
+DataFrames and arrays are passed between stages in memory. With --ingest the clustered games and neighbour lists go
+straight into the database (no json round trip); the json/model files are checkpoints written in the background, and
+--no_checkpoints skips them altogether.
+
+With --memmap_dir the feature matrix never has to fit in memory: it is written to a memory mapped .npy file,
+standardized in two streaming passes and clustered with MiniBatchKMeans, which reads random batches of it.
+
+With --stream the raw data is parsed while it streams in from S3 (see src/storage.py), so featurization doesn't wait
+for a local copy to be written first.
+
+The stage functions import pandas, scikit-learn, boto3 and SQLAlchemy (via the src modules and ingest.py) when they
+first run, so `python run.py --help` or a mistyped option doesn't wait for them.
 """
 
 import logging
 import logging.config
+import os
 import argparse
 import yaml
 import sys
-import pandas as pd
 import json
-import pickle
 
-import src.download as dl
-import src.featurize as ft
-import src.model as md
+from config.flaskconfig import SQLALCHEMY_DATABASE_URI, CLUSTER_TOP_N
+from src import profiling
+from src.pipeline import Pipeline, Stage
 
 logging_config = './config/logging/local.conf'
 
@@ -28,11 +45,282 @@ except: # Fallback to basic configurations
                         level=logging.DEBUG)
 logger = logging.getLogger(__file__)
 
+# Settings of the out-of-core mode (--memmap_dir) that the config's model: out_of_core section doesn't set
+OUT_OF_CORE_DEFAULTS = {'chunk_size': 100000, 'batch_size': 4096, 'silhouette_sample_size': 50000}
+
+
+def download(local_filepath, bucket_name, key, stream=False, snapshot=False):
+    """Downloads the raw data from S3 (or keeps using the local copy if that fails) and loads it
+
+    With snapshot the current snapshot of key is downloaded, unless the local copy already has its content (see
+    src/storage.py). With stream the object is parsed as it streams in (decompressed if it is a snapshot or the key
+    ends in .gz or .zst), without writing local_filepath; the local copy is still loaded if S3 can't be reached
+    """
+    import src.download as dl
+    import src.featurize as ft
+    from src import storage
+
+    if stream:
+        try:
+            manifest = storage.read_manifest(bucket_name, key) if snapshot else None
+            if manifest is not None:  # Otherwise key hasn't been uploaded as a snapshot yet: stream the plain file
+                key = manifest['snapshot_key']
+            return ft.load_unfeaturized_data(f's3://{bucket_name}/{key}')
+        except Exception as err:  # Otherwise, rely on the local copy
+            logger.error(f'Failed to stream {key} from S3 bucket with error: {err}')
+            return ft.load_unfeaturized_data(local_filepath)
+    try:
+        dl.download_file_from_bucket(bucket_name=bucket_name, key=key, local_filepath=local_filepath, snapshot=snapshot)
+        logger.info(f'Successfully downloaded {key} from S3 bucket')
+    except Exception as err:  # Otherwise, rely on the local copy
+        logger.error(f'Failed to download {key} from S3 bucket with error: {err}')
+    return ft.load_unfeaturized_data(local_filepath)
+
+
+def raw_data_fingerprint(local_filepath, bucket_name, key, stream=False, snapshot=False):
+    """ETag of the raw data on S3 (the content hash of a snapshot), so the download is skipped while it is unchanged;
+    the local copy's hash if S3 can't be reached"""
+    import src.download as dl
+    from src.hashing import file_sha256
+
+    try:
+        return dl.object_etag(bucket_name, key, snapshot=snapshot)
+    except Exception as err:
+        logger.warning(f'Could not read the ETag of {key} on S3 and got error {err}. Fingerprinting {local_filepath} instead')
+        return file_sha256(local_filepath) if os.path.exists(local_filepath) else None
+
+
+def featurize(raw, index_categories, index_mechanics):
+    """One-hot encodes categories and mechanics and extracts the stats columns"""
+    import pandas as pd
+    import src.featurize as ft
+
+    # Convert the unfeaturized data dictionary to pandas DataFrame
+    df = pd.DataFrame(raw)
+
+    # Calling wrapper function to create categories features
+    featurized_categories_data = ft.wrapper(df, 'categories', index_categories)
+
+    # Calling wrapper function to create mechanics features
+    featurized_mechanics_data = ft.wrapper(featurized_categories_data, 'mechanics', index_mechanics)
+
+    # Extract relevant information from the 'stats' column (which contains dictionaries) into new columns, then drop it
+    return ft.compact_dtypes(ft.extract_stats(featurized_mechanics_data))
+
+
+def standardize(featurized, memmap_dir=None, chunk_size=100000):
+    """Extracts the feature columns and standardizes them; returns the features, feature matrix and fitted scaler
+
+    With memmap_dir the feature matrix is written to memmap_dir/features.npy and standardized out of core into
+    memmap_dir/X.npy, chunk_size games at a time; X is then memory mapped
+    """
+    import src.model as md
+
+    features = md.extract_features(featurized)
+    if memmap_dir is None:
+        X, scaler = md.fit_standardizer(features)
+    else:
+        os.makedirs(memmap_dir, exist_ok=True)
+        raw_X = md.write_feature_matrix(features, os.path.join(memmap_dir, 'features.npy'), chunk_size=chunk_size)
+        X, scaler = md.fit_standardizer_out_of_core(raw_X, os.path.join(memmap_dir, 'X.npy'), chunk_size)
+    return features, X, scaler
+
+
+def warm_start_fingerprint(warm_start):
+    """Hash of the warm start bundle's manifest (which has the sha256 of every array), so replacing or rolling back the
+    previous model reruns the fit; None without a warm start or if the bundle doesn't exist (the fit starts from scratch)"""
+    from src.hashing import file_sha256
+    from src.model_bundle import MANIFEST_FILENAME
+
+    manifest_path = os.path.join(warm_start, MANIFEST_FILENAME) if warm_start else None
+    return file_sha256(manifest_path) if manifest_path and os.path.exists(manifest_path) else None
+
+
+def fit(features, X, scaler, k, seed, warm_start, batch_size=None):
+    """Fits KMeans (MiniBatchKMeans with a batch_size), starting from the previous model's centroids when retraining;
+    returns the model, labels and retrain info"""
+    import src.model as md
+
+    init, previous_labels = None, None
+    if warm_start:
+        init, previous_labels = md.warm_start(warm_start, features, scaler, k)
+    if batch_size:
+        # MiniBatchKMeans labels all games at the end of the fit already
+        model = md.fit_minibatch_kmeans(X, k, seed, batch_size, init=init)
+        labels = model.labels_
+    else:
+        model = md.fit_kmeans(X, k, seed, init=init)
+        # Calculate labels for data
+        labels = md.model_predict(X, model)
+    retrain_metadata = {'warm_start': init is not None, 'n_iter': int(model.n_iter_)}
+    if previous_labels is not None:
+        retrain_metadata['changed_cluster'] = md.changed_clusters(previous_labels, labels)
+    return model, labels, retrain_metadata
+
+
+def evaluate(X, labels, sample_size=None):
+    """Silhouette score of the fitted model on the training data (estimated on sample_size games if given)"""
+    import src.model as md
+
+    return md.evaluate_silhouette(X, labels, sample_size)
+
+
+def label(featurized, X, model, labels):
+    """Combines the games with their clusters and the distances to the centroids (used by the ranking score)"""
+    import src.model as md
+
+    # Combining the original df with the labels and dropping unnecessary columns (now that the modelling is done)
+    df = md.combine_with_labels(featurized, labels)
+
+    # Distance to the cluster centroid, which the ranking score uses to prefer games typical for their cluster
+    df['centroid_distance'] = md.centroid_distances(X, model)
+    return df
+
+
+def similarity(featurized, X, model):
+    """Builds the "games like this one" index, which partitions the feature matrix by the KMeans clusters"""
+    from src.similarity import SimilarityIndex
+
+    return SimilarityIndex.from_kmeans(featurized['id'], X, model)
+
+
+def neighbours(index, k, block_size, n_jobs):
+    """Precomputes the top K similar games of every game, which ingest.py loads into the game_neighbours table"""
+    import src.neighbours as nb
+
+    rows, distances = nb.top_k_neighbours(index.X, k, block_size, n_jobs)
+    return nb.neighbour_records(index.game_ids, rows, distances)
+
+
+def save_clustered(clustered, output):
+    """Saves the final json data, which will be used for upload to database"""
+    with open(output, 'w') as fp:
+        json.dump(clustered.to_dict(orient='records'), fp)
+        logger.info(f'Saved final json data to {output}')
+    return output
+
+
+def save_model(model, scaler, features, silhouette, retrain_metadata, model_output):
+    """Saves the model bundle (centroids, scaler parameters and feature column order) and the silhouette score"""
+    from src.model_bundle import ModelBundle
+
+    bundle = ModelBundle.from_fit(model, scaler, features.columns,
+                                  {'n_games': len(features), 'silhouette_score': float(silhouette), **retrain_metadata})
+    bundle.save(model_output)
+
+    model_silhouette_path = model_output.rstrip('/') + '.txt'
+    with open(model_silhouette_path, "w") as text_file:
+        text_file.write(f"The model silhouette score is: {silhouette}")
+        logger.info(f'Saved silhouette score to {model_silhouette_path}')
+    return model_output
+
+
+def save_similarity(index, similarity_output):
+    """Saves the similarity index"""
+    index.save(similarity_output)
+    return similarity_output
+
+
+def save_neighbours(neighbour_records, neighbours_output):
+    """Saves the neighbour lists for ingest.py"""
+    with open(neighbours_output, 'w') as fp:
+        json.dump(neighbour_records, fp)
+        logger.info(f'Saved neighbour lists to {neighbours_output}')
+    return neighbours_output
+
+
+def register(model_path, data_path, similarity_path, neighbours_path, registry, activate):
+    """Registers the outputs as a new version, which the app can switch to (and roll back from) without a re-ingest"""
+    from src.registry import ModelRegistry
+
+    model_registry = ModelRegistry(registry)
+    version = model_registry.register({'model': model_path, 'data': data_path,
+                                       'similarity': similarity_path, 'neighbours': neighbours_path})
+    if activate:
+        model_registry.activate(version)
+
+
+def ingest_games(clustered, engine_string, weights, top_n):
+    """Replaces the games in the database with the clustered games, straight from the DataFrame"""
+    import ingest as ig
+
+    session = ig.get_session(engine_string=engine_string)
+    try:
+        ig.ingest_games(session, clustered, weights, top_n, truncate=True)
+    finally:
+        session.close()
+
+
+def ingest_neighbours(neighbour_records, engine_string):
+    """Replaces the game_neighbours table with the neighbour lists"""
+    import ingest as ig
+
+    session = ig.get_session(engine_string=engine_string)
+    try:
+        ig.persist_neighbours(session, neighbour_records)
+    finally:
+        session.close()
+
+
+def build_pipeline(args, config) -> list:
+    """Returns the stages of the model pipeline for the parsed CLI arguments and config"""
+    download_params = {'local_filepath': args.local_filepath, **config['download'], 'stream': args.stream}
+    standardize_params, fit_params, evaluate_params = {}, {}, {}
+    if args.memmap_dir:
+        out_of_core = {**OUT_OF_CORE_DEFAULTS, **config['model'].get('out_of_core', {})}
+        standardize_params = {'memmap_dir': args.memmap_dir, 'chunk_size': out_of_core['chunk_size']}
+        fit_params = {'batch_size': out_of_core['batch_size']}
+        evaluate_params = {'sample_size': out_of_core['silhouette_sample_size']}
+    stages = [
+        Stage('download', download, outputs=['raw'], params=download_params,
+              fingerprint=lambda: raw_data_fingerprint(**download_params)),
+        Stage('featurize', featurize, inputs=['raw'], outputs=['featurized'], params=config['featurize']),
+        # Out of core, X is memory mapped: the .npy files are its checkpoint, caching would pickle it into memory
+        Stage('standardize', standardize, inputs=['featurized'], outputs=['features', 'X', 'scaler'],
+              params=standardize_params, cache=not args.memmap_dir),
+        Stage('fit', fit, inputs=['features', 'X', 'scaler'], outputs=['model', 'labels', 'retrain_metadata'],
+              params={**config['model']['kmeans'], 'warm_start': args.warm_start, **fit_params},
+              fingerprint=lambda: warm_start_fingerprint(args.warm_start)),
+        Stage('evaluate', evaluate, inputs=['X', 'labels'], outputs=['silhouette'], params=evaluate_params),
+        Stage('label', label, inputs=['featurized', 'X', 'model', 'labels'], outputs=['clustered']),
+        Stage('similarity', similarity, inputs=['featurized', 'X', 'model'], outputs=['index'],
+              cache=not args.memmap_dir),
+        Stage('neighbours', neighbours, inputs=['index'], outputs=['neighbour_records'], params=config['neighbours']),
+    ]
+    if args.checkpoints:
+        # Checkpoints run on the background writer thread, so they never hold up the modelling or ingestion stages
+        stages += [
+            Stage('save_clustered', save_clustered, inputs=['clustered'], outputs=['data_path'],
+                  params={'output': args.output}, targets=[args.output], background=True),
+            Stage('save_model', save_model, inputs=['model', 'scaler', 'features', 'silhouette', 'retrain_metadata'],
+                  outputs=['model_path'], params={'model_output': args.model_output}, targets=[args.model_output],
+                  background=True),
+            Stage('save_similarity', save_similarity, inputs=['index'], outputs=['similarity_path'],
+                  params={'similarity_output': args.similarity_output}, targets=[args.similarity_output],
+                  background=True),
+            Stage('save_neighbours', save_neighbours, inputs=['neighbour_records'], outputs=['neighbours_path'],
+                  params={'neighbours_output': args.neighbours_output}, targets=[args.neighbours_output],
+                  background=True),
+        ]
+    if args.ingest:
+        # The database is external state, so these always run when --ingest is given
+        stages += [
+            Stage('ingest', ingest_games, inputs=['clustered'], cache=False,
+                  params={'engine_string': args.engine_string, 'weights': config.get('ranking'), 'top_n': args.top_n}),
+            Stage('ingest_neighbours', ingest_neighbours, inputs=['neighbour_records'], cache=False,
+                  params={'engine_string': args.engine_string}),
+        ]
+    if args.registry:
+        stages.append(Stage('register', register, inputs=['model_path', 'data_path', 'similarity_path', 'neighbours_path'],
+                            params={'registry': args.registry, 'activate': args.activate}, cache=False))
+    return stages
+
+
 
 if __name__ == "__main__":
     # Setup CLI argument parser
     parser = argparse.ArgumentParser(
-        description="Downloads raw data from S3, creates featurized data from it and finally trains a KMeans model, which is evaluated and saved as .pkl")
+        description="Downloads raw data from S3, creates featurized data from it and finally trains a KMeans model, which is evaluated and saved as a model bundle")
     parser.add_argument('-lfp', '--local_filepath',
                         help="Filepath for downloaded file. Default: ../data/games.json",
                         default="../data/games.json", type=str)
@@ -43,8 +331,45 @@ if __name__ == "__main__":
                         help="Path to output labelled (clustered) data. Default: ../data/games_clustered.json",
                         default="../data/games_clustered.json", type=str)
     parser.add_argument('-mo', '--model_output',
-                        help="Path to save trained model. Default: ../models/kmeans.pkl",
-                        default="../models/kmeans.pkl", type=str)
+                        help="Directory to save the trained model bundle (see src/model_bundle.py). Default: ../models/kmeans",
+                        default="../models/kmeans", type=str)
+    parser.add_argument('-no', '--neighbours_output',
+                        help="Path to output the top K similar games of every game. Default: ../data/game_neighbours.json",
+                        default="../data/game_neighbours.json", type=str)
+    parser.add_argument('-so', '--similarity_output',
+                        help="Path to save the nearest neighbour index over the feature matrix. Default: ../models/similarity.npz",
+                        default="../models/similarity.npz", type=str)
+    parser.add_argument('-ws', '--warm_start',
+                        help="Directory of a previous model bundle whose centroids initialize KMeans (e.g. ../models/kmeans). Default: fit from scratch",
+                        default=None, type=str)
+    parser.add_argument('-r', '--registry',
+                        help="Model registry directory (see src/registry.py) to register the outputs in as a new version. Default: don't register",
+                        default=None, type=str)
+    parser.add_argument('--activate', action='store_true',
+                        help="Make the registered version the one the app serves")
+    parser.add_argument('--ingest', action='store_true',
+                        help="Ingest the clustered games and neighbour lists into the database straight from memory")
+    parser.add_argument('--engine_string', default=SQLALCHEMY_DATABASE_URI,
+                        help="SQLAlchemy connection URI for the database to ingest into")
+    parser.add_argument('-n', '--top_n', default=CLUSTER_TOP_N, type=int,
+                        help="Number of top games per cluster to materialize in cluster_top_games")
+    parser.add_argument('--no_checkpoints', dest='checkpoints', action='store_false',
+                        help="Don't write the json/model files (only useful with --ingest)")
+    parser.add_argument('--memmap_dir', default=None, type=str,
+                        help="Standardize and cluster out of core: the feature matrices are written to .npy files in this directory and memory mapped, and MiniBatchKMeans is fitted (settings in the model: out_of_core section of the config). Default: in memory")
+    parser.add_argument('--stream', action='store_true',
+                        help="Parse the raw data as it streams in from S3 (gzip/zstd objects are decompressed on the fly) instead of downloading it to --local_filepath first")
+    parser.add_argument('--cache_dir',
+                        help="Directory for cached stage outputs. Default: ../data/pipeline_cache",
+                        default="../data/pipeline_cache", type=str)
+    parser.add_argument('--no_cache', action='store_true', help="Rerun every stage and don't cache outputs")
+    parser.add_argument('--force', nargs='*', default=[],
+                        help="Stages to rerun even if their outputs are cached, e.g. --force download")
+    parser.add_argument('-j', '--n_jobs', default=2, type=int, help="Maximum number of stages running at the same time")
+    parser.add_argument('--profile_dir', default=profiling.PROFILE_DIR,
+                        help="Directory to dump a cProfile (or pyinstrument, see src/profiling.py) profile of every stage to. Default: $PROFILE_DIR or no profiles")
+    parser.add_argument('--report', default=profiling.PROFILE_REPORT,
+                        help="Path of the JSON run report with per stage time, memory and rows; regressions against the previous report are logged. Default: $PROFILE_REPORT or no report")
 
     # Parse command line arguments
     args = parser.parse_args()
@@ -59,61 +384,20 @@ if __name__ == "__main__":
         logger.error('Terminating process prematurely')
         sys.exit()
 
-    # Download file to S3 bucket
-    try:
-        dl.download_file_from_bucket(local_filepath=args.local_filepath, **config['download'])
-        logger.info(f'Successfully downloaded {config["download"]["key"]} from S3 bucket')
-    except Exception as err:  # Otherwise, rely on the config/config.yml file
-        logger.error(f'Failed to download {config["download"]["key"]} from S3 bucket with error: {err}')
-
-    # Load unfeaturized json data into a dictionary
-    unfeaturized_data = ft.load_unfeaturized_data(args.local_filepath)
-
-    # Convert the unfeaturized data dictionary to pandas DataFrame
-    df = pd.DataFrame(unfeaturized_data)
-
-    # Calling wrapper function to create categories features
-    featurized_categories_data = ft.wrapper(df, 'categories', config['featurize']['index_categories'])
-
-    # Calling wrapper function to create mechanics features
-    featurized_mechanics_data = ft.wrapper(featurized_categories_data, 'mechanics', config['featurize']['index_mechanics'])
-
-    # Extract relevant information from the 'stats' column (which contains dictionaries) into new columns, then drop it
-    featurized_data = ft.extract_stats(featurized_mechanics_data)
-
-    # Extract relevant feature columns for modelling
-    features_df = md.extract_features(featurized_data)
-
-    # Standardize data and return feature matrix (numpy array)
-    X = md.standardize_features(features_df)
-
-    # Fit KMeans model
-    model = md.fit_kmeans(X, **config['model']['kmeans'])
-
-    # Calculate labels for data
-    labels = md.model_predict(X, model)
-
-    # Calculate Silhouette score for fitted model and labels for the training data
-    silhouette_score_ = md.evaluate_silhouette(X, labels)
-
-    # Combining the original df with the labels and dropping unnecessary columns (now that the modelling is done)
-    df = md.combine_with_labels(featurized_data, labels)
-
-    # Converting back to dictionary so I can save as json
-    df_dict = df.to_dict(orient='records')
-
-    # Saving final json data, which will be used for upload to database
-    with open(args.output, 'w') as fp:
-        json.dump(df_dict, fp)
-        logger.info(f'Saved final json data to {args.output}')
-
-    # Saving calculated model
-    with open(args.model_output, 'wb') as output:
-        pickle.dump(model, output)
-        logger.info(f'Saved model to {args.model_output}')
+    if args.registry and not args.checkpoints:
+        logger.error('Registering a version needs the model and data files; drop --no_checkpoints')
+        logger.error('Terminating process prematurely')
+        sys.exit()
 
-    # Saving silhouette score
-    model_silhouette_path = args.model_output[:-4] + '.txt'  # Changing the file extension from .pkl to .txt
-    with open(model_silhouette_path, "w") as text_file:
-        text_file.write(f"The model silhouette score is: {silhouette_score_}")
-        logger.info(f'Saved silhouette score to {model_silhouette_path}')
\ No newline at end of file
+    profiling.PROFILE_DIR = args.profile_dir
+    pipeline = Pipeline(build_pipeline(args, config), cache_dir=None if args.no_cache else args.cache_dir,
+                        n_jobs=args.n_jobs)
+    try:
+        pipeline.run(force=args.force)
+    except ValueError as e:
+        logger.error(f'Could not run the pipeline and got error {e}')
+        logger.error('Terminating process prematurely')
+        sys.exit()
+    logger.info('Pipeline stage timings:\n' + pipeline.summary())
+    profiling.write_report(args.report, {'pipeline': pipeline.timings, 'total_seconds': pipeline.total_seconds,
+                                         'k': config['model']['kmeans']['k']})
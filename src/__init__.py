@@ -0,0 +1,8 @@
+"""Modules of the boardgame recommendation pipeline (acquire, featurize, model, neighbours, ...) and app (schema, cache,
+catalog, search, recommend, ...)
+
+Importing this package imports nothing else. The modules the app and ingest.py import at startup (schema, db, cache,
+filters, search, ranking, recommend, metrics, profiling) don't import pandas, scikit-learn or boto3; the pipeline
+modules that need them are imported by the entry points that run them (see run.py). benchmarks/import_time.py keeps
+the startup time of every entry point within its budget.
+"""
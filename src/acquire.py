@@ -33,10 +33,12 @@ from urllib.error import HTTPError
 from boardgamegeek import BGGClient
 from boardgamegeek.exceptions import BGGApiError, BGGError, BGGItemNotFoundError, BGGValueError
 
+from src import profiling
+
 logging_config = './config/logging/local.conf'
 
 try: # Set Logging configurations from file
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except: # Fallback to basic configurations
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
@@ -184,24 +186,33 @@ if __name__ == "__main__":
         sys.exit()
 
     # Get the ids of 17,313 games
-    ids = fetch_game_ids(**config['acquire']['fetch_game_ids'])
+    with profiling.stage('fetch_game_ids') as metrics:
+        ids = fetch_game_ids(**config['acquire']['fetch_game_ids'])
+        metrics['rows'] = len(ids)
     # Fetch up-to-date data on these games from the BoardGameGeek XML API via the boardgamegeek wrapper
     # Expected time to completion: ~5 minutes. Time to stretch your legs or get some coffee!
-    games = batch_api_call(ids, **config['acquire']['batch_api_call'])
+    with profiling.stage('batch_api_call') as metrics:
+        games = batch_api_call(ids, **config['acquire']['batch_api_call'])
+        metrics['rows'] = len(games)
 
     # Extract the relevant data from the BoardGame objects and convert it to dictionaries
     dict_games = []
-    for game in games:
-        try:
-            dict_game = convert_game_to_dict(game)
-            dict_games.append(dict_game)
-        except:
-            logging.debug(f"Failed to convert to dict game with id {game.id}")
+    with profiling.stage('convert_games', rows=len(games)):
+        for game in games:
+            try:
+                dict_game = convert_game_to_dict(game)
+                dict_games.append(dict_game)
+            except:
+                logging.debug(f"Failed to convert to dict game with id {game.id}")
 
     # Save results to json
-    with open(args.output, 'w') as fp:
+    with profiling.stage('save_games', rows=len(dict_games)), open(args.output, 'w') as fp:
         json.dump(dict_games, fp)
         logger.info(f'Successfully saved games.json data to {fp}')
 
+    # Per step time and memory; also saved as a JSON run report if PROFILE_REPORT is set
+    logger.info('Step measurements:\n' + profiling.format_table(profiling.recorder.as_dict()))
+    profiling.write_report(metadata={'script': 'acquire', 'n_games': len(dict_games)})
+
 
 
@@ -0,0 +1,94 @@
+"""This module provides a small thread-safe LRU cache with a time-to-live (TTL) for the Flask app
+
+The data behind the app only changes when ingest.py runs, so query results can be reused across requests.
+Entries are evicted when the cache is full (least recently used first) or when they are older than the TTL.
+The app additionally clears the whole cache when ingest.py writes a new data version stamp.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__file__)
+
+
+class TTLCache:
+    """Read-through LRU cache with a TTL and hit/miss counters
+
+    Args:
+        maxsize (`int`): Maximum number of entries. 0 disables caching (every lookup is a miss).
+        ttl (`float`): Seconds an entry stays valid after it was computed
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.clears = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the cached value for key or default if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Stores value under key, evicting the least recently used entries if the cache is full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Read-through lookup: returns the cached value for key, or calls compute() and caches its result
+
+        Exceptions raised by compute() are propagated and nothing is cached.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drops all entries, e.g. when a new data version has been ingested"""
+        with self._lock:
+            self._entries.clear()
+            self.clears += 1
+        logger.info('Cache cleared')
+
+    def stats(self) -> dict:
+        """Returns the cache size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'clears': self.clears}
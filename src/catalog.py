@@ -0,0 +1,228 @@
+"""This module holds the clustered boardgame catalog in memory, so the app can serve without querying the database
+
+The whole catalog (~17k games) fits in a few MB. It is loaded once, either from the `boardgames` table or
+straight from `data/games_clustered.json`, into one NumPy array per column plus three lookup structures:
+1. game_id -> row dictionary
+2. cluster -> row indices sorted by the ranking score (best first, see ranking.py)
+3. a `NameIndex` (see search.py) for name queries
+4. a `FilterIndex` (see filters.py) for filtered top N queries (min_age, year_published, complexity)
+
+`ReloadingCatalog` wraps a loader and swaps in a new `Catalog` when a new snapshot appears
+(the snapshot file changed, ingest.py stamped a new data version or another model registry version was activated),
+without blocking requests.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from src.filters import FilterIndex
+from src.ranking import score_games
+from src.search import NameIndex
+
+logger = logging.getLogger(__file__)
+
+# Catalog columns (named as in the `boardgames` table) and the dtype each one is stored with.
+# Integer columns may be missing, so they are stored as float64 with NaN and converted back when a row is returned.
+STRING_COLUMNS = ['game_id', 'name', 'thumbnail', 'description']
+FLOAT_COLUMNS = ['average_user_rating', 'average_user_rating_weight', 'bayes_average', 'centroid_distance', 'score']
+INTEGER_COLUMNS = ['year_published', 'min_age', 'number_of_ratings', 'number_of_users_own', 'cluster']
+COLUMNS = STRING_COLUMNS + FLOAT_COLUMNS + INTEGER_COLUMNS
+
+# Keys in games_clustered.json (output of model.py/run.py) for each catalog column
+JSON_KEYS = {'game_id': 'id', 'name': 'name', 'thumbnail': 'thumbnail', 'description': 'description',
+             'average_user_rating': 'average_user_rating', 'average_user_rating_weight': 'average_user_weight_rating',
+             'bayes_average': 'bayes_average', 'year_published': 'year', 'min_age': 'min_age',
+             'number_of_ratings': 'number_of_user_ratings', 'number_of_users_own': 'number_of_users_own',
+             'cluster': 'cluster', 'centroid_distance': 'centroid_distance', 'score': 'score'}
+
+
+class Catalog:
+    """Column-oriented, read-only boardgame catalog
+
+    Args:
+        games (`list`): Games as dictionaries keyed by the `boardgames` column names (see COLUMNS)
+        weights (`dict`): Ranking weights (see ranking.py) used to score the games if they have no scores yet,
+            e.g. when loaded from games_clustered.json. Default: ranking.DEFAULT_WEIGHTS
+    """
+
+    def __init__(self, games: list, weights: dict = None):
+        self.columns = {}
+        for column in STRING_COLUMNS:
+            values = [game.get(column) for game in games]
+            if column == 'game_id':
+                values = [str(value) for value in values]
+            self.columns[column] = np.array(values, dtype=object)
+        for column in FLOAT_COLUMNS + INTEGER_COLUMNS:
+            self.columns[column] = np.array([np.nan if game.get(column) is None else game.get(column) for game in games],
+                                            dtype=np.float64)
+
+        self.row_of = {game_id: row for row, game_id in enumerate(self.columns['game_id'])}
+
+        if len(self) and np.isnan(self.columns['score']).all():
+            self.columns['score'] = score_games(games, weights)
+
+        # Rows ordered by score (best first, missing scores last); ties broken by game_id like ingest.rank_cluster_top_games()
+        score = self.columns['score']
+        self.rows_by_score = np.lexsort((self.columns['game_id'].astype(str), -np.nan_to_num(score, nan=-np.inf)))
+
+        # cluster -> row indices in score order. A stable sort by cluster keeps the score order inside each cluster
+        clusters = self.columns['cluster'][self.rows_by_score]
+        has_cluster = ~np.isnan(clusters)
+        ordered_rows, clusters = self.rows_by_score[has_cluster], clusters[has_cluster]
+        order = np.argsort(clusters, kind='stable')
+        ordered_rows, clusters = ordered_rows[order], clusters[order]
+        boundaries = np.flatnonzero(np.diff(clusters)) + 1
+        self.cluster_rows = {int(cluster_ids[0]): rows
+                             for cluster_ids, rows in zip(np.split(clusters, boundaries), np.split(ordered_rows, boundaries))
+                             if len(rows)}
+        self.filter_index = FilterIndex(self.columns, self.rows_by_score, self.cluster_rows)
+        # Neighbour lists of the same snapshot, set when the catalog is loaded from a model registry version (see registry.py)
+        self.neighbour_index = None
+
+        all_games = self.games(np.arange(len(self)))
+        self.name_index = NameIndex((game['game_id'], game['name'], game['cluster'], game['number_of_users_own'])
+                                    for game in all_games)
+
+        logger.info(f'Loaded catalog with {len(self)} games in {len(self.cluster_rows)} clusters '
+                    f'({sum(array.nbytes for array in self.columns.values()) / 1e6:.1f} MB of column arrays)')
+
+    def __len__(self):
+        return len(self.columns['game_id'])
+
+    @classmethod
+    def from_json(cls, filepath: str, weights: dict = None):
+        """Loads the catalog from clustered json data (e.g. data/games_clustered.json), scored with weights"""
+        with open(filepath) as json_file:
+            games = json.load(json_file)
+        logger.info(f'Loading catalog from {filepath}')
+        return cls([{column: game.get(key) for column, key in JSON_KEYS.items()} for game in games], weights)
+
+    @classmethod
+    def from_session(cls, session, weights: dict = None):
+        """Loads the catalog from the `boardgames` table (weights only matter if the games haven't been scored)"""
+        from src.schema import Boardgame  # Imported here so the catalog can be built from json without a database
+
+        columns = [getattr(Boardgame, column) for column in COLUMNS]
+        logger.info('Loading catalog from the boardgames table')
+        return cls([row._asdict() for row in session.query(*columns)], weights)
+
+    def games(self, rows) -> list:
+        """Returns the rows as a list of dictionaries"""
+        rows = np.asarray(rows, dtype=np.intp)
+        values = []
+        for column in COLUMNS:
+            column_values = self.columns[column][rows].tolist()  # One bulk conversion per column instead of per value
+            if column in INTEGER_COLUMNS:
+                column_values = [None if value != value else int(value) for value in column_values]
+            elif column in FLOAT_COLUMNS:
+                column_values = [None if value != value else value for value in column_values]
+            values.append(column_values)
+        return [dict(zip(COLUMNS, row_values)) for row_values in zip(*values)]
+
+    def cluster_of_game_id(self, game_id) -> int:
+        """Returns the cluster of the game with the given id; raises KeyError if there is no such game"""
+        cluster = self.columns['cluster'][self.row_of[str(game_id)]]
+        return None if np.isnan(cluster) else int(cluster)
+
+    def cluster_of_game_name(self, game_name: str) -> int:
+        """Returns the cluster of the best matching game name; raises LookupError if nothing matches"""
+        matches = self.name_index.search(game_name, limit=1)
+        if not matches:
+            raise LookupError(f'No game matches the name {game_name!r}')
+        return matches[0].cluster
+
+    def clusters_of_game_ids(self, game_ids) -> dict:
+        """Returns {game_id: cluster} for the given ids; unknown ids are left out"""
+        return {str(game_id): self.cluster_of_game_id(game_id) for game_id in game_ids if str(game_id) in self.row_of}
+
+    def games_by_ids(self, game_ids) -> list:
+        """Returns the games with the given ids in the same order; unknown ids are left out"""
+        return self.games([self.row_of[str(game_id)] for game_id in game_ids if str(game_id) in self.row_of])
+
+    def top_games_in_cluster(self, cluster: int, limit: int, offset: int = 0, filters: dict = None) -> list:
+        """Returns the top games by score in a cluster (empty list for unknown clusters)
+
+        filters ({column: (low, high)}, see filters.py) restricts the games to those matching all of them
+        """
+        if filters:
+            return self.games(self.filter_index.top_rows(filters, limit, offset, cluster))
+        return self.games(self.cluster_rows.get(int(cluster), ())[offset:offset + limit])
+
+    def top_games(self, limit: int, filters: dict = None) -> list:
+        """Returns the top games by score across the whole catalog, optionally only those matching filters"""
+        if filters:
+            return self.games(self.filter_index.top_rows(filters, limit))
+        return self.games(self.rows_by_score[:limit])
+
+
+class ReloadingCatalog:
+    """Keeps a `Catalog` up to date with its source
+
+    Args:
+        load (`callable`): Builds a new Catalog from the source
+        version (`callable`): Returns a token identifying the current snapshot (e.g. file mtime or data version stamp)
+        check_seconds (`float`): Minimum time between two version checks
+    """
+
+    def __init__(self, load, version, check_seconds: float = 30):
+        self.load = load
+        self.version = version
+        self.check_seconds = check_seconds
+        self.catalog = None
+        self.loaded_version = None
+        self.checked_at = float('-inf')
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def from_json(cls, filepath: str, check_seconds: float = 30, weights: dict = None):
+        """Catalog backed by a json snapshot, reloaded when the file is replaced or modified
+
+        weights are the ranking weights the games are scored with (the config.yml `ranking` section, see
+        ranking.load_ranking_weights()), so the in-memory ranking matches the one ingest.py stores in the database
+        """
+        def version():
+            stat = os.stat(filepath)
+            return stat.st_mtime_ns, stat.st_size
+        return cls(lambda: Catalog.from_json(filepath, weights), version, check_seconds)
+
+    @classmethod
+    def from_registry(cls, registry, pinned: str = None, check_seconds: float = 30, weights: dict = None):
+        """Catalog of the active (or pinned) version of a `ModelRegistry`, reloaded when another version is activated;
+        scored with the ranking weights like from_json()"""
+        def load():
+            version = registry.resolve(pinned)
+            if version is None:
+                raise LookupError(f'No active version in the model registry at {registry.root}')
+            return registry.load_catalog(version, weights)
+        return cls(load, lambda: registry.resolve(pinned), check_seconds)
+
+    def reload(self):
+        """Builds a catalog from the current snapshot and swaps it in. Requests keep using the old catalog meanwhile"""
+        with self._reload_lock:
+            version = self.version()
+            if self.catalog is not None and version == self.loaded_version:
+                return self.catalog
+            start = time.perf_counter()
+            catalog = self.load()
+            self.catalog, self.loaded_version = catalog, version
+            logger.info(f'Catalog (re)loaded in {time.perf_counter() - start:.2f} seconds, version: {version}')
+            return catalog
+
+    def get(self) -> Catalog:
+        """Returns the current catalog, reloading it first if a new snapshot has appeared since the last check"""
+        now = time.monotonic()
+        if self.catalog is None:
+            return self.reload()
+        if now - self.checked_at >= self.check_seconds and not self._reload_lock.locked():
+            self.checked_at = now
+            try:
+                if self.version() != self.loaded_version:
+                    self.reload()
+            except Exception as e:  # Keep serving the current catalog if the new snapshot can't be read
+                logger.error(f'Failed to reload catalog, still serving version {self.loaded_version}. Got error: {e}')
+        return self.catalog
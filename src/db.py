@@ -0,0 +1,155 @@
+"""This module is the shared SQLAlchemy engine factory for app.py and ingest.py
+
+Both use the same connection pool settings from config/flaskconfig.py (pool size, overflow, timeout,
+recycle, pre-ping) and the same instrumentation. ingest.py reuses a single engine per connection string
+instead of creating a new one for every session (e.g. once for truncating and once more for ingesting).
+
+The instrumentation counts pool checkouts, the time spent waiting for a connection, and connection churn
+(DBAPI connections opened, closed and invalidated). This shows whether the pool is sized right for the number of
+gunicorn workers/threads: long checkout waits mean the pool is too small, and high churn means connections
+are recycled or dropped too often.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from config.flaskconfig import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+
+logger = logging.getLogger(__file__)
+
+# Upper bounds (seconds) of the checkout wait time histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+
+class PoolStats:
+    """Thread-safe counters for connection pool checkouts and connection churn"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+
+    def record_wait(self, seconds: float):
+        """Records how long a checkout waited for a connection (including opening a new one)"""
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS, seconds)] += 1
+
+    def increment(self, counter: str):
+        """Increments one of the event counters"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> dict:
+        """Returns all counters, the average wait and the cumulative wait time histogram"""
+        with self._lock:
+            timed_checkouts = sum(self.wait_buckets)
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(WAIT_BUCKETS, self.wait_buckets):
+                cumulative += count
+                histogram['+Inf' if bound == float('inf') else str(bound)] = cumulative
+            return {'checkouts': self.checkouts,
+                    'checkins': self.checkins,
+                    'connects': self.connects,
+                    'closes': self.closes,
+                    'invalidations': self.invalidations,
+                    'wait_seconds_total': self.wait_seconds_total,
+                    'wait_seconds_max': self.wait_seconds_max,
+                    'wait_seconds_avg': self.wait_seconds_total / timed_checkouts if timed_checkouts else 0.0,
+                    'wait_seconds_histogram': histogram}
+
+
+# One set of counters per process (i.e. per gunicorn worker)
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def engine_options(engine_string: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                   pool_timeout: float = DB_POOL_TIMEOUT, pool_recycle: int = DB_POOL_RECYCLE,
+                   pool_pre_ping: bool = DB_POOL_PRE_PING) -> dict:
+    """Returns the keyword arguments for `create_engine()` (or Flask-SQLAlchemy's SQLALCHEMY_ENGINE_OPTIONS)
+
+    SQLite keeps SQLAlchemy's default pool, because it is a local file and doesn't accept the queue pool settings.
+
+    Args:
+        engine_string (`str`): SQLAlchemy connection string
+        pool_size (`int`): Connections kept open in the pool
+        max_overflow (`int`): Extra connections allowed beyond pool_size under load
+        pool_timeout (`float`): Seconds to wait for a connection before giving up
+        pool_recycle (`int`): Seconds after which connections are replaced (should be below MySQL's wait_timeout)
+        pool_pre_ping (`bool`): Test connections on checkout, so connections dropped by RDS are replaced transparently
+
+    Returns:
+        options (`dict`)
+    """
+    if make_url(engine_string).get_backend_name() == 'sqlite':
+        return {'pool_pre_ping': pool_pre_ping}
+    return {'poolclass': InstrumentedQueuePool,
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'pool_recycle': pool_recycle,
+            'pool_pre_ping': pool_pre_ping}
+
+
+def instrument_engine(engine):
+    """Attaches listeners to the engine's pool which count checkouts and connection churn"""
+    event.listen(engine, 'connect', lambda *args: pool_stats.increment('connects'))
+    event.listen(engine, 'close', lambda *args: pool_stats.increment('closes'))
+    event.listen(engine, 'invalidate', lambda *args: pool_stats.increment('invalidations'))
+    event.listen(engine, 'checkout', lambda *args: pool_stats.increment('checkouts'))
+    event.listen(engine, 'checkin', lambda *args: pool_stats.increment('checkins'))
+    return engine
+
+
+def pool_status(engine) -> dict:
+    """Returns the current state of the engine's pool along with the process-wide counters"""
+    pool = engine.pool
+    status = {'pool': pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                      checked_in=pool.checkedin())
+    status.update(pool_stats.as_dict())
+    return status
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(engine_string: str):
+    """Returns the shared, instrumented engine for the connection string, creating it on first use
+
+    Raises:
+        sqlalchemy.exc.ArgumentError: if the connection string is empty or malformed
+    """
+    with _engines_lock:
+        engine = _engines.get(engine_string)
+        if engine is None:
+            logger.debug('Creating engine from engine string')
+            engine = instrument_engine(create_engine(engine_string, **engine_options(engine_string)))
+            _engines[engine_string] = engine
+        return engine
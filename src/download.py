@@ -4,7 +4,6 @@ You can pass the local filepath of the file you want to upload via the [-lfp --l
 Otherwise default: data/external/games.json
 """
 
-import boto3
 from botocore.exceptions import ClientError
 import argparse
 import logging
@@ -12,47 +11,60 @@ import logging.config
 import yaml
 import sys
 
+from src import storage
+
 # todo: Exception Handling
 
 logging_config = './config/logging/local.conf'
 try:
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except:
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.DEBUG)
 logger = logging.getLogger(__file__)
 
-def download_file_from_bucket(bucket_name, key, local_filepath,):
+def download_file_from_bucket(bucket_name, key, local_filepath, snapshot=False):
     '''Download file from S3 bucket with specified key & filepath
 
+    Large files are downloaded in parallel ranged parts with the shared client of storage.py
+
     Args:
         bucket_name (`str`): The S3 bucket to download from
         key (`str`): The name of the file on S3
         local_filepath (`str`): The path to download the file to
+        snapshot (`bool`): Download the current snapshot of key (skipped if local_filepath already has its content)
+            instead of key itself, or key itself while it has no snapshot; see storage.download_snapshot()
+
+    Raises:
+        botocore.exceptions.ClientError: If the bucket or file doesn't exist or can't be accessed
     '''
-    # Connect to S3
-    s3 = boto3.resource('s3')
-    logger.debug('Connected to S3')
-    # Connect to Bucket # Note that all buckets have unique names so we don't need the 's3://' part
-    bucket = s3.Bucket(bucket_name)
-    logger.debug(f'Connected to {bucket_name}')
-    # Download to Bucket
+    # Download from Bucket # Note that all buckets have unique names so we don't need the 's3://' part
     try:
-        bucket.download_file(key, local_filepath)
+        if snapshot:
+            storage.download_snapshot(bucket_name, key, local_filepath)
+        else:
+            storage.download_file(bucket_name, key, local_filepath)
         logger.info(f'Successfully downloaded {key}')
-    except ClientError as e:
-        logger.error(f"Failed to download {key} with error: {e}. Maybe you didn't specify the file key correctly?")
-        logger.error('Terminating process prematurely')
-        sys.exit()
-    except bucket.meta.client.exceptions.NoSuchKey:
-        logger.error(f"Failed to download {key} with error: {e}. Maybe you didn't specify the file key correctly?")
-        logger.error('Terminating process prematurely')
-        sys.exit()
-    except bucket.meta.client.exceptions.NoSuchBucket:
-        logger.error(f"Failed to download {key} with error: {e}. Maybe you didn't specify the bucket name correctly?")
-        logger.error('Terminating process prematurely')
-        sys.exit()
+    except ClientError as e:  # Missing keys and buckets are reported as ClientErrors (404 / NoSuchBucket)
+        logger.error(f"Failed to download {key} with error: {e}. Maybe you didn't specify the bucket name or file key correctly?")
+        raise
+
+
+def object_etag(bucket_name, key, snapshot=False):
+    '''Returns the ETag of a file in an S3 bucket, which changes whenever the file is replaced
+
+    For a snapshot, the sha256 of its current content (from its manifest) is returned instead, as long as it has one
+
+    Args:
+        bucket_name (`str`): The S3 bucket the file is in
+        key (`str`): The name of the file on S3
+        snapshot (`bool`): Whether key is uploaded as snapshots
+    '''
+    manifest = storage.read_manifest(bucket_name, key) if snapshot else None
+    if manifest is not None:
+        return manifest['sha256']
+    return storage.object_etag(bucket_name, key)
 
 if __name__ == "__main__":
     # Setup CLI argument parser
@@ -77,5 +89,9 @@ if __name__ == "__main__":
         sys.exit()
 
     # Download file to S3 bucket
-    download_file_from_bucket(local_filepath=args.local_filepath, **config['download'])
+    try:
+        download_file_from_bucket(local_filepath=args.local_filepath, **config['download'])
+    except ClientError:
+        logger.error('Terminating process prematurely')
+        sys.exit()
     logger.info(f'Successfully downloaded {config["download"]["key"]} from S3 bucket')
\ No newline at end of file
@@ -11,6 +11,10 @@ The above steps are performed once for categories and once for mechanics.
 All the steps are combined into a wrapper function, which is called twice
 
 Finally, the relevant data in the 'stats' dictionary is extracted and the stats column is dropped
+
+Every step keeps the frame compact (see compact_dtypes()): the one-hot columns are uint8 (0/1 flags instead of int64
+sums), ids and the rating counts are int32 and low-cardinality strings are categorical. The averages stay float64, so
+the values saved to json and the database are unchanged; model.py casts the feature matrix to float32.
 """
 
 import argparse
@@ -23,18 +27,43 @@ import numpy as np
 import pandas as pd
 import yaml
 
+from src import profiling
+
 logging_config = './config/logging/local.conf'
 try:
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except:
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.DEBUG)
 logger = logging.getLogger(__file__)
 
+# Columns extracted from the 'stats' dictionaries by extract_stats(): column -> (key in 'stats', dtype)
+STATS_COLUMNS = {
+    'number_of_user_ratings': ('usersrated', np.int32),
+    'average_user_rating': ('average', np.float64),
+    'number_of_user_weight_ratings': ('numweights', np.int32),
+    'average_user_weight_rating': ('averageweight', np.float64),
+    'bayes_average': ('bayesaverage', np.float64),
+    'number_of_users_own': ('owned', np.int32),
+}
+
+# Object columns with at most this share of distinct values (and only strings) are stored as categoricals
+CATEGORICAL_MAX_SHARE = 0.5
+
 
 def load_unfeaturized_data(filepath: str) -> dict:
-    """Loads json data from local filepath and returns a dictionary """
+    """Loads json data from local filepath and returns a dictionary
+
+    An s3://bucket/key filepath is streamed from S3 and parsed as it arrives (decompressed if the key ends in .gz or
+    .zst), without downloading it to a file first; see storage.read_json()
+    """
+    if filepath.startswith('s3://'):
+        from src import storage
+
+        data = storage.read_json(*storage.parse_s3_url(filepath))
+        logger.info(f'Successfully streamed unfeaturized data from {filepath}')
+        return data
     try:
         with open(filepath) as json_file:
             data = json.load(json_file)
@@ -92,7 +121,7 @@ def one_hot_encode(df: pd.DataFrame, feature_name: str) -> pd.DataFrame:
         logger.warning('The dataframe does not contain the "Id" column.')
         logger.warning('It might not be possible to join the one-hot encoded data back with the original dataset')
     try:
-        df_one_hot_encoded = pd.get_dummies(df, columns=[feature_name])
+        df_one_hot_encoded = pd.get_dummies(df, columns=[feature_name], dtype=np.uint8)
         logger.debug(f'Successfully one-hot encoded {feature_name} column')
     except (ValueError, KeyError) as e:
         logger.error(f'Could not one-hot encode the data and got error {e}. Maybe the dataframe is empty?')
@@ -124,6 +153,8 @@ def collapse_one_hot_encoded(df: pd.DataFrame, index: int) -> pd.DataFrame:
     # Collapsing the feature columns so all binary feature values are on the same row
     try:
         df_one_hot_collapsed = df[id_and_feature_columns].groupby(by='id', as_index=False).sum()
+        feature_columns = id_and_feature_columns[1:]
+        df_one_hot_collapsed[feature_columns] = df_one_hot_collapsed[feature_columns].astype(np.uint8)
         return df_one_hot_collapsed
     except KeyError as e:
         logger.error(f'Cannot collapse one_hot_encoded columns. Is the "id" column in the dataframe?')
@@ -178,12 +209,14 @@ def extract_stats(df: pd.DataFrame) -> pd.DataFrame:
     """
     logger.debug('Extracting stats into new columns from the "stats" column, which contains dictionaries columns')
     try:
-        df['number_of_user_ratings'] = df.apply(lambda row: row['stats']['usersrated'], axis=1)
-        df['average_user_rating'] = df.apply(lambda row: row['stats']['average'], axis=1)
-        df['number_of_user_weight_ratings'] = df.apply(lambda row: row['stats']['numweights'], axis=1)
-        df['average_user_weight_rating'] = df.apply(lambda row: row['stats']['averageweight'], axis=1)
-        df['bayes_average'] = df.apply(lambda row: row['stats']['bayesaverage'], axis=1)
-        df['number_of_users_own'] = df.apply(lambda row: row['stats']['owned'], axis=1)
+        stats = pd.DataFrame(df['stats'].tolist(), index=df.index)
+        columns = {}
+        for column, (key, dtype) in STATS_COLUMNS.items():
+            values = pd.to_numeric(stats[key])
+            # Counts with missing values can't be integers
+            columns[column] = values if values.isna().any() and np.issubdtype(dtype, np.integer) else values.astype(dtype)
+        # Adding the columns at once; the frame has a column per category and mechanic already
+        df = pd.concat([df.drop(columns=list(columns), errors='ignore'), pd.DataFrame(columns)], axis=1)
     except KeyError as e:
         logger.error(f'Could not extract relevant stats from "stats" column and got error: {e}')
         logger.error('Is the "stats" column in the dataframe?')
@@ -196,11 +229,39 @@ def extract_stats(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcasts the columns of a DataFrame to the smallest dtype that holds their values
+
+    - id: int32 (BGG ids are well below 2^31)
+    - other integer columns, e.g. year, min_age and the one-hot columns: the smallest integer dtype
+    - string columns with few distinct values (at most CATEGORICAL_MAX_SHARE of the rows): categorical
+    Float columns and columns holding lists (artists, categories, ...) are left as they are.
+
+    Returns:
+        df (`pd.DataFrame`): The DataFrame with compact dtypes (a copy)
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if column == 'id' and pd.api.types.is_integer_dtype(values) and values.abs().max() < np.iinfo(np.int32).max:
+            df[column] = values.astype(np.int32)
+        elif column != 'id' and pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='unsigned' if values.min() >= 0 else 'integer')
+        elif pd.api.types.is_string_dtype(values) and len(values) > 0:
+            try:
+                n_distinct = values.nunique()
+            except TypeError:  # Strings mixed with lists
+                continue
+            if n_distinct <= CATEGORICAL_MAX_SHARE * len(values):
+                df[column] = values.astype('category')
+    return df
+
+
 if __name__ == "__main__":
     # Setup CLI argument parser
     parser = argparse.ArgumentParser(description="Creates One-hot encoded features for categories and mechanics from data/games.json")
     parser.add_argument('-i', '--input',
-                        help="Path to input (unfeaturized games.json). Default: ../data/games.json",
+                        help="Path to input (unfeaturized games.json), or an s3://bucket/key URL (.gz/.zst are decompressed) to stream it from S3. Default: ../data/games.json",
                         default="../data/games.json", type=str)
     parser.add_argument('-c', '--config',
                         help="Path to .yml (YAML) config file with module settings. Default: ../config/config.yml",
@@ -222,23 +283,33 @@ if __name__ == "__main__":
         sys.exit()
 
     # Load unfeaturized json data into a dictionary
-    unfeaturized_data = load_unfeaturized_data(args.input)
+    with profiling.stage('load_unfeaturized_data') as metrics:
+        unfeaturized_data = load_unfeaturized_data(args.input)
+        metrics['rows'] = len(unfeaturized_data)
 
     # Step 0: Convert the unfeaturized data dictionary to pandas DataFrame
     df = pd.DataFrame(unfeaturized_data)
 
     # Calling wrapper function to create categories features
-    featurized_categories_data = wrapper(df, 'categories', config['featurize']['index_categories'])
+    with profiling.stage('featurize_categories', rows=len(df)):
+        featurized_categories_data = wrapper(df, 'categories', config['featurize']['index_categories'])
 
     # Calling wrapper function to create mechanics features
-    featurized_mechanics_data = wrapper(featurized_categories_data, 'mechanics', config['featurize']['index_mechanics'])
+    with profiling.stage('featurize_mechanics', rows=len(df)):
+        featurized_mechanics_data = wrapper(featurized_categories_data, 'mechanics', config['featurize']['index_mechanics'])
 
-    featurized_data = extract_stats(featurized_mechanics_data)
+    with profiling.stage('extract_stats', rows=len(df)):
+        featurized_data = compact_dtypes(extract_stats(featurized_mechanics_data))
+    logger.info(f'The featurized data uses {profiling.memory_mb(featurized_data):.1f} MB')
 
     # Converting back to dictionary so I can save as json
     df_dict = featurized_data.to_dict(orient='records')
 
     # Save results to json
-    with open(args.output, 'w') as fp:
+    with profiling.stage('save_featurized', rows=len(df_dict)), open(args.output, 'w') as fp:
         json.dump(df_dict, fp)
-        logger.info(f'Successfully saved featurized data to {fp}')
\ No newline at end of file
+        logger.info(f'Successfully saved featurized data to {fp}')
+
+    # Per step time and memory; also saved as a JSON run report if PROFILE_REPORT is set
+    logger.info('Step measurements:\n' + profiling.format_table(profiling.recorder.as_dict()))
+    profiling.write_report(metadata={'script': 'featurize', 'n_games': len(df_dict)})
\ No newline at end of file
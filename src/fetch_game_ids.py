@@ -13,7 +13,7 @@ import argparse
 logging_config = './config/logging/local.conf'
 
 try: # Set Logging configurations from file
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except: # Fallback to basic configurations
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
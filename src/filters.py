@@ -0,0 +1,180 @@
+"""This module filters recommendations by player age, publication year and complexity without touching the database
+
+Filtering the cluster query with SQL WHERE clauses would bypass the precomputed top N per cluster. Instead,
+`FilterIndex` keeps prebuilt bitmaps over the in-memory catalog (see catalog.py), with one bit per game in score order:
+- one bitmap per cluster
+- per filterable attribute, one cumulative bitmap per value bucket: the games whose bucket is at most that bucket
+
+A range filter is the difference of two cumulative bitmaps, so a filtered query is a handful of ANDs over n/8 bytes
+followed by scanning for the first set bits, which are the best scoring matches (stopping once there are enough). Bucket bitmaps may include a few games
+just outside the requested range (e.g. complexity 2.53 in the bucket of 2.5), so the candidates are checked against the
+exact values before they are returned. Games with a missing value never match a filter on that attribute.
+
+Filters are passed around as {column: (low, high)} with inclusive bounds (None for an open end); see parse_filters().
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+# Filterable catalog columns and the width of their value buckets
+BUCKET_WIDTHS = {'min_age': 1, 'year_published': 1, 'average_user_rating_weight': 0.1}
+
+# Bitmap bytes (8 games each) unpacked at a time when scanning for the best matches
+SCAN_CHUNK_BYTES = 512
+
+# Query parameters -> (column, bound): bound 0 is the lower end of the range, 1 the upper end
+FILTER_PARAMETERS = {'age': ('min_age', 1),  # Games a player of this age can play, i.e. min_age <= age
+                     'min_year': ('year_published', 0),
+                     'max_year': ('year_published', 1),
+                     'min_complexity': ('average_user_rating_weight', 0),
+                     'max_complexity': ('average_user_rating_weight', 1)}
+
+
+def parse_filters(args) -> dict:
+    """Reads the filter parameters (see FILTER_PARAMETERS) from a query string, form or JSON body
+
+    Returns:
+        filters (`dict`): {column: (low, high)}; empty if no filter parameter was given
+
+    Raises:
+        ValueError: if a filter parameter is not a number
+    """
+    filters = {}
+    for parameter, (column, bound) in FILTER_PARAMETERS.items():
+        value = args.get(parameter)
+        if value is None or value == '':
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{parameter} must be a number')
+        low_high = list(filters.get(column, (None, None)))
+        low_high[bound] = value
+        filters[column] = tuple(low_high)
+    return filters
+
+
+def filters_key(filters: dict) -> tuple:
+    """Hashable, order independent representation of filters, e.g. for cache keys"""
+    return tuple(sorted(filters.items())) if filters else ()
+
+
+class FilterIndex:
+    """Bitmap indexes for filtered top N queries over a catalog
+
+    Args:
+        columns (`dict`): Catalog column arrays (see catalog.Catalog.columns), with NaN for missing values
+        rows_by_score (`np.ndarray`): Catalog rows, best score first; bit i of every bitmap is the game rows_by_score[i]
+        cluster_rows (`dict`): cluster -> rows of that cluster
+    """
+
+    def __init__(self, columns: dict, rows_by_score: np.ndarray, cluster_rows: dict):
+        self.rows_by_score = rows_by_score
+        self.n_games = len(rows_by_score)
+        position_of_row = np.empty(self.n_games, dtype=np.intp)
+        position_of_row[rows_by_score] = np.arange(self.n_games)
+
+        self.cluster_bitmaps = {}
+        for cluster, rows in cluster_rows.items():
+            bits = np.zeros(self.n_games, dtype=bool)
+            bits[position_of_row[rows]] = True
+            self.cluster_bitmaps[cluster] = np.packbits(bits)
+        self.all_bitmap = np.packbits(np.ones(self.n_games, dtype=bool))
+
+        # Attribute values in score order, for the exact check of the candidates
+        self.values = {column: columns[column][rows_by_score] for column in BUCKET_WIDTHS}
+        self.buckets = {}
+        self.at_most = {}
+        for column, width in BUCKET_WIDTHS.items():
+            values = self.values[column]
+            present = ~np.isnan(values)
+            bucket_ids = np.full(self.n_games, np.iinfo(np.int64).max, dtype=np.int64)
+            bucket_ids[present] = np.floor(values[present] / width).astype(np.int64)
+            self.buckets[column] = np.unique(bucket_ids[present])
+            # Row b holds the games with bucket <= buckets[b], built cumulatively
+            order = np.argsort(bucket_ids, kind='stable')
+            boundaries = np.searchsorted(bucket_ids[order], self.buckets[column], side='right')
+            bitmaps = np.zeros((len(boundaries), (self.n_games + 7) // 8), dtype=np.uint8)
+            bits = np.zeros(self.n_games, dtype=bool)
+            start = 0
+            for b, end in enumerate(boundaries):
+                bits[order[start:end]] = True
+                bitmaps[b] = np.packbits(bits)
+                start = end
+            self.at_most[column] = bitmaps
+
+        logger.debug(f'Built filter bitmaps over {self.n_games} games and {len(self.cluster_bitmaps)} clusters '
+                     f'({sum(bitmaps.nbytes for bitmaps in self.at_most.values()) / 1e6:.2f} MB)')
+
+    def _range_bitmap(self, column: str, low: float, high: float) -> np.ndarray:
+        """Bitmap of the games whose bucket overlaps [low, high] (a superset of the exact matches)"""
+        width = BUCKET_WIDTHS[column]
+        buckets, at_most = self.buckets[column], self.at_most[column]
+        empty = np.zeros_like(self.all_bitmap)
+        if len(buckets) == 0:
+            return empty
+
+        if high is None:
+            bitmap = at_most[-1]
+        else:
+            b = np.searchsorted(buckets, np.floor(high / width), side='right') - 1
+            if b < 0:
+                return empty
+            bitmap = at_most[b]
+        if low is not None:
+            b = np.searchsorted(buckets, np.floor(low / width), side='left') - 1
+            if b >= 0:
+                bitmap = bitmap & ~at_most[b]
+        return bitmap
+
+    def _exact_matches(self, positions: np.ndarray, filters: dict) -> np.ndarray:
+        """Keeps the positions whose values lie in the filter ranges; candidates from boundary buckets may not"""
+        for column, (low, high) in filters.items():
+            values = self.values[column][positions]
+            keep = ~np.isnan(values)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            positions = positions[keep]
+        return positions
+
+    def top_rows(self, filters: dict, limit: int, offset: int = 0, cluster: int = None) -> np.ndarray:
+        """Returns the catalog rows of the best scoring games which match all filters
+
+        Args:
+            filters (`dict`): {column: (low, high)}, see parse_filters()
+            limit (`int`): Maximum number of rows to return
+            offset (`int`): Number of matching rows to skip (for pagination)
+            cluster (`int`): Only return games in this cluster. Default: whole catalog
+
+        Returns:
+            rows (`np.ndarray`): Catalog rows, best score first
+        """
+        if cluster is None:
+            bitmap = self.all_bitmap
+        elif int(cluster) in self.cluster_bitmaps:
+            bitmap = self.cluster_bitmaps[int(cluster)]
+        else:
+            return np.empty(0, dtype=np.intp)
+
+        for column, (low, high) in filters.items():
+            bitmap = bitmap & self._range_bitmap(column, low, high)
+
+        # Scan the bitmap from the best scores down, a chunk at a time, until enough matches are found
+        matches = []
+        n_matches = 0
+        for chunk_start in range(0, len(bitmap), SCAN_CHUNK_BYTES):
+            # Unpack only the non-zero bytes; filtered bitmaps are mostly sparse
+            nonzero_bytes = np.flatnonzero(bitmap[chunk_start:chunk_start + SCAN_CHUNK_BYTES]) + chunk_start
+            bits = np.unpackbits(bitmap[nonzero_bytes]).reshape(-1, 8).astype(bool)
+            positions = self._exact_matches((nonzero_bytes[:, np.newaxis] * 8 + np.arange(8))[bits], filters)
+            matches.append(positions)
+            n_matches += len(positions)
+            if n_matches >= offset + limit:
+                break
+        positions = np.concatenate(matches) if matches else np.empty(0, dtype=np.intp)
+        return self.rows_by_score[positions[offset:offset + limit]]
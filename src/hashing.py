@@ -0,0 +1,15 @@
+"""This module hashes files for the model bundles, the model registry and the S3 data snapshots
+
+It only uses the standard library, so storage.py can fingerprint data files without importing NumPy through model_bundle.py.
+"""
+
+import hashlib
+
+
+def file_sha256(filepath: str) -> str:
+    """Hex SHA-256 digest of a file, read in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,348 @@
+"""This module collects request metrics of app.py and exposes them in the Prometheus text format (`/metrics`)
+
+Recorded per request (labelled by route, so the number of series stays bounded):
+- http_request_duration_seconds: latency histogram (also by method and status)
+- http_request_db_seconds: time spent executing SQL statements (see instrument_queries())
+- http_request_render_seconds: time spent rendering Jinja templates (Flask's template signals)
+- recommendation_queries_total: requests by query type (game_id, game_name, cluster_id, batch)
+- http_request_errors_total: requests that ended on the error page or with a 5xx status
+
+Recording is a few dictionary updates under a lock, i.e. microseconds per request. Cache and connection pool
+counters are read from the cache and pool when the metrics are collected, not on every request.
+
+Every gunicorn worker is a separate process with its own counters. If `METRICS_DIR` is set (config/gunicorn.conf.py
+sets it for multi-worker servers) each worker writes a snapshot of its metrics to METRICS_DIR/metrics-<pid>.json
+every METRICS_FLUSH_SECONDS from a background thread, and `/metrics` merges the snapshots of all workers: counters and histograms are
+summed (including those of exited workers, so counters never go backwards), gauges are reported per live worker
+(`pid` label). The snapshots of exited workers (e.g. recycled after gunicorn's max_requests) are folded into
+METRICS_DIR/metrics-exited.json and removed on the next scrape, so the directory doesn't grow with every recycled
+worker. Without METRICS_DIR only the worker answering the scrape is reported.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__file__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+# Snapshot file with the summed counters and histograms of all exited workers
+EXITED_SNAPSHOT = 'metrics-exited.json'
+
+# Type and help text of every metric, in the order they are exposed
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route, method and status'),
+    'http_request_db_seconds': ('histogram', 'Time per request spent executing SQL statements'),
+    'http_request_render_seconds': ('histogram', 'Time per request spent rendering templates'),
+    'recommendation_queries_total': ('counter', 'Recommendation requests by query type'),
+    'http_request_errors_total': ('counter', 'Requests answered with the error page or a 5xx status'),
+    'cache_hits_total': ('counter', 'Lookups answered from the read-through cache'),
+    'cache_misses_total': ('counter', 'Lookups that missed the read-through cache'),
+    'cache_evictions_total': ('counter', 'Entries evicted from the full cache'),
+    'cache_entries': ('gauge', 'Entries in the read-through cache'),
+    'db_pool_checkouts_total': ('counter', 'Connection pool checkouts'),
+    'db_pool_connects_total': ('counter', 'Database connections opened'),
+    'db_pool_invalidations_total': ('counter', 'Database connections invalidated'),
+    'db_pool_wait_seconds_total': ('counter', 'Total time checkouts waited for a connection'),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out of the pool'),
+}
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, labels: dict = None, amount: float = 1):
+        """Increments a counter"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: dict = None):
+        """Adds a value (seconds) to a histogram"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self, collectors: list = ()) -> dict:
+        """JSON serializable copy of the metrics, plus the samples of collectors
+
+        Args:
+            collectors (`list`): Callables returning [(name, labels, value), ...] read at snapshot time, e.g. cache stats
+        """
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, dict(labels), list(h['buckets']), h['sum'], h['count']]
+                          for (name, labels), h in self.histograms.items()]
+        gauges = []
+        for collector in collectors:
+            for name, labels, value in collector():
+                (gauges if METRICS[name][0] == 'gauge' else counters).append([name, labels, value])
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+# One registry per process (i.e. per gunicorn worker)
+registry = MetricsRegistry()
+
+# Per thread (i.e. per request with threaded workers) SQL and template time of the current request
+_request = threading.local()
+
+
+def start_request():
+    """Resets the SQL and template timers of the current thread at the start of a request"""
+    _request.db_seconds = 0.0
+    _request.render_seconds = 0.0
+    _request.render_started = None
+
+
+def finish_request(route: str, method: str, status: int, seconds: float, query_type: str = None, error: bool = False):
+    """Records a finished request with the SQL and template time accumulated since start_request()"""
+    registry.observe('http_request_duration_seconds', seconds, {'route': route, 'method': method, 'status': str(status)})
+    registry.observe('http_request_db_seconds', getattr(_request, 'db_seconds', 0.0), {'route': route})
+    registry.observe('http_request_render_seconds', getattr(_request, 'render_seconds', 0.0), {'route': route})
+    if query_type:
+        registry.inc('recommendation_queries_total', {'route': route, 'query': query_type})
+    if error or status >= 500:
+        registry.inc('http_request_errors_total', {'route': route})
+
+
+def instrument_queries(engine):
+    """Attaches listeners to the engine which add the execution time of every SQL statement to the current request"""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        _request.db_seconds = getattr(_request, 'db_seconds', 0.0) + time.perf_counter() - started
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    return engine
+
+
+def instrument_templates(app):
+    """Times template rendering with Flask's before_render_template and template_rendered signals"""
+    from flask import before_render_template, template_rendered
+
+    def started(sender, **extra):
+        _request.render_started = time.perf_counter()
+
+    def rendered(sender, **extra):
+        if getattr(_request, 'render_started', None) is not None:
+            _request.render_seconds = getattr(_request, 'render_seconds', 0.0) + time.perf_counter() - _request.render_started
+            _request.render_started = None
+
+    before_render_template.connect(started, app, weak=False)
+    template_rendered.connect(rendered, app, weak=False)
+
+
+def _write_atomically(path: str, data: dict):
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary_path, path)
+
+
+def _read_snapshot(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge_snapshots(snapshots: list) -> dict:
+    """Sums the counters and histograms of several snapshots into one snapshot without gauges"""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, _labels_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            merged = histograms.setdefault((name, _labels_key(labels)), [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return {'pid': None,
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), *h] for (name, labels), h in histograms.items()],
+            'gauges': []}
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MultiprocessCollector:
+    """Shares the metrics of all worker processes through snapshot files in a directory
+
+    Every worker writes its snapshot from a background thread, so requests never wait on the file.
+
+    Args:
+        directory (`str`): Directory shared by the workers (e.g. METRICS_DIR)
+        flush_seconds (`float`): Time between two snapshots of the same worker
+        collectors (`list`): Callables returning [(name, labels, value), ...] added to every snapshot
+    """
+
+    def __init__(self, directory: str, flush_seconds: float = 5, collectors: list = ()):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.collectors = list(collectors)
+        self.pid = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Starts the flushing thread of this process, if it doesn't run yet (threads don't survive a fork)"""
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        """Writes this worker's snapshot"""
+        try:
+            snapshot = registry.snapshot(self.collectors)
+            _write_atomically(os.path.join(self.directory, f"metrics-{snapshot['pid']}.json"), snapshot)
+        except Exception as e:
+            logger.warning(f'Could not write the metrics snapshot and got error {e}')
+
+    def snapshots(self) -> list:
+        """Snapshots of all live workers, plus one snapshot with the counters and histograms of all exited workers"""
+        snapshots = []
+        exited_paths = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if os.path.basename(path) == EXITED_SNAPSHOT:
+                continue
+            snapshot = _read_snapshot(path)
+            if snapshot is None:
+                continue
+            if _is_alive(snapshot['pid']):
+                snapshots.append(snapshot)
+            else:
+                exited_paths.append(path)
+        exited = self._merge_exited(exited_paths)
+        if exited is not None:
+            snapshots.append(exited)
+        return snapshots
+
+    def _merge_exited(self, paths: list):
+        """Folds the snapshots of exited workers into EXITED_SNAPSHOT and removes them
+
+        Workers scrape concurrently, so the merge runs under an exclusive lock on a file in the directory and the
+        snapshots are read again under it (another worker may have merged them already).
+
+        Args:
+            paths (`list`): Snapshot files of exited workers
+
+        Returns:
+            exited (`dict`): Snapshot with the summed counters and histograms of all exited workers, None if there are none
+        """
+        import fcntl
+
+        exited_path = os.path.join(self.directory, EXITED_SNAPSHOT)
+        with open(os.path.join(self.directory, '.exited.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = _read_snapshot(exited_path)
+            merged = [snapshot for snapshot in map(_read_snapshot, paths) if snapshot is not None]
+            if not merged:
+                return exited
+            exited = _merge_snapshots(([exited] if exited is not None else []) + merged)
+            try:
+                _write_atomically(exited_path, exited)
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+            except OSError as e:
+                logger.warning(f'Could not merge the metrics snapshots of exited workers and got error {e}')
+            return exited
+
+
+def clear_directory(directory: str):
+    """Removes the snapshots of a previous server run (including those of its exited workers), e.g. when gunicorn starts"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        os.remove(path)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render(snapshots: list) -> str:
+    """Merges snapshots of one or more workers into the Prometheus text exposition format"""
+    samples = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, _labels_key(labels))
+            samples[key] = samples.get(key, 0) + value
+        for name, labels, value in snapshot['gauges']:
+            samples[(name, _labels_key({**labels, 'pid': str(snapshot['pid'])}))] = value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            merged = histograms.setdefault((name, _labels_key(labels)), {'buckets': [0] * len(LATENCY_BUCKETS),
+                                                                         'sum': 0.0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], buckets)]
+            merged['sum'] += total
+            merged['count'] += count
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = sorted((labels, value) for (sample_name, labels), value in samples.items() if sample_name == name)
+        series_histograms = sorted((labels, h) for (sample_name, labels), h in histograms.items() if sample_name == name)
+        if not series and not series_histograms:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for labels, value in series:
+            lines.append(f'{name}{_format_labels(dict(labels))} {value}')
+        for labels, histogram in series_histograms:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels({**dict(labels), 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(dict(labels))} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(dict(labels))} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
@@ -6,21 +6,31 @@ import yaml
 import logging.config
 import argparse
 import sys
-import pickle
 
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from src import profiling
+from src.featurize import compact_dtypes
+from src.model_bundle import ModelBundle
+from src.similarity import SimilarityIndex
 
 logging_config = './config/logging/local.conf'
 try:
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except:
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.DEBUG)
 logger = logging.getLogger(__file__)
 
+# dtype of the standardized feature matrix; float32 halves its memory and KMeans keeps fitting in float32
+FEATURE_DTYPE = np.float32
+
+# Rows processed at once by the out-of-core functions, which bounds their memory to CHUNK_SIZE x features values
+CHUNK_SIZE = 100000
+
 
 def load_featurized_data(filepath: str) -> pd.DataFrame:
     """Loads json data from local filepath and returns a dictionary """
@@ -52,25 +62,139 @@ def extract_features(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def standardize_features(df: pd.DataFrame) -> np.ndarray:
-    """Standardize Feature Matrix. Takes pd.DataFrame and returns Numpy array"""
+    """Standardize Feature Matrix. Takes pd.DataFrame and returns Numpy array
+
+    Raises:
+        ValueError: If the features can't be standardized (see fit_standardizer()). It used to return the dataframe
+            unchanged instead, which failed later on in the clustering
+    """
+    return fit_standardizer(df)[0]
+
+
+def fit_standardizer(df: pd.DataFrame, dtype=FEATURE_DTYPE) -> tuple:
+    """Standardize Feature Matrix and return it together with the fitted StandardScaler (saved in the model bundle)
+
+    The features are converted to one dtype array once (the uint8 one-hot and int columns of featurize.py included)
+    and standardized in place, so the only copy of the feature data is the returned matrix. The scaler's mean_ and
+    scale_ are float64 whatever the dtype.
+
+    Args:
+        df (`pd.DataFrame`): Feature data (see extract_features())
+        dtype: dtype of the standardized feature matrix. Default: FEATURE_DTYPE (float32)
+
+    Raises:
+        ValueError: If the features can't be standardized (e.g. the dataframe is empty); there is no scaler to return
+    """
 
     logger.info('Standardizing Features')
     try:
-        standardized_features = StandardScaler().fit_transform(df)
-        return standardized_features
+        scaler = StandardScaler(copy=False)
+        standardized_features = scaler.fit_transform(df.to_numpy(dtype=dtype))
+        logger.info(f'The standardized feature matrix uses {standardized_features.nbytes / 2 ** 20:.1f} MB '
+                    f'({standardized_features.dtype})')
+        return standardized_features, scaler
     except ValueError as e:
         logger.error(f'Encountered error: {e}. Maybe your dataframe is empty?')
-        logger.error('Returning original dataframe')
-        return df
+        raise
+
+
+def write_feature_matrix(df: pd.DataFrame, filepath: str, dtype=FEATURE_DTYPE, chunk_size: int = CHUNK_SIZE) -> np.memmap:
+    """Writes the feature data to a .npy file chunk by chunk and returns it memory mapped (read only)
+
+    The file can be reopened with np.load(filepath, mmap_mode='r'), so the out-of-core steps below never need the
+    whole dense matrix in memory.
+
+    Args:
+        df (`pd.DataFrame`): Feature data (see extract_features())
+        filepath (`str`): Path of the .npy file
+        dtype: dtype of the matrix. Default: FEATURE_DTYPE (float32)
+        chunk_size (`int`): Rows converted at once
+
+    Returns:
+        X (`np.memmap`): The feature matrix
+    """
+    X = np.lib.format.open_memmap(filepath, mode='w+', dtype=dtype, shape=df.shape)
+    for start in range(0, len(df), chunk_size):
+        X[start:start + chunk_size] = df.iloc[start:start + chunk_size].to_numpy(dtype=dtype)
+    X.flush()
+    del X
+    logger.info(f'Wrote the {df.shape[0]} x {df.shape[1]} feature matrix to {filepath}')
+    return np.load(filepath, mmap_mode='r')
+
+
+def fit_standardizer_out_of_core(X: np.ndarray, filepath: str, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """Standardizes a (memory mapped) feature matrix in two streaming passes, writing the result to a .npy file
+
+    The first pass accumulates the column means and variances chunk by chunk (StandardScaler.partial_fit() merges the
+    chunks with the parallel Welford update of Chan et al., in float64), the second scales every chunk into the
+    output file. Memory stays at a few chunks whatever the number of games.
+
+    Args:
+        X (`np.ndarray`): Feature matrix, e.g. of write_feature_matrix()
+        filepath (`str`): Path of the .npy file for the standardized matrix
+        chunk_size (`int`): Rows read at once
+
+    Returns:
+        (X_standardized, scaler): The standardized matrix (memory mapped, read only, dtype of X) and the fitted scaler
+    """
+    logger.info(f'Standardizing {len(X)} games out of core')
+    scaler = StandardScaler()
+    for start in range(0, len(X), chunk_size):
+        scaler.partial_fit(X[start:start + chunk_size])
+
+    standardized = np.lib.format.open_memmap(filepath, mode='w+', dtype=X.dtype, shape=X.shape)
+    for start in range(0, len(X), chunk_size):
+        standardized[start:start + chunk_size] = scaler.transform(X[start:start + chunk_size])
+    standardized.flush()
+    del standardized
+    return np.load(filepath, mmap_mode='r'), scaler
+
+
+def fit_minibatch_kmeans(X: np.ndarray, k: int, seed: int, batch_size: int, init: np.ndarray = None):
+    """Fits sklearn MiniBatchKMeans with k clusters, for feature matrices too large for KMeans
 
+    Every step reads one random batch of rows, so X can be a memory mapped matrix (see fit_standardizer_out_of_core())
+    which is never copied into memory. The labels of all games are computed chunk by chunk at the end of the fit.
 
-def fit_kmeans(X: np.ndarray, k: int, seed: int):
+    Args:
+        X (`np.ndarray`): Training data, e.g. memory mapped
+        k (`int`): number of clusters
+        seed (`int`): random_state to ensure reproducibility
+        batch_size (`int`): Games per step; larger batches converge to centroids closer to those of KMeans
+        init (`np.ndarray`): Initial centroids (k x features), e.g. of the previous model (see warm_start()).
+            Default: k-means++ initialization on a sample
+
+    Returns:
+        kmeans: the fitted sklearn MiniBatchKMeans object (same attributes as KMeans)
+    """
+    try:
+        if init is None:
+            kmeans = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, random_state=seed, n_init=1)
+        else:
+            kmeans = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, init=init, random_state=seed, n_init=1)
+        logger.info(f'Fitting MiniBatchKMeans with {k} clusters to {len(X)} games in batches of {batch_size}')
+        with profiling.stage('fit_minibatch_kmeans', rows=len(X)) as metrics:
+            kmeans.fit(X)
+        # n_steps_ is new in scikit-learn 1.0, before that n_iter_ counted the batches
+        n_steps = getattr(kmeans, 'n_steps_', kmeans.n_iter_)
+        logger.info(f"MiniBatchKMeans stopped after {n_steps} batches in {metrics['wall_seconds']:.1f}s "
+                    f"({metrics['cpu_seconds']:.1f}s CPU)")
+        return kmeans
+    except (ValueError, TypeError) as e:
+        logger.error(f'Encountered error: {e}. Maybe you specified a seed, n_clusters or batch_size, which is not a whole number?')
+        logger.error('Terminating process prematurely')
+        sys.exit()
+
+
+def fit_kmeans(X: np.ndarray, k: int, seed: int, init: np.ndarray = None):
     """Fits sklearn KMeans clustering algorithm with k clusters to training data X
 
     Args:
         X (`np.ndarray`): Training data for KMeans
         k (`int`): number of clusters for KMeans()
         seed (`int`): random_state for KMeans() to ensure reproducibility
+        init (`np.ndarray`): Initial centroids (k x features), e.g. of the previous model (see warm_start()).
+            Default: k-means++ initialization
 
     Returns:
         kmeans: sklearn transformer object to make predictions for new data based on KMeans algorithm
@@ -78,10 +202,17 @@ def fit_kmeans(X: np.ndarray, k: int, seed: int):
 
     try:
         # Instantiate estimator
-        kmeans = KMeans(n_clusters=k, random_state=seed)
+        if init is None:
+            kmeans = KMeans(n_clusters=k, random_state=seed)
+            logger.info(f'Fitting KMeans Clustering algorithm with {k} clusters to {len(X)} games')
+        else:
+            kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed)
+            logger.info('Fitting KMeans Clustering algorithm starting from the previous centroids')
         # Fit estimator on standardized feature data
-        logger.info('Fitting KMeans Clustering algorithm to provided feature data. This will take ~2 minutes')
-        kmeans.fit(X)
+        with profiling.stage('fit_kmeans', rows=len(X)) as metrics:
+            kmeans.fit(X)
+        logger.info(f"KMeans converged after {kmeans.n_iter_} iterations in {metrics['wall_seconds']:.1f}s "
+                    f"({metrics['cpu_seconds']:.1f}s CPU)")
         return kmeans
     except ValueError as e:
         logger.error(f'Encountered error: {e}. Maybe you specified a seed, which is not a whole number?')
@@ -93,6 +224,46 @@ def fit_kmeans(X: np.ndarray, k: int, seed: int):
         sys.exit()
 
 
+def warm_start(bundle_path: str, features_df: pd.DataFrame, scaler, k: int) -> tuple:
+    """Prepares a retrain starting from the centroids of a previous model bundle (see model_bundle.py)
+
+    Starting from the previous centroids converges in a few iterations when few games changed, and keeps cluster ids
+    stable across runs. Feature columns are aligned by name, so a grown category/mechanics vocabulary is fine.
+
+    Args:
+        bundle_path (`str`): Directory of the previous model bundle
+        features_df (`pd.DataFrame`): Current feature data (see extract_features())
+        scaler: StandardScaler fitted on features_df (see fit_standardizer())
+        k (`int`): Number of clusters of the retrain
+
+    Returns:
+        (init, previous_labels): Centroids to pass to fit_kmeans() and the clusters the previous model assigns the
+        current games to. (None, None) if the previous model can't be used, which means a cold start
+    """
+    try:
+        # Not memory mapped: the retrained bundle may be saved to the same directory
+        bundle = ModelBundle.load(bundle_path, mmap=False)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Could not load the previous model from {bundle_path} and got error {e}. Fitting from scratch')
+        return None, None
+    if len(bundle) != k:
+        logger.warning(f'The previous model has {len(bundle)} clusters instead of {k}. Fitting from scratch')
+        return None, None
+
+    added = set(map(str, features_df.columns)) - set(bundle.feature_columns)
+    removed = set(bundle.feature_columns) - set(map(str, features_df.columns))
+    logger.info(f'Warm starting from {bundle_path}: {len(added)} new and {len(removed)} removed feature columns')
+    init = bundle.aligned_centroids(list(features_df.columns), scaler.mean_, scaler.scale_)
+    return init, bundle.predict(features_df)
+
+
+def changed_clusters(previous_labels, labels) -> int:
+    """Number of games the retrained model assigns to another cluster than the previous model"""
+    changed = int(np.sum(np.asarray(previous_labels) != np.asarray(labels)))
+    logger.info(f'{changed} of {len(labels)} games ({changed / max(len(labels), 1):.1%}) changed cluster')
+    return changed
+
+
 def model_predict(X, model):
     """Calculates labels for feature data based on provided model
 
@@ -109,8 +280,27 @@ def model_predict(X, model):
     return model.labels_
 
 
-def evaluate_silhouette(X, labels):
-    """Calculate silhouette score for X data & clustered labels"""
+def centroid_distances(X, model, chunk_size: int = CHUNK_SIZE):
+    """Calculates the Euclidean distance of every row of X to the centroid of its cluster (used for ranking, see ranking.py)
+
+    Works through X chunk by chunk, so a memory mapped X is never loaded at once
+    """
+    distances = np.empty(len(X))
+    for start in range(0, len(X), chunk_size):
+        chunk = np.asarray(X[start:start + chunk_size])
+        distances[start:start + len(chunk)] = np.linalg.norm(
+            chunk - model.cluster_centers_[model.labels_[start:start + len(chunk)]], axis=1)
+    return distances
+
+
+def evaluate_silhouette(X, labels, sample_size: int = None, seed: int = 0):
+    """Calculate silhouette score for X data & clustered labels
+
+    The exact score compares every pair of games; with sample_size it is estimated on that many random games
+    """
+    if sample_size is not None and sample_size < len(X):
+        logger.info(f'Estimating the silhouette score on {sample_size} of {len(X)} games')
+        return silhouette_score(X, labels, sample_size=sample_size, random_state=seed)
     return silhouette_score(X, labels)
 
 
@@ -138,8 +328,14 @@ if __name__ == "__main__":
                         help="Path to output labelled (clustered) data. Default: ../data/games_clustered.json",
                         default="../data/games_clustered.json", type=str)
     parser.add_argument('-mo', '--model_output',
-                        help="Path to save trained model. Default: ../models/kmeans.pkl",
-                        default="../models/kmeans.pkl", type=str)
+                        help="Directory to save the trained model bundle (see model_bundle.py). Default: ../models/kmeans",
+                        default="../models/kmeans", type=str)
+    parser.add_argument('-so', '--similarity_output',
+                        help="Path to save the nearest neighbour index over the feature matrix. Default: ../models/similarity.npz",
+                        default="../models/similarity.npz", type=str)
+    parser.add_argument('-ws', '--warm_start',
+                        help="Directory of a previous model bundle whose centroids initialize KMeans (e.g. ../models/kmeans). Default: fit from scratch",
+                        default=None, type=str)
 
     # Parse CLI arguments
     args = parser.parse_args()
@@ -155,42 +351,66 @@ if __name__ == "__main__":
         sys.exit()
 
     # Load unfeaturized json data into a dictionary
-    featurized_data = load_featurized_data(args.input)
+    with profiling.stage('load_featurized_data') as metrics:
+        featurized_data = compact_dtypes(load_featurized_data(args.input))
+        metrics['rows'] = len(featurized_data)
 
     # Extract relevant feature columns
     features_df = extract_features(featurized_data)
 
     # Standardize data and return feature matrix (numpy array)
-    X = standardize_features(features_df)
+    try:
+        with profiling.stage('standardize', rows=len(features_df)):
+            X, scaler = fit_standardizer(features_df)
+    except ValueError:
+        logger.error('Terminating process prematurely')  # fit_standardizer() logged the error
+        sys.exit()
 
-    # Fit KMeans model
-    model = fit_kmeans(X, **config['model']['kmeans'])
+    # Fit KMeans model, starting from the previous model's centroids when retraining
+    init, previous_labels = None, None
+    if args.warm_start:
+        init, previous_labels = warm_start(args.warm_start, features_df, scaler, config['model']['kmeans']['k'])
+    model = fit_kmeans(X, **config['model']['kmeans'], init=init)
 
     # Calculate labels for data
     labels = model_predict(X, model)
+    retrain_metadata = {'warm_start': init is not None, 'n_iter': int(model.n_iter_)}
+    if previous_labels is not None:
+        retrain_metadata['changed_cluster'] = changed_clusters(previous_labels, labels)
 
     # Calculate Silhouette score for fitted model and labels for the training data
-    silhouette_score_ = evaluate_silhouette(X, labels)
+    with profiling.stage('evaluate_silhouette', rows=len(X)):
+        silhouette_score_ = evaluate_silhouette(X, labels)
 
     # Combining the original df with the labels and dropping unnecessary columns (now that the modelling is done)
     df = combine_with_labels(featurized_data, labels)
 
+    # Distance to the cluster centroid, which the ranking score uses to prefer games typical for their cluster
+    df['centroid_distance'] = centroid_distances(X, model)
+
     # Converting back to dictionary so I can save as json
     df_dict = df.to_dict(orient='records')
 
     # Saving final json data, which will be used for upload to database
-    with open(args.output, 'w') as fp:
+    with profiling.stage('save_clustered', rows=len(df_dict)), open(args.output, 'w') as fp:
         json.dump(df_dict, fp)
         logger.info(f'Saved final json data to {args.output}')
 
-    # Saving calculated model
-    with open(args.model_output, 'wb') as output:
-        pickle.dump(model, output)
-        logger.info(f'Saved model to {args.model_output}')
-        logger.info('It might take ~30 seconds for the file to appear in your file system')
+    # Saving calculated model as a bundle of centroids, scaler parameters and feature column order
+    bundle = ModelBundle.from_fit(model, scaler, features_df.columns,
+                                  {'n_games': len(X), 'silhouette_score': float(silhouette_score_), **retrain_metadata})
+    bundle.save(args.model_output)
 
     # Saving silhouette score
-    model_silhouette_path = args.model_output[:-4] + '.txt'  # Changing the file extension from .pkl to .txt
+    model_silhouette_path = args.model_output.rstrip('/') + '.txt'
     with open(model_silhouette_path, "w") as text_file:
         text_file.write(f"The model silhouette score is: {silhouette_score_}")
-        logger.info(f'Saved silhouette score to {model_silhouette_path}')
\ No newline at end of file
+        logger.info(f'Saved silhouette score to {model_silhouette_path}')
+
+    # Saving the "games like this one" index, which partitions the feature matrix by the KMeans clusters
+    with profiling.stage('similarity_index', rows=len(X)):
+        SimilarityIndex.from_kmeans(featurized_data['id'], X, model).save(args.similarity_output)
+
+    # Per step time and memory; also saved as a JSON run report if PROFILE_REPORT is set
+    logger.info('Step measurements:\n' + profiling.format_table(profiling.recorder.as_dict()))
+    profiling.write_report(metadata={'script': 'model', 'k': config['model']['kmeans']['k'], 'n_games': len(X)})
\ No newline at end of file
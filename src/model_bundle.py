@@ -0,0 +1,177 @@
+"""This module saves and loads the trained model as a versioned bundle instead of a pickle
+
+Unpickling executes arbitrary code, ties the saved model to the sklearn version that wrote it, and has to import
+sklearn (and rebuild the estimator) before the first prediction. Assigning a game to a cluster only needs the
+numbers the fit produced, so a bundle is a directory of plain arrays plus a manifest:
+- centroids.npy: KMeans cluster centers (clusters x features), in standardized feature space
+- mean.npy, scale.npy: the StandardScaler's per-feature mean and scale
+- manifest.json: format version, feature column order, shape/dtype/sha256 of every array and metadata
+  (k, seed, number of games, silhouette score, library versions)
+
+Arrays are loaded with `allow_pickle=False` and memory mapped by default, so loading takes milliseconds and workers
+share the pages. `ModelBundle` standardizes and clusters new feature rows with NumPy only.
+
+Usage:
+    bundle = ModelBundle.load('models/kmeans')
+    clusters = bundle.predict(features_df)
+"""
+
+import datetime
+import json
+import logging
+import os
+
+import numpy as np
+
+from src.hashing import file_sha256
+
+logger = logging.getLogger(__file__)
+
+# Bumped whenever the layout of the bundle changes; load() refuses bundles with a different version
+BUNDLE_FORMAT_VERSION = 1
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# Arrays stored in every bundle, saved as <name>.npy
+ARRAY_NAMES = ['centroids', 'mean', 'scale']
+
+
+class ModelBundle:
+    """Everything needed to assign feature rows to clusters
+
+    Args:
+        centroids (`np.ndarray`): Cluster centers (clusters x features) in standardized feature space
+        mean (`np.ndarray`): Per-feature mean subtracted before scaling
+        scale (`np.ndarray`): Per-feature scale divided by after centering
+        feature_columns (`list`): Name of every feature, in the column order of centroids
+        metadata (`dict`): Free-form, JSON serializable information about the fit
+    """
+
+    def __init__(self, centroids: np.ndarray, mean: np.ndarray, scale: np.ndarray, feature_columns: list,
+                 metadata: dict = None):
+        self.centroids = centroids
+        self.mean = mean
+        self.scale = scale
+        self.feature_columns = [str(column) for column in feature_columns]
+        self.metadata = metadata or {}
+        n_features = len(self.feature_columns)
+        if centroids.ndim != 2 or centroids.shape[1] != n_features or mean.shape != (n_features,) \
+                or scale.shape != (n_features,):
+            raise ValueError(f'Got {n_features} feature columns, centroids of shape {centroids.shape}, '
+                             f'mean of shape {mean.shape} and scale of shape {scale.shape}')
+        self.centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    @classmethod
+    def from_fit(cls, kmeans, scaler, feature_columns: list, metadata: dict = None):
+        """Builds the bundle from a fitted sklearn KMeans model and the StandardScaler of its training data"""
+        import sklearn
+
+        metadata = {'k': int(kmeans.n_clusters), 'seed': kmeans.random_state, 'sklearn_version': sklearn.__version__,
+                    **(metadata or {})}
+        return cls(np.asarray(kmeans.cluster_centers_, dtype=np.float64), np.asarray(scaler.mean_, dtype=np.float64),
+                   np.asarray(scaler.scale_, dtype=np.float64), list(feature_columns), metadata)
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def save(self, directory: str):
+        """Saves the arrays as .npy files and, last, the manifest (a bundle without manifest is incomplete)"""
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for name in ARRAY_NAMES:
+            array = np.ascontiguousarray(getattr(self, name))
+            filename = f'{name}.npy'
+            np.save(os.path.join(directory, filename), array, allow_pickle=False)
+            arrays[name] = {'file': filename, 'sha256': file_sha256(os.path.join(directory, filename)),
+                            'shape': list(array.shape), 'dtype': array.dtype.str}
+
+        manifest = {'format_version': BUNDLE_FORMAT_VERSION,
+                    'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                    'numpy_version': np.__version__,
+                    'feature_columns': self.feature_columns,
+                    'arrays': arrays,
+                    'metadata': self.metadata}
+        with open(os.path.join(directory, MANIFEST_FILENAME), 'w') as fp:
+            json.dump(manifest, fp, indent=2, default=float)
+        logger.info(f'Saved model bundle with {len(self)} clusters and {len(self.feature_columns)} features to {directory}')
+
+    @classmethod
+    def load(cls, directory: str, verify: bool = True, mmap: bool = True):
+        """Loads a bundle saved with save()
+
+        Args:
+            directory (`str`): Bundle directory
+            verify (`bool`): Check the sha256 of every array file against the manifest
+            mmap (`bool`): Memory map the arrays (read only) instead of reading them into memory
+
+        Raises:
+            FileNotFoundError: if the directory has no manifest or an array file is missing
+            ValueError: if the format version, a checksum, shape or dtype doesn't match the manifest
+        """
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as fp:
+            manifest = json.load(fp)
+        if manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Model bundle at {directory} has format version {manifest.get('format_version')}, "
+                             f"expected {BUNDLE_FORMAT_VERSION}")
+
+        arrays = {}
+        for name in ARRAY_NAMES:
+            entry = manifest['arrays'][name]
+            filepath = os.path.join(directory, entry['file'])
+            if verify and file_sha256(filepath) != entry['sha256']:
+                raise ValueError(f'Checksum of {filepath} does not match the manifest; the bundle is corrupt')
+            array = np.load(filepath, mmap_mode='r' if mmap else None, allow_pickle=False)
+            if list(array.shape) != entry['shape'] or array.dtype.str != entry['dtype']:
+                raise ValueError(f"{filepath} has shape {array.shape} and dtype {array.dtype.str}, the manifest says "
+                                 f"{tuple(entry['shape'])} and {entry['dtype']}")
+            arrays[name] = array
+
+        bundle = cls(arrays['centroids'], arrays['mean'], arrays['scale'], manifest['feature_columns'],
+                     manifest.get('metadata'))
+        logger.debug(f'Loaded model bundle with {len(bundle)} clusters from {directory}')
+        return bundle
+
+    def feature_matrix(self, features, fill_value: float = 0.0) -> np.ndarray:
+        """Aligns raw features to the bundle's column order
+
+        Args:
+            features: pd.DataFrame, list of dictionaries or a single dictionary with (a superset of) the feature columns
+            fill_value (`float`): Value of feature columns missing from features, e.g. one-hot columns of a category
+                that none of the rows has
+
+        Returns:
+            X (`np.ndarray`): rows x features, unstandardized
+        """
+        if isinstance(features, dict):
+            features = [features]
+        if isinstance(features, list):
+            return np.array([[row.get(column, fill_value) for column in self.feature_columns] for row in features],
+                            dtype=np.float64).reshape(len(features), len(self.feature_columns))
+        return features.reindex(columns=self.feature_columns, fill_value=fill_value).to_numpy(dtype=np.float64)
+
+    def aligned_centroids(self, feature_columns: list, mean: np.ndarray, scale: np.ndarray) -> np.ndarray:
+        """Maps the centroids into another standardized feature space, e.g. of a retrain on updated data
+
+        Centroids are unstandardized with the bundle's scaler and standardized with mean and scale. Columns the bundle
+        doesn't have (e.g. new categories) are set to the new mean (0); columns missing from feature_columns are dropped.
+
+        Returns:
+            centroids (`np.ndarray`): clusters x len(feature_columns)
+        """
+        position = {column: i for i, column in enumerate(self.feature_columns)}
+        shared = [j for j, column in enumerate(feature_columns) if str(column) in position]
+        old = [position[str(feature_columns[j])] for j in shared]
+        centroids = np.zeros((len(self), len(feature_columns)))
+        raw = self.centroids[:, old] * self.scale[old] + self.mean[old]
+        centroids[:, shared] = (raw - mean[shared]) / scale[shared]
+        return centroids
+
+    def transform(self, features) -> np.ndarray:
+        """Standardizes raw features (see feature_matrix()) like the StandardScaler of the training data"""
+        return (self.feature_matrix(features) - self.mean) / self.scale
+
+    def predict(self, features) -> np.ndarray:
+        """Returns the cluster (nearest centroid) of every row of raw features (see feature_matrix())"""
+        X = self.transform(features)
+        distances = self.centroid_sq_norms[np.newaxis, :] - 2 * X @ self.centroids.T
+        return np.argmin(distances, axis=1)
@@ -0,0 +1,172 @@
+"""This module precomputes the top K most similar games for every game at model time
+
+Instead of searching the similarity index on every request (see similarity.py), the neighbour lists of all games are
+computed in one pass over the standardized feature matrix and ingested into the `game_neighbours` table, so serving
+"games like this one" is a primary key lookup.
+
+The all-pairs search never holds the n x n distance matrix. Queries are processed in blocks of `block_size` games,
+and each query block is compared with the candidates one block at a time (a single matrix multiply per pair of blocks),
+keeping only the running top K per query (blocks without a closer candidate are skipped). Memory is therefore bounded by n_jobs * block_size^2 distances, and query
+blocks are spread over a pool of threads (NumPy releases the GIL during the matrix multiplies).
+If NumPy's BLAS is itself multithreaded, n_jobs=1 may already use all cores.
+
+Usage (after model.py/run.py has saved the similarity index):
+    python -m src.neighbours -i models/similarity.npz -c config/config.yml -o data/game_neighbours.json
+"""
+
+import argparse
+import json
+import logging
+import logging.config
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+
+from src.similarity import SimilarityIndex, smallest_k
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+
+def _block_neighbours(X: np.ndarray, X_sq_norms: np.ndarray, start: int, end: int, k: int, block_size: int) -> tuple:
+    """Top k neighbours (excluding the game itself) of the query rows start:end, scanning candidates block by block"""
+    queries = X[start:end]
+    best_rows = np.full((end - start, k), -1, dtype=np.intp)
+    best_distances = np.full((end - start, k), np.inf, dtype=np.float32)
+    query_rows = np.arange(start, end)
+
+    for candidate_start in range(0, len(X), block_size):
+        candidate_end = min(candidate_start + block_size, len(X))
+        # ||x||^2 - 2 q.x ranks candidates like the squared distance; ||q||^2 is the same for a whole row and added at the end
+        distances = queries @ X[candidate_start:candidate_end].T
+        distances *= -2
+        distances += X_sq_norms[candidate_start:candidate_end]
+
+        # A game is not its own neighbour
+        overlap = (query_rows >= candidate_start) & (query_rows < candidate_end)
+        distances[overlap, query_rows[overlap] - candidate_start] = np.inf
+
+        # Merge the block's top k into the running top k, only for the queries where some candidate beats the current k-th
+        improved = np.flatnonzero((distances < best_distances[:, -1:]).any(axis=1))
+        if len(improved) == 0:
+            continue
+        distances = distances[improved]
+        nearest = smallest_k(distances, k)
+        merged_rows = np.concatenate([best_rows[improved], nearest + candidate_start], axis=1)
+        merged_distances = np.concatenate([best_distances[improved], np.take_along_axis(distances, nearest, axis=1)], axis=1)
+        keep = smallest_k(merged_distances, k)
+        best_rows[improved] = np.take_along_axis(merged_rows, keep, axis=1)
+        best_distances[improved] = np.take_along_axis(merged_distances, keep, axis=1)
+
+    best_rows[np.isinf(best_distances)] = -1
+    best_distances += X_sq_norms[start:end, np.newaxis]
+    return best_rows, np.sqrt(np.maximum(best_distances, 0))
+
+
+def top_k_neighbours(X: np.ndarray, k: int = 10, block_size: int = 1024, n_jobs: int = None) -> tuple:
+    """Finds the k nearest games (Euclidean distance) of every game in X
+
+    Args:
+        X (`np.ndarray`): Standardized feature matrix (games x features)
+        k (`int`): Number of neighbours per game
+        block_size (`int`): Number of query and candidate games compared at once
+        n_jobs (`int`): Number of threads working on query blocks. Default: number of CPUs
+
+    Returns:
+        (rows, distances): both games x k arrays, nearest first. Rows are -1 where there are fewer than k other games
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    X_sq_norms = np.einsum('ij,ij->i', X, X)
+    rows = np.empty((len(X), k), dtype=np.intp)
+    distances = np.empty((len(X), k), dtype=np.float32)
+
+    def compute(start):
+        end = min(start + block_size, len(X))
+        rows[start:end], distances[start:end] = _block_neighbours(X, X_sq_norms, start, end, k, block_size)
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(compute, range(0, len(X), block_size)))
+    logger.info(f'Computed the top {k} neighbours of {len(X)} games in {time.perf_counter() - started:.1f}s '
+                f'(block size {block_size}, {n_jobs} threads)')
+    return rows, distances
+
+
+def neighbour_records(game_ids, rows: np.ndarray, distances: np.ndarray) -> list:
+    """Converts neighbour rows to `game_neighbours` records: game_id, rank (starting at 1), neighbour_id, distance"""
+    game_ids = [str(game_id) for game_id in game_ids]
+    return [{'game_id': game_id, 'rank': rank, 'neighbour_id': game_ids[row], 'distance': distance}
+            for game_id, game_rows, game_distances in zip(game_ids, rows.tolist(), distances.tolist())
+            for rank, (row, distance) in enumerate(zip(game_rows, game_distances), start=1) if row != -1]
+
+
+class PrecomputedNeighbours:
+    """In-memory neighbour lists, with the same `neighbours()` lookup as `SimilarityIndex`
+
+    Args:
+        records (`list`): `game_neighbours` records (see neighbour_records())
+    """
+
+    def __init__(self, records: list):
+        self.lists = {}
+        for record in sorted(records, key=lambda record: (record['game_id'], record['rank'])):
+            self.lists.setdefault(str(record['game_id']), []).append((str(record['neighbour_id']), record['distance']))
+
+    @classmethod
+    def from_json(cls, filepath: str):
+        """Loads neighbour lists saved by this module's CLI (e.g. data/game_neighbours.json)"""
+        with open(filepath) as json_file:
+            return cls(json.load(json_file))
+
+    def neighbours(self, game_ids, k: int, nprobe: int = None) -> dict:
+        """Returns {game_id: [(similar game_id, distance), ...]} with at most k games each; nprobe is ignored"""
+        return {str(game_id): self.lists[str(game_id)][:k] for game_id in game_ids if str(game_id) in self.lists}
+
+
+if __name__ == "__main__":
+    # Setup CLI argument parser
+    parser = argparse.ArgumentParser(description="Precomputes the top K similar games of every game for the game_neighbours table")
+    parser.add_argument('-i', '--input',
+                        help="Path to the similarity index saved by model.py/run.py. Default: ../models/similarity.npz",
+                        default="../models/similarity.npz", type=str)
+    parser.add_argument('-c', '--config',
+                        help="Path to .yml (YAML) config file with module settings. Default: ../config/config.yml",
+                        default='../config/config.yml', type=str)
+    parser.add_argument('-o', '--output',
+                        help="Path to output neighbour lists. Default: ../data/game_neighbours.json",
+                        default="../data/game_neighbours.json", type=str)
+    args = parser.parse_args()
+
+    # Load .yml config file
+    try:
+        with open(args.config, 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info(f'Loaded configurations from {args.config}')
+    except FileNotFoundError as e:
+        logger.error(f"Could not load configurations file, didn't find it at {args.config} and threw error {e}")
+        logger.error('Terminating process prematurely')
+        sys.exit()
+
+    try:
+        index = SimilarityIndex.load(args.input)
+    except FileNotFoundError as e:
+        logger.error(f'Did not find the similarity index at {args.input} and got error {e}. Run model.py first')
+        logger.error('Terminating process prematurely')
+        sys.exit()
+
+    rows, distances = top_k_neighbours(index.X, **config['neighbours'])
+
+    with open(args.output, 'w') as fp:
+        json.dump(neighbour_records(index.game_ids, rows, distances), fp)
+        logger.info(f'Saved neighbour lists to {args.output}')
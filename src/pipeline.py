@@ -0,0 +1,245 @@
+"""This module runs the model pipeline as a DAG of stages, rerunning only the stages whose inputs or settings changed
+
+A `Stage` declares the named values it consumes (`inputs`) and produces (`outputs`), the settings it depends on
+(`params`, e.g. config['model']['kmeans'], passed to the stage function as keyword arguments) and the files it writes
+(`targets`). `Pipeline.run()` orders the stages by their inputs and runs every stage as soon as the stages it depends
+on are done, up to `n_jobs` stages at a time (e.g. evaluating the model while the neighbour lists are computed).
+
+Each stage has a cache key: a hash of its name, the source of its function, its params and the fingerprints of its
+inputs. An output's fingerprint is the key of the stage that produced it, so a change propagates down the DAG: changing
+k reruns the fit and everything after it, but not the download or featurization. A stage can also declare a
+`fingerprint` of external state (e.g. the ETag of the raw data on S3). The outputs of a stage are cached in
+`cache_dir` under its key and loaded instead of rerunning the stage, unless one of its targets is missing.
+
+Values are passed between stages in memory. Persistence is off the critical path: cache entries are written by a
+background thread while the next stages already run, and stages marked `background` (e.g. json/model checkpoints)
+run on that thread too, without taking one of the `n_jobs` slots. `run()` waits for them before it returns.
+
+Every stage that runs is measured with src/profiling.py (wall and CPU time, peak memory, rows of its first output),
+which also dumps a per stage profile if PROFILE_DIR is set; `summary()` shows the measurements.
+
+The cache is local state that only this module writes, so it is stored with pickle.
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src import profiling
+
+logger = logging.getLogger(__file__)
+
+
+class Stage:
+    """One step of a pipeline
+
+    Args:
+        name (`str`): Unique stage name
+        func (`callable`): Called with the inputs and params as keyword arguments. Returns the value of its single
+            output, or a tuple with one value per output
+        inputs (`list`): Names of values produced by other stages
+        outputs (`list`): Names of the values the stage produces
+        params (`dict`): Settings passed to func; part of the cache key
+        targets (`list`): Files the stage writes; the stage reruns if one of them is missing
+        fingerprint (`callable`): Returns a token of external state the stage reads (part of the cache key), e.g. the
+            ETag of a file on S3
+        cache (`bool`): Whether the outputs are cached. Stages with side effects that must always happen set False
+        background (`bool`): Run on the background writer thread, e.g. for checkpoints no other stage waits for
+    """
+
+    def __init__(self, name: str, func, inputs: list = (), outputs: list = (), params: dict = None, targets: list = (),
+                 fingerprint=None, cache: bool = True, background: bool = False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.targets = list(targets)
+        self.fingerprint = fingerprint
+        self.cache = cache
+        self.background = background
+
+    def source_hash(self) -> str:
+        """Hash of the stage function's source, so editing the function invalidates its cache"""
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = getattr(self.func, '__qualname__', repr(self.func))
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def key(self, input_fingerprints: dict) -> str:
+        """Cache key of the stage for the given input fingerprints"""
+        token = {'name': self.name,
+                 'source': self.source_hash(),
+                 'params': self.params,
+                 'inputs': input_fingerprints,
+                 'external': self.fingerprint() if self.fingerprint else None}
+        return hashlib.sha256(json.dumps(token, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Pipeline:
+    """Runs stages in dependency order with output caching
+
+    Args:
+        stages (`list`): `Stage` objects; every input must be the output of exactly one stage
+        cache_dir (`str`): Directory for cached stage outputs. None disables the cache
+        n_jobs (`int`): Maximum number of stages running at the same time
+    """
+
+    def __init__(self, stages: list, cache_dir: str = None, n_jobs: int = 1):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.n_jobs = n_jobs
+        self.producer = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producer:
+                    raise ValueError(f'{output!r} is produced by both {self.producer[output]} and {stage.name}')
+                self.producer[output] = stage.name
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in self.producer]
+            if missing:
+                raise ValueError(f'Stage {stage.name} needs {missing}, which no stage produces')
+        self.dependencies = {stage.name: {self.producer[name] for name in stage.inputs} for stage in stages}
+        self._check_acyclic()
+        self.timings = []
+
+    def _check_acyclic(self):
+        """Raises ValueError if the stages depend on each other in a cycle"""
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Stages depend on each other in a cycle through {name}')
+            visiting.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _cache_path(self, stage: Stage, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{stage.name}-{key[:16]}.pkl')
+
+    def _load_cached(self, stage: Stage, key: str):
+        """Returns the cached outputs of the stage for key, or None if they aren't cached (or a target is missing)"""
+        if not stage.cache or self.cache_dir is None or not all(os.path.exists(target) for target in stage.targets):
+            return None
+        try:
+            with open(self._cache_path(stage, key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _save_cached(self, stage: Stage, key: str, outputs: dict):
+        """Caches the outputs under key, replacing older cache entries of the stage"""
+        if not stage.cache or self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        path = self._cache_path(stage, key)
+        os.replace(temporary_path, path)
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(f'{stage.name}-') and os.path.join(self.cache_dir, filename) != path:
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def _save_cached_in_background(self, stage: Stage, key: str, outputs: dict):
+        """Writes a cache entry; a failed write only means the stage reruns next time"""
+        try:
+            self._save_cached(stage, key, outputs)
+        except Exception as e:
+            logger.warning(f'Could not cache the outputs of stage {stage.name} and got error {e}')
+
+    def _run_stage(self, stage: Stage, values: dict, fingerprints: dict, force: bool, writer) -> tuple:
+        """Loads the stage's outputs from the cache or runs it, caching the outputs with the writer executor.
+
+        Returns (outputs, key, status, seconds, metrics), where metrics are the measurements of src/profiling.py for a
+        stage that ran, plus the memory held by its DataFrame and array outputs (output_mb)
+        """
+        start = time.perf_counter()
+        key = stage.key({name: fingerprints[name] for name in stage.inputs})
+        outputs = None if force else self._load_cached(stage, key)
+        status = 'cached'
+        metrics = {}
+        if outputs is None:
+            with profiling.stage(stage.name) as metrics:
+                result = stage.func(**{name: values[name] for name in stage.inputs}, **stage.params)
+                if len(stage.outputs) == 1:
+                    result = (result,)
+                outputs = dict(zip(stage.outputs, result if stage.outputs else ()))
+                metrics['rows'] = profiling.count_rows(next(iter(outputs.values()), None))
+            if stage.cache and self.cache_dir is not None:
+                self.writes.append(writer.submit(self._save_cached_in_background, stage, key, outputs))
+            status = 'ran'
+        seconds = time.perf_counter() - start
+        sizes = [size for size in map(profiling.memory_mb, outputs.values()) if size is not None]
+        metrics['output_mb'] = sum(sizes) if sizes else None
+        return outputs, key, status, seconds, metrics
+
+    def run(self, force: list = ()) -> dict:
+        """Runs the pipeline and returns all stage outputs by name
+
+        Args:
+            force (`list`): Names of stages to rerun even if their outputs are cached
+        """
+        unknown = set(force) - set(self.stages)
+        if unknown:
+            raise ValueError(f'Unknown stages {sorted(unknown)}; the stages are {sorted(self.stages)}')
+
+        values, fingerprints = {}, {}
+        self.timings = []
+        pending = dict(self.stages)
+        running = {}
+        finished = set()
+        self.writes = []
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(self.n_jobs, 1)) as executor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-writer') as writer:
+            while pending or running:
+                ready = [name for name in pending if self.dependencies[name] <= finished]
+                for name in ready:
+                    stage = pending.pop(name)
+                    pool = writer if stage.background else executor
+                    running[pool.submit(self._run_stage, stage, values, fingerprints, name in force, writer)] = name
+                    logger.info(f'Started stage {name}')
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs, key, status, seconds, metrics = future.result()  # Re-raises the stage's exception
+                    finished.add(name)
+                    values.update(outputs)
+                    fingerprints.update({output: f'{key}:{output}' for output in outputs})
+                    self.timings.append({'stage': name, 'status': status, 'seconds': seconds,
+                                         'cpu_seconds': metrics.get('cpu_seconds'),
+                                         'peak_rss_mb': metrics.get('peak_rss_mb'), 'rows': metrics.get('rows'),
+                                         'output_mb': metrics.get('output_mb')})
+                    logger.info(f'Finished stage {name} ({status}) in {seconds:.2f}s')
+            wait(self.writes)
+        self.total_seconds = time.perf_counter() - started
+        return values
+
+    def summary(self) -> str:
+        """Per stage timing table of the last run, in the order the stages finished"""
+        lines = [f"{'stage':<20}{'status':>8}{'seconds':>10}{'cpu s':>9}{'peak MB':>9}{'out MB':>9}{'rows':>9}"]
+        for timing in self.timings:
+            cpu = '' if timing['cpu_seconds'] is None else f"{timing['cpu_seconds']:.2f}"
+            peak = '' if timing['peak_rss_mb'] is None else f"{timing['peak_rss_mb']:.0f}"
+            output = '' if timing['output_mb'] is None else f"{timing['output_mb']:.1f}"
+            rows = '' if timing['rows'] is None else timing['rows']
+            lines.append(f"{timing['stage']:<20}{timing['status']:>8}{timing['seconds']:>10.2f}{cpu:>9}{peak:>9}"
+                         f"{output:>9}{rows:>9}")
+        lines.append(f"{'total (wall)':<20}{'':>8}{self.total_seconds:>10.2f}")
+        return '\n'.join(lines)
@@ -0,0 +1,307 @@
+"""This module measures where the pipeline scripts and the app spend their time and memory
+
+`stage()` is a context manager (and `profiled()` the decorator version) that records, per named stage:
+- wall_seconds: elapsed wall clock time
+- cpu_seconds: CPU time of the whole process (includes other threads, e.g. concurrent pipeline stages or BLAS)
+- peak_rss_mb: the process' peak resident memory after the stage, and rss_growth_mb: how much the stage raised it
+- rows: number of rows the stage handled, if the caller sets it (`with stage('featurize') as metrics:
+  metrics['rows'] = len(df)`) or, for `profiled()`, the length of the return value
+
+Measurements are aggregated by stage name in a `StageRecorder` (calls, totals and maximums), so it stays small in
+a long running app. Setting PROFILE_DIR additionally dumps a profile of every stage to PROFILE_DIR/<stage>.prof
+(cProfile; view with `python -m pstats` or snakeviz), or PROFILE_DIR/<stage>.html with PROFILER=pyinstrument if
+pyinstrument is installed. `write_report()` saves a machine readable JSON run report (to PROFILE_REPORT, e.g.
+data/run_report.json) and `regressions()` compares it with the report of the previous run.
+
+Usage:
+    with profiling.stage('featurize') as metrics:
+        df = featurize(games)
+        metrics['rows'] = len(df)
+    profiling.write_report()
+"""
+
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak memory isn't recorded there
+    resource = None
+
+logger = logging.getLogger(__file__)
+
+# Directory for per stage profiles and the profiler ('cprofile' or 'pyinstrument'); profiling is off without a directory
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+
+# Default path of the JSON run report written by write_report()
+PROFILE_REPORT = os.environ.get('PROFILE_REPORT')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the process in MB, or None where the resource module isn't available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # Bytes on macOS, KB on Linux
+
+
+def count_rows(value) -> int:
+    """Number of rows of a DataFrame, array or list (the first element of a tuple), or None for other values"""
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    if value is None or isinstance(value, (str, bytes, dict)):
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def memory_mb(value) -> float:
+    """Memory held by a DataFrame or Series (including the objects of object columns) or an in-memory array in MB, or
+    None for other values"""
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)  # Per column for a DataFrame, a number for a Series
+        return float(usage.sum() if hasattr(usage, 'sum') else usage) / 2 ** 20
+    if hasattr(value, 'nbytes'):
+        # A memory mapped array (np.memmap) is backed by its file, not by the process' memory
+        return 0.0 if getattr(value, 'filename', None) else value.nbytes / 2 ** 20
+    return None
+
+
+class StageRecorder:
+    """Thread-safe per stage aggregates of wall time, CPU time, peak memory and row counts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    def record(self, name: str, wall_seconds: float, cpu_seconds: float, peak_rss_mb: float = None,
+               rss_growth_mb: float = None, rows: int = None):
+        """Adds one measurement of a stage"""
+        with self._lock:
+            stats = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'max_wall_seconds': 0.0,
+                                                  'cpu_seconds': 0.0, 'peak_rss_mb': None, 'rss_growth_mb': None,
+                                                  'rows': None})
+            stats['calls'] += 1
+            stats['wall_seconds'] += wall_seconds
+            stats['max_wall_seconds'] = max(stats['max_wall_seconds'], wall_seconds)
+            stats['cpu_seconds'] += cpu_seconds
+            if peak_rss_mb is not None:
+                stats['peak_rss_mb'] = max(stats['peak_rss_mb'] or 0.0, peak_rss_mb)
+                stats['rss_growth_mb'] = max(stats['rss_growth_mb'] or 0.0, rss_growth_mb)
+            if rows is not None:
+                stats['rows'] = (stats['rows'] or 0) + rows
+
+    def as_dict(self) -> dict:
+        """Returns a copy of the aggregates by stage name, in the order the stages were first recorded"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.stages.items()}
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+
+
+# One recorder per process (i.e. per pipeline script run or gunicorn worker)
+recorder = StageRecorder()
+
+
+# Whether the current thread is already profiling a stage; nested stages are measured but not profiled separately
+_active = threading.local()
+
+
+class _StageProfiler:
+    """Profiles one stage with cProfile or pyinstrument and dumps the profile to profile_dir"""
+
+    def __init__(self, name: str, profile_dir: str, profiler: str):
+        self.path = os.path.join(profile_dir, name.replace('/', '_'))
+        self.profiler = None
+        if profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+                self.profiler, self.kind = Profiler(), 'pyinstrument'
+            except ImportError:
+                logger.warning('pyinstrument is not installed, profiling with cProfile instead')
+        if self.profiler is None:
+            import cProfile
+            self.profiler, self.kind = cProfile.Profile(), 'cprofile'
+
+    def start(self):
+        if getattr(_active, 'profiling', False):
+            self.profiler = None
+            return
+        try:
+            if self.kind == 'pyinstrument':
+                self.profiler.start()
+            else:
+                self.profiler.enable()
+        except (RuntimeError, ValueError) as e:  # Another stage in this process is being profiled at the same time
+            logger.debug(f'Not profiling {self.path}, got error: {e}')
+            self.profiler = None
+            return
+        _active.profiling = True
+
+    def stop(self):
+        if self.profiler is None:
+            return
+        _active.profiling = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if self.kind == 'pyinstrument':
+            self.profiler.stop()
+            with open(self.path + '.html', 'w') as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path + '.prof')
+        logger.debug(f'Saved profile to {self.path}')
+
+
+@contextmanager
+def stage(name: str, rows: int = None, profile_dir: str = None, stage_recorder: StageRecorder = None):
+    """Measures the code in the with block as stage name
+
+    Args:
+        name (`str`): Stage name; measurements of the same name are aggregated
+        rows (`int`): Number of rows the stage handles, if known upfront. Can also be set via the yielded dictionary
+        profile_dir (`str`): Dump a profile of the stage here. Default: PROFILE_DIR (no profile if not set)
+        stage_recorder (`StageRecorder`): Default: the module's recorder
+
+    Yields:
+        metrics (`dict`): Filled in with the measurements when the block exits; set metrics['rows'] inside the block
+    """
+    profile_dir = profile_dir or PROFILE_DIR
+    profiler = _StageProfiler(name, profile_dir, PROFILER) if profile_dir else None
+    metrics = {'stage': name, 'rows': rows}
+    peak_before = peak_rss_mb()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    if profiler:
+        profiler.start()
+    try:
+        yield metrics
+    finally:
+        if profiler:
+            profiler.stop()
+        peak_after = peak_rss_mb()
+        metrics.update({'wall_seconds': time.perf_counter() - wall_start,
+                        'cpu_seconds': time.process_time() - cpu_start,
+                        'peak_rss_mb': peak_after,
+                        'rss_growth_mb': None if peak_after is None else peak_after - peak_before})
+        (stage_recorder or recorder).record(name, metrics['wall_seconds'], metrics['cpu_seconds'],
+                                            metrics['peak_rss_mb'], metrics['rss_growth_mb'], metrics['rows'])
+        logger.debug(f"Stage {name} took {metrics['wall_seconds']:.2f}s wall, {metrics['cpu_seconds']:.2f}s CPU")
+
+
+def profiled(name: str = None):
+    """Decorator that measures every call of the function as a stage (see stage()), counting the rows it returns
+
+    Args:
+        name (`str`): Stage name. Default: the function's name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            with stage(name or func.__name__) as metrics:
+                result = func(*args, **kwargs)
+                metrics['rows'] = count_rows(result)
+            return result
+        return wrapped
+    return decorator
+
+
+def build_report(metadata: dict = None, stage_recorder: StageRecorder = None) -> dict:
+    """JSON serializable run report: when and where the run happened, metadata and the per stage measurements"""
+    stage_recorder = stage_recorder or recorder
+    return {'started_at': stage_recorder.started_at,
+            'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'command': ' '.join(sys.argv),
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': peak_rss_mb(),
+            'metadata': metadata or {},
+            'stages': stage_recorder.as_dict()}
+
+
+def load_report(path: str) -> dict:
+    """Loads a report saved by write_report(), or returns None if there is none (or it's unreadable)"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def regressions(previous: dict, current: dict, threshold: float = 0.25, min_seconds: float = 0.5,
+                metrics: tuple = ('wall_seconds', 'cpu_seconds', 'peak_rss_mb')) -> list:
+    """Stages that got slower or used more memory than in the previous report
+
+    Args:
+        previous (`dict`), current (`dict`): Reports built by build_report()
+        threshold (`float`): Relative increase that counts as a regression, e.g. 0.25 for 25% slower
+        min_seconds (`float`): Ignore times below this in both runs (too noisy)
+        metrics (`tuple`): Stage measurements to compare; names ending in _mb are memory in MB, the others seconds
+
+    Returns:
+        regressions (`list`): One human readable line per regression
+    """
+    found = []
+    previous_stages = (previous or {}).get('stages', {})
+    for name, stats in current.get('stages', {}).items():
+        before = previous_stages.get(name)
+        if not before:
+            continue
+        for metric in metrics:
+            unit, floor = (' MB', 0.0) if metric.endswith('_mb') else ('s', min_seconds)
+            old, new = before.get(metric), stats.get(metric)
+            if old is None or new is None or max(old, new) < floor:
+                continue
+            if old > 0 and new > old * (1 + threshold):
+                found.append(f'{name}: {metric} went from {old:.2f}{unit} to {new:.2f}{unit} (+{new / old - 1:.0%})')
+    return found
+
+
+def write_report(path: str = None, metadata: dict = None, stage_recorder: StageRecorder = None) -> dict:
+    """Saves the run report as JSON and logs the regressions against the report previously saved there
+
+    Args:
+        path (`str`): Report path. Default: PROFILE_REPORT; nothing is written if neither is set
+        metadata (`dict`): Extra information about the run, e.g. the number of games and k
+
+    Returns:
+        report (`dict`)
+    """
+    report = build_report(metadata, stage_recorder)
+    path = path or PROFILE_REPORT
+    if not path:
+        return report
+
+    for regression in regressions(load_report(path), report):
+        logger.warning(f'Performance regression since the last run - {regression}')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Saved run report to {path}')
+    return report
+
+
+def format_table(stages: dict) -> str:
+    """Text table of the per stage measurements, e.g. for logging at the end of a run"""
+    lines = [f"{'stage':<28}{'calls':>6}{'wall s':>9}{'cpu s':>9}{'peak MB':>9}{'rows':>9}"]
+    for name, stats in stages.items():
+        peak = '' if stats['peak_rss_mb'] is None else f"{stats['peak_rss_mb']:.0f}"
+        rows = '' if stats['rows'] is None else stats['rows']
+        lines.append(f"{name:<28}{stats['calls']:>6}{stats['wall_seconds']:>9.2f}{stats['cpu_seconds']:>9.2f}"
+                     f"{peak:>9}{rows:>9}")
+    return '\n'.join(lines)
@@ -0,0 +1,96 @@
+"""This module computes the blended ranking score, which orders the games within a cluster
+
+Ordering by `average_user_rating` alone lets obscure games with a handful of perfect ratings outrank classics.
+The score is a weighted sum of standardized (z-scored) components, each oriented so that higher is better:
+- bayes_average: BoardGameGeek's Bayesian average rating, which shrinks ratings of rarely rated games towards the mean
+- rating: average_user_rating
+- popularity: log(1 + number_of_users_own)
+- recency: year_published (years before RECENCY_MIN_YEAR count as RECENCY_MIN_YEAR)
+- centrality: negative distance to the game's KMeans centroid, i.e. how typical the game is for its cluster
+
+Missing values count as the catalog average (z-score 0). Scores are computed for the whole catalog at once at
+ingest time (or with `ingest.py rescore`, which doesn't need re-clustering), and stored in the `score` column.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+# Used when config.yml has no ranking section
+DEFAULT_WEIGHTS = {'bayes_average': 1.0, 'rating': 0.0, 'popularity': 0.5, 'recency': 0.1, 'centrality': 0.2}
+
+# Older games (including ancient ones like Go, published in -2200) all count as published in this year
+RECENCY_MIN_YEAR = 1950
+
+# Columns (as in the `boardgames` table) needed to compute the score
+SCORE_COLUMNS = ['game_id', 'bayes_average', 'average_user_rating', 'number_of_users_own', 'year_published',
+                 'centroid_distance']
+
+
+def load_ranking_weights(config_path: str) -> dict:
+    """Returns the ranking weights from the `ranking` section of the config file, or the defaults if there is none"""
+    import yaml  # Only needed by the callers that read config.yml (ingest.py, the in-memory app catalog)
+
+    try:
+        with open(config_path, 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info(f'Loaded configurations from {config_path}')
+    except FileNotFoundError as e:
+        logger.warning(f"Didn't find the config file at {config_path}, using the default ranking weights. Got error: {e}")
+        return DEFAULT_WEIGHTS
+    return (config or {}).get('ranking') or DEFAULT_WEIGHTS
+
+
+def standardize(values) -> np.ndarray:
+    """z-scores values, with missing values (None/NaN) and constant columns mapped to 0"""
+    values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    present = ~np.isnan(values)
+    if not present.any():
+        return np.zeros(len(values))
+    std = values[present].std()
+    z = (values - values[present].mean()) / std if std > 0 else np.zeros(len(values))
+    z[~present] = 0.0
+    return z
+
+
+def score_components(games: list) -> dict:
+    """Returns the standardized score components (see module docstring) for games with SCORE_COLUMNS"""
+    def column(name):
+        return [game.get(name) for game in games]
+
+    owners = np.array([np.nan if value is None else value for value in column('number_of_users_own')], dtype=np.float64)
+    years = np.array([np.nan if value is None or value <= 0 else value for value in column('year_published')],
+                     dtype=np.float64)
+    distances = np.array([np.nan if value is None else value for value in column('centroid_distance')], dtype=np.float64)
+
+    return {'bayes_average': standardize(column('bayes_average')),
+            'rating': standardize(column('average_user_rating')),
+            'popularity': standardize(np.log1p(np.maximum(owners, 0))),
+            'recency': standardize(np.maximum(years, RECENCY_MIN_YEAR)),
+            'centrality': standardize(-distances)}
+
+
+def score_games(games: list, weights: dict = None) -> np.ndarray:
+    """Computes the blended score of every game
+
+    Args:
+        games (`list`): Games as dictionaries with the SCORE_COLUMNS (missing keys count as missing values)
+        weights (`dict`): Weight per component (bayes_average, rating, popularity, recency, centrality).
+            Components left out get weight 0. Default: DEFAULT_WEIGHTS
+
+    Returns:
+        scores (`np.ndarray`): One score per game, in the order of games
+    """
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    components = score_components(games)
+    unknown = set(weights) - set(components)
+    if unknown:
+        raise ValueError(f'Unknown ranking components {sorted(unknown)}; expected some of {sorted(components)}')
+
+    scores = np.zeros(len(games))
+    for component, weight in weights.items():
+        scores += weight * components[component]
+    logger.info(f'Scored {len(games)} games with weights {weights}')
+    return scores
@@ -0,0 +1,144 @@
+"""This module holds the request handling logic of the JSON recommendation API
+
+It is shared by the Flask app (app.py) and the async ASGI app (asgi.py), which only differ in how they
+receive requests and send responses. Handlers take:
+- a backend answering the queries: the in-memory `Catalog` or an object with the same methods backed by SQL
+(`cluster_of_game_id`, `cluster_of_game_name`, `clusters_of_game_ids`, `top_games_in_cluster`, `games_by_ids`)
+- the request parameters (query string or JSON body) as a mapping
+- the app configuration as a mapping (MAX_ROWS_SHOW, API_MAX_PER_PAGE, API_MAX_BATCH_SIZE)
+
+and return a (payload, HTTP status) tuple.
+"""
+
+import hashlib
+import json
+
+from src.filters import parse_filters
+
+# Fields returned per game by the JSON API; the description is left out to keep responses compact
+API_COLUMNS = ['game_id', 'name', 'average_user_rating', 'average_user_rating_weight', 'number_of_users_own',
+               'year_published', 'min_age', 'thumbnail', 'score']
+
+
+def api_games(games: list) -> list:
+    """Strips games down to the API fields"""
+    return [{column: game[column] for column in API_COLUMNS} for game in games]
+
+
+def pagination(args, config) -> tuple:
+    """Parses the 1-based page and per_page parameters; raises ValueError (or TypeError) for invalid values"""
+    page = int(args.get('page', 1))
+    per_page = int(args.get('per_page', config["MAX_ROWS_SHOW"]))
+    if page < 1 or not 1 <= per_page <= config["API_MAX_PER_PAGE"]:
+        raise ValueError(f'page must be >= 1 and per_page between 1 and {config["API_MAX_PER_PAGE"]}')
+    return page, per_page
+
+
+def recommendations(backend, args, config) -> tuple:
+    """Top games in the cluster of a single game_id, game_name or cluster_id parameter, one page at a time
+
+    The optional filter parameters (age, min_year, max_year, min_complexity, max_complexity; see filters.py)
+    restrict the games returned.
+
+    Returns:
+        (payload, status): payload has the cluster, page, per_page, next_page (None on the last page) and games
+    """
+    try:
+        page, per_page = pagination(args, config)
+        filters = parse_filters(args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    try:
+        if args.get('game_id'):
+            cluster = backend.cluster_of_game_id(args['game_id'].strip())
+        elif args.get('game_name'):
+            cluster = backend.cluster_of_game_name(args['game_name'])
+        elif args.get('cluster_id'):
+            cluster = int(args['cluster_id'])
+        else:
+            return {'error': 'Provide one of game_id, game_name or cluster_id'}, 400
+        if cluster is None:  # The game exists but wasn't clustered, so there is nothing to recommend
+            raise LookupError('The matching game has no cluster')
+    except ValueError:
+        return {'error': 'cluster_id must be an integer'}, 400
+    except LookupError:
+        return {'error': 'No matching game found'}, 404
+
+    # Fetch one extra game to know whether there is a next page without counting the cluster
+    games = backend.top_games_in_cluster(cluster, per_page + 1, (page - 1) * per_page, filters)
+    return {'cluster': cluster,
+            'page': page,
+            'per_page': per_page,
+            'next_page': page + 1 if len(games) > per_page else None,
+            'games': api_games(games[:per_page])}, 200
+
+
+def batch_recommendations(backend, body, config) -> tuple:
+    """Recommendations for many games at once
+
+    Expects a body like {"game_ids": ["13", "822"], "per_page": 10}, optionally with filter parameters
+    (e.g. "age": 8, "max_complexity": 2.5). All clusters are resolved at once and
+    the top games of every distinct cluster are returned only once, keyed by cluster.
+
+    Returns:
+        (payload, status): payload has clusters ({game_id: cluster}), missing game ids and recommendations ({cluster: games})
+    """
+    body = body if isinstance(body, dict) else {}
+    game_ids = body.get('game_ids')
+    if not isinstance(game_ids, list) or not game_ids:
+        return {'error': 'Expected a JSON body with a non-empty list of game_ids'}, 400
+    if len(game_ids) > config["API_MAX_BATCH_SIZE"]:
+        return {'error': f'At most {config["API_MAX_BATCH_SIZE"]} game_ids per request'}, 400
+    try:
+        _, per_page = pagination({'per_page': body.get('per_page', config["MAX_ROWS_SHOW"])}, config)
+        filters = parse_filters(body)
+    except (ValueError, TypeError) as e:
+        return {'error': str(e)}, 400
+
+    clusters = backend.clusters_of_game_ids(game_ids)
+    recommendations_ = {str(cluster): api_games(backend.top_games_in_cluster(cluster, per_page, 0, filters))
+                        for cluster in sorted(set(clusters.values()) - {None})}
+    return {'clusters': clusters,
+            'missing': [str(game_id) for game_id in game_ids if str(game_id) not in clusters],
+            'recommendations': recommendations_}, 200
+
+
+def similar_games(backend, index, args, config) -> tuple:
+    """The k games closest to a game_id in feature space, which may come from any cluster
+
+    index is a `SimilarityIndex` (see similarity.py) or anything else with the same `neighbours()` method,
+    e.g. the precomputed neighbour lists of neighbours.py.
+
+    Returns:
+        (payload, status): payload has the game_id and the similar games, each with its distance to the query game
+    """
+    if index is None:
+        return {'error': 'Similar games not available; set SIMILARITY_INDEX_PATH or NEIGHBOURS_PATH'}, 503
+    game_id = str(args.get('game_id', '')).strip()
+    if not game_id:
+        return {'error': 'Provide a game_id'}, 400
+    try:
+        k = int(args.get('k', config["MAX_ROWS_SHOW"]))
+    except ValueError:
+        k = 0
+    if not 1 <= k <= config["API_MAX_PER_PAGE"]:
+        return {'error': f'k must be between 1 and {config["API_MAX_PER_PAGE"]}'}, 400
+
+    neighbours = index.neighbours([game_id], k, config["SIMILARITY_NPROBE"]).get(game_id)
+    if neighbours is None:
+        return {'error': 'No matching game found'}, 404
+    games = {game['game_id']: game for game in backend.games_by_ids([neighbour for neighbour, _ in neighbours])}
+    return {'game_id': game_id,
+            'games': [dict(api_games([games[neighbour]])[0], distance=distance)
+                      for neighbour, distance in neighbours if neighbour in games]}, 200
+
+
+def dump_json(payload) -> bytes:
+    """Serializes a payload as compact JSON"""
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def etag(body: bytes) -> str:
+    """Strong ETag for a response body"""
+    return f'"{hashlib.sha1(body).hexdigest()}"'
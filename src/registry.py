@@ -0,0 +1,312 @@
+"""This module keeps versioned model/data artifacts in a local registry, so a bad retrain can be rolled back in seconds
+
+Every pipeline run used to overwrite models/kmeans*, data/games_clustered.json and the neighbour lists in place.
+Registered versions are instead stored side by side and never modified:
+
+    models/registry/
+        versions/<version>/      model bundle (model/), games_clustered.json, similarity.npz, game_neighbours.json, metadata.json
+        ACTIVE                   id of the version the serving app uses
+        history.json             previously active versions, most recent last (what rollback returns to)
+
+A version id is derived from the content of its artifacts (the first 12 hex digits of a SHA-256 over their hashes), so
+registering the same artifacts twice yields the same version. metadata.json records the silhouette score, k and seed
+(from the model bundle, see model_bundle.py), the hash of the clustered data snapshot, the fit time and the hash of
+every file.
+
+ACTIVE is replaced atomically. app.py/asgi.py (SERVING_BACKEND = 'memory' with MODEL_REGISTRY_PATH set) check it every
+CATALOG_CHECK_SECONDS and swap in the catalog and neighbour lists of the new version, so activating or rolling back
+takes effect in every worker without a restart. Setting MODEL_VERSION pins a worker to one version instead.
+
+Usage:
+    python -m src.registry register --model models/kmeans --data data/games_clustered.json \
+        --similarity models/similarity.npz --neighbours data/game_neighbours.json --activate
+    python -m src.registry list
+    python -m src.registry activate <version>
+    python -m src.registry rollback
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import logging.config
+import os
+import shutil
+import sys
+import tempfile
+
+from src.hashing import file_sha256
+from src.model_bundle import MANIFEST_FILENAME
+
+logging_config = './config/logging/local.conf'
+try:
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+except:
+    logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+logger = logging.getLogger(__file__)
+
+# Artifact name -> file or directory name inside a version
+ARTIFACTS = {'model': 'model',
+             'data': 'games_clustered.json',
+             'similarity': 'similarity.npz',
+             'neighbours': 'game_neighbours.json'}
+
+# Length of version ids (hex digits of the content hash)
+VERSION_LENGTH = 12
+
+
+def _write_atomically(filepath: str, text: str):
+    """Writes text to a temporary file next to filepath and renames it, so readers never see a partial file"""
+    directory = os.path.dirname(filepath) or '.'
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(temporary_path, filepath)
+
+
+def artifact_hashes(path: str) -> dict:
+    """Returns {relative file path: sha256} of a file, or of every file under a directory"""
+    if os.path.isfile(path):
+        return {os.path.basename(path): file_sha256(path)}
+    hashes = {}
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(directory, filename)
+            hashes[os.path.relpath(filepath, os.path.dirname(path))] = file_sha256(filepath)
+    return hashes
+
+
+class ModelRegistry:
+    """Content-addressed store of model/data versions with an active version pointer
+
+    Args:
+        root (`str`): Registry directory, e.g. models/registry (created on the first registration)
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.active_path = os.path.join(root, 'ACTIVE')
+        self.history_path = os.path.join(root, 'history.json')
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self.versions_dir, version)
+
+    def artifact_path(self, version: str, artifact: str) -> str:
+        """Path of an artifact (see ARTIFACTS) of a version; the file may not exist if it wasn't registered"""
+        return os.path.join(self.version_dir(version), ARTIFACTS[artifact])
+
+    def has_artifact(self, version: str, artifact: str) -> bool:
+        return os.path.exists(self.artifact_path(version, artifact))
+
+    def register(self, artifacts: dict, metadata: dict = None) -> str:
+        """Copies artifacts into a new version (or returns the existing version with the same content)
+
+        Args:
+            artifacts (`dict`): artifact name (see ARTIFACTS) -> local path. 'model' and 'data' are required
+            metadata (`dict`): Extra JSON serializable information, e.g. a note on what changed
+
+        Returns:
+            version (`str`): Id of the version
+        """
+        missing = {'model', 'data'} - set(artifacts)
+        unknown = set(artifacts) - set(ARTIFACTS)
+        if missing or unknown:
+            raise ValueError(f'Artifacts must include {sorted(missing)} and can only be {sorted(ARTIFACTS)}; '
+                             f'got unknown {sorted(unknown)}')
+
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.versions_dir, prefix='.staging-')
+        os.chmod(staging, 0o755)  # mkdtemp creates the directory readable by its owner only
+        try:
+            files = {}
+            for artifact, path in sorted(artifacts.items()):
+                target = os.path.join(staging, ARTIFACTS[artifact])
+                if os.path.isdir(path):
+                    shutil.copytree(path, target)
+                else:
+                    shutil.copyfile(path, target)
+                files.update(artifact_hashes(target))
+
+            content_hash = hashlib.sha256(json.dumps(sorted(files.items())).encode()).hexdigest()
+            version = content_hash[:VERSION_LENGTH]
+            if os.path.isdir(self.version_dir(version)):
+                logger.info(f'Artifacts are identical to the registered version {version}')
+                return version
+
+            with open(os.path.join(staging, ARTIFACTS['model'], MANIFEST_FILENAME)) as fp:
+                manifest = json.load(fp)
+            model_metadata = manifest.get('metadata', {})
+            version_metadata = {'version': version,
+                                'registered_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                                'fitted_at': manifest.get('created_at'),
+                                'k': model_metadata.get('k'),
+                                'seed': model_metadata.get('seed'),
+                                'silhouette_score': model_metadata.get('silhouette_score'),
+                                'n_games': model_metadata.get('n_games'),
+                                'data_sha256': files[ARTIFACTS['data']],
+                                'artifacts': sorted(artifacts),
+                                'files': files,
+                                **(metadata or {})}
+            with open(os.path.join(staging, 'metadata.json'), 'w') as fp:
+                json.dump(version_metadata, fp, indent=2)
+            os.rename(staging, self.version_dir(version))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f'Registered version {version} in {self.root}')
+        return version
+
+    def metadata(self, version: str) -> dict:
+        """Returns the metadata.json of a version; raises LookupError for unknown versions"""
+        try:
+            with open(os.path.join(self.version_dir(version), 'metadata.json')) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            raise LookupError(f'Unknown version {version!r} in {self.root}')
+
+    def versions(self) -> list:
+        """Returns the metadata of all versions, oldest registration first"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        versions = [self.metadata(version) for version in os.listdir(self.versions_dir) if not version.startswith('.')]
+        return sorted(versions, key=lambda metadata: (metadata['registered_at'], metadata['version']))
+
+    def active(self):
+        """Returns the id of the active version, or None if no version was activated yet"""
+        try:
+            with open(self.active_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def history(self) -> list:
+        """Previously active versions, most recent last"""
+        try:
+            with open(self.history_path) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return []
+
+    def _set_active(self, version: str, history: list):
+        _write_atomically(self.history_path, json.dumps(history))
+        _write_atomically(self.active_path, version + '\n')
+
+    def activate(self, version: str):
+        """Makes version the active version; the previously active version is kept for rollback()"""
+        self.metadata(version)  # Raises LookupError for unknown versions
+        current = self.active()
+        if version == current:
+            return
+        history = self.history()
+        if current is not None:
+            history.append(current)
+        self._set_active(version, history)
+        logger.info(f'Activated version {version} (previously {current})')
+
+    def rollback(self) -> str:
+        """Reactivates the version that was active before the current one and returns it
+
+        Repeated rollbacks walk further back through the history. Raises LookupError if there is nothing to roll back to
+        """
+        history = self.history()
+        if not history:
+            raise LookupError(f'No previous version to roll back to in {self.root}')
+        version = history.pop()
+        current = self.active()
+        self._set_active(version, history)
+        logger.info(f'Rolled back from version {current} to {version}')
+        return version
+
+    def resolve(self, pinned: str = None):
+        """Version to serve: the pinned version if given, otherwise the active one (None if there is none)"""
+        return pinned or self.active()
+
+    def load_catalog(self, version: str, weights: dict = None):
+        """Loads the catalog of a version (scored with the ranking weights), with its neighbour lists (or similarity
+        index) as `neighbour_index`"""
+        from src.catalog import Catalog
+        from src.neighbours import PrecomputedNeighbours
+        from src.similarity import SimilarityIndex
+
+        catalog = Catalog.from_json(self.artifact_path(version, 'data'), weights)
+        if self.has_artifact(version, 'neighbours'):
+            catalog.neighbour_index = PrecomputedNeighbours.from_json(self.artifact_path(version, 'neighbours'))
+        elif self.has_artifact(version, 'similarity'):
+            catalog.neighbour_index = SimilarityIndex.load(self.artifact_path(version, 'similarity'))
+        return catalog
+
+
+def register(args):
+    """Registers the pipeline outputs as a new version (and activates it if --activate is set)"""
+    artifacts = {artifact: getattr(args, artifact) for artifact in ARTIFACTS if getattr(args, artifact)}
+    registry = ModelRegistry(args.registry)
+    try:
+        version = registry.register(artifacts, {'note': args.note} if args.note else None)
+    except (OSError, ValueError) as e:
+        logger.error(f'Could not register the artifacts and got error {e}')
+        logger.error('Terminating process prematurely')
+        sys.exit()
+    if args.activate:
+        registry.activate(version)
+    print(version)
+
+
+def list_versions(args):
+    """Prints one line per version: id, registration time, k, seed, silhouette score and whether it is active"""
+    registry = ModelRegistry(args.registry)
+    active = registry.active()
+    for metadata in registry.versions():
+        silhouette = metadata.get('silhouette_score')
+        print(f"{'*' if metadata['version'] == active else ' '} {metadata['version']}  {metadata['registered_at']}  "
+              f"k={metadata.get('k')}  seed={metadata.get('seed')}  "
+              f"silhouette={'n/a' if silhouette is None else format(silhouette, '.4f')}  {metadata.get('note', '')}")
+
+
+def activate(args):
+    """Switches the serving app to the given version"""
+    try:
+        ModelRegistry(args.registry).activate(args.version)
+    except LookupError as e:
+        logger.error(e)
+        sys.exit()
+
+
+def rollback(args):
+    """Switches the serving app back to the previously active version"""
+    try:
+        print(ModelRegistry(args.registry).rollback())
+    except LookupError as e:
+        logger.error(e)
+        sys.exit()
+
+
+if __name__ == "__main__":
+    # Setup CLI argument parser
+    parser = argparse.ArgumentParser(description="Register, list, activate and roll back model/data versions")
+    parser.add_argument('-r', '--registry', default='./models/registry', help="Registry directory")
+    subparsers = parser.add_subparsers()
+
+    sb_register = subparsers.add_parser('register', description="Register pipeline outputs as a new version")
+    sb_register.add_argument('--model', default='./models/kmeans', help="Model bundle directory saved by model.py/run.py")
+    sb_register.add_argument('--data', default='./data/games_clustered.json', help="Clustered data saved by model.py/run.py")
+    sb_register.add_argument('--similarity', default=None, help="Similarity index saved by model.py/run.py (optional)")
+    sb_register.add_argument('--neighbours', default=None, help="Neighbour lists saved by src/neighbours.py (optional)")
+    sb_register.add_argument('--note', default=None, help="Note stored in the version metadata")
+    sb_register.add_argument('--activate', action='store_true', help="Make the new version the active version")
+    sb_register.set_defaults(func=register)
+
+    sb_list = subparsers.add_parser('list', description="List registered versions; the active one is marked with *")
+    sb_list.set_defaults(func=list_versions)
+
+    sb_activate = subparsers.add_parser('activate', description="Make a version the active version")
+    sb_activate.add_argument('version', help="Version id, see list")
+    sb_activate.set_defaults(func=activate)
+
+    sb_rollback = subparsers.add_parser('rollback', description="Reactivate the previously active version")
+    sb_rollback.set_defaults(func=rollback)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,157 @@
+"""This module defines the database tables (SQLAlchemy ORM models) shared by ingest.py, app.py and asgi.py
+
+migrate() adds the columns and indexes introduced since a database was created. It only imports SQLAlchemy, so the app can use the models without importing ingest.py (its CLI, logging setup and the
+ranking/NumPy code of the ingestion), and `ingest.py create_db` stays quick to start.
+"""
+
+import logging
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Index, inspect, text
+
+try:
+    from sqlalchemy.orm import declarative_base
+except ImportError:  # SQLAlchemy < 1.4
+    from sqlalchemy.ext.declarative import declarative_base
+
+logger = logging.getLogger(__file__)
+
+Base = declarative_base()
+
+# Defining Table Schema
+class Boardgame(Base):
+    """ Defines the data model for the table `boardgames`. """
+
+    __tablename__ = 'boardgames'
+
+    # Need to add collation argument for two of the columns to avoid odd warnings when uploading to MySQL in RDS
+    # Those warnings are most likely related to UTF-8 characters which need 4 instead of 3 bytes to be stored.
+    # SQLAlchemy Documentation: https://docs.sqlalchemy.org/en/13/core/type_basics.html#sqlalchemy.types.String.__init__
+    # MySQL Documentation: https://dev.mysql.com/doc/refman/8.0/en/charset-unicode-utf8mb4.html
+    # StackOverflow Thread: https://stackoverflow.com/questions/10957238/incorrect-string-value-when-trying-to-insert-utf-8-into-mysql-via-jdbc
+
+    game_id = Column(String(100), primary_key=True, unique=True, nullable=False)
+    name = Column(String(200), unique=False, nullable=False) # Collation Needed
+    image = Column(String(150), unique=False, nullable=True)
+    thumbnail = Column(String(100), unique=False, nullable=True)
+    description = Column(Text, unique=False, nullable=True) # Collation Needed
+    year_published = Column(Integer, unique=False, nullable=True)
+    min_age = Column(Integer, unique=False, nullable=True)
+    number_of_ratings = Column(Integer, unique=False, nullable=True)
+    average_user_rating = Column(Float, unique=False, nullable=True)
+    number_of_ratings_weight = Column(Integer, unique=False, nullable=True)
+    average_user_rating_weight = Column(Float, unique=False, nullable=True)
+    bayes_average = Column(Float, unique=False, nullable=True)
+    number_of_users_own = Column(Integer, unique=False, nullable=True)
+    cluster = Column(Integer, unique=False, nullable=True)
+    centroid_distance = Column(Float, unique=False, nullable=True)  # Distance to the KMeans centroid of the cluster
+    score = Column(Float, unique=False, nullable=True)  # Blended ranking score, see src/ranking.py
+
+    # Serving a cluster is a single range scan in score order
+    __table_args__ = (Index('ix_boardgames_cluster_score', 'cluster', 'score'),)
+
+    def __repr__(self):
+        game_repr = f"<Boardgame(game_id={self.game_id}, name={self.name})>"
+        return game_repr
+
+
+class ClusterTopGame(Base):
+    """ Defines the data model for the table `cluster_top_games`.
+
+    Materialized top N games (by the blended ranking score) for every cluster, built at ingest time.
+    The display columns are copied from `boardgames` so the app can serve a cluster with a single
+    primary key range read instead of sorting the cluster on every request.
+    """
+
+    __tablename__ = 'cluster_top_games'
+
+    cluster = Column(Integer, primary_key=True, nullable=False)
+    rank = Column(Integer, primary_key=True, nullable=False)
+    game_id = Column(String(100), unique=False, nullable=False)
+    name = Column(String(200), unique=False, nullable=False)
+    thumbnail = Column(String(100), unique=False, nullable=True)
+    description = Column(Text, unique=False, nullable=True)
+    year_published = Column(Integer, unique=False, nullable=True)
+    min_age = Column(Integer, unique=False, nullable=True)
+    average_user_rating = Column(Float, unique=False, nullable=True)
+    average_user_rating_weight = Column(Float, unique=False, nullable=True)
+    number_of_users_own = Column(Integer, unique=False, nullable=True)
+    score = Column(Float, unique=False, nullable=True)
+
+    def __repr__(self):
+        top_game_repr = f"<ClusterTopGame(cluster={self.cluster}, rank={self.rank}, game_id={self.game_id})>"
+        return top_game_repr
+
+
+class GameNeighbour(Base):
+    """ Defines the data model for the table `game_neighbours`.
+
+    The top K most similar games (in the model's feature space) of every game, precomputed by src/neighbours.py.
+    """
+
+    __tablename__ = 'game_neighbours'
+
+    game_id = Column(String(100), primary_key=True, nullable=False)
+    rank = Column(Integer, primary_key=True, nullable=False)
+    neighbour_id = Column(String(100), unique=False, nullable=False)
+    distance = Column(Float, unique=False, nullable=False)
+
+    def __repr__(self):
+        neighbour_repr = f"<GameNeighbour(game_id={self.game_id}, rank={self.rank}, neighbour_id={self.neighbour_id})>"
+        return neighbour_repr
+
+
+class DataVersion(Base):
+    """ Defines the data model for the table `data_version`.
+
+    Holds a single row, which ingest.py re-stamps every time the data changes.
+    The app compares the stamp with the one it last saw to know when its caches are stale.
+    """
+
+    __tablename__ = 'data_version'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    version = Column(String(32), unique=False, nullable=False)
+    updated_at = Column(DateTime, unique=False, nullable=False)
+
+    def __repr__(self):
+        version_repr = f"<DataVersion(version={self.version}, updated_at={self.updated_at})>"
+        return version_repr
+
+
+# Columns copied from boardgames into cluster_top_games
+TOP_GAME_COLUMNS = ['game_id', 'name', 'thumbnail', 'description', 'year_published', 'min_age',
+                    'average_user_rating', 'average_user_rating_weight', 'number_of_users_own', 'score']
+
+
+def migrate(engine):
+    """Brings the tables of a database up to date with the models above
+
+    `Base.metadata.create_all()` only creates missing tables, so databases created by an older version of ingest.py
+    lack the columns (e.g. boardgames.score and centroid_distance) and indexes added since. They are added with
+    ALTER TABLE ... ADD COLUMN / CREATE INDEX; existing columns and rows are left untouched.
+
+    Args:
+        engine: SQLAlchemy engine of the database
+    """
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    logger.error(f'Cannot add the NOT NULL column {table.name}.{column.name} to the existing table; '
+                                 f'recreate the table to add it')
+                    continue
+                connection.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} '
+                                        f'{column.type.compile(dialect=engine.dialect)}'))
+                logger.info(f'Added column {column.name} to the {table.name} table')
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                logger.info(f'Created index {index.name} on the {table.name} table')
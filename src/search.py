@@ -0,0 +1,159 @@
+"""This module provides an in-process name search index for boardgames
+
+It replaces `Boardgame.name.like('%...%')`, which cannot use an index (because of the leading wildcard)
+and returns an arbitrary match. The index is built once from (game_id, name, cluster, number_of_users_own) rows,
+e.g. from the `boardgames` table when the app starts, and answers queries without touching the database.
+
+Names are normalized (lower-cased, accents and punctuation stripped) and indexed in two ways:
+1. A sorted list of (token, row) pairs, which answers word-prefix queries via binary search ('tick' -> 'Ticket to Ride')
+2. A trigram index, which answers substring queries inside words ('atan' -> 'Catan')
+
+Matches are ranked by relevance tier first and popularity (number_of_users_own) second:
+0. Exact name match
+1. Name starts with the query
+2. Every query word is a prefix of some word in the name
+3. Query appears anywhere in the name
+"""
+
+import bisect
+import logging
+import re
+import unicodedata
+from collections import namedtuple
+
+logger = logging.getLogger(__file__)
+
+# A single search result; `tier` is the relevance tier described in the module docstring (lower is better)
+Match = namedtuple('Match', ['game_id', 'name', 'cluster', 'number_of_users_own', 'tier'])
+
+EXACT, STARTS_WITH, WORD_PREFIX, SUBSTRING = range(4)
+
+_NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_name(name: str) -> str:
+    """Lower-cases a name, strips accents and replaces punctuation with single spaces
+
+    Args:
+        name (`str`): The name (or query) to normalize
+
+    Returns:
+        normalized (`str`): e.g. 'Pandemic: Legacy – Season 1' -> 'pandemic legacy season 1'
+    """
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(name))
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_ALPHANUMERIC.sub(' ', without_accents.lower()).strip()
+
+
+def trigrams(text: str) -> set:
+    """Returns the set of 3-character substrings of text (spaces included, so trigrams can span words)"""
+    return {text[ii:ii + 3] for ii in range(len(text) - 2)}
+
+
+class NameIndex:
+    """Prefix & trigram index over boardgame names
+
+    Args:
+        games (`iterable`): rows of (game_id, name, cluster, number_of_users_own), e.g. the result of
+        `session.query(Boardgame.game_id, Boardgame.name, Boardgame.cluster, Boardgame.number_of_users_own).all()`
+    """
+
+    def __init__(self, games):
+        self.game_ids = []
+        self.names = []
+        self.clusters = []
+        self.popularity = []
+        self.normalized = []
+
+        tokens = []
+        self.trigram_index = {}
+        for row, (game_id, name, cluster, number_of_users_own) in enumerate(games):
+            normalized = normalize_name(name)
+            self.game_ids.append(game_id)
+            self.names.append(name)
+            self.clusters.append(cluster)
+            self.popularity.append(number_of_users_own or 0)
+            self.normalized.append(normalized)
+
+            for token in set(normalized.split()):
+                tokens.append((token, row))
+            for trigram in trigrams(normalized):
+                self.trigram_index.setdefault(trigram, []).append(row)
+
+        # Sorted tokens allow prefix lookups with binary search
+        tokens.sort()
+        self.tokens = [token for token, _ in tokens]
+        self.token_rows = [row for _, row in tokens]
+
+        logger.info(f'Built name index over {len(self.names)} games ({len(self.tokens)} tokens, '
+                    f'{len(self.trigram_index)} trigrams)')
+
+    def __len__(self):
+        return len(self.names)
+
+    def _rows_with_token_prefix(self, prefix: str) -> set:
+        """Returns the rows with at least one name token starting with prefix"""
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\uffff')
+        return set(self.token_rows[start:end])
+
+    def _rows_containing(self, query: str) -> set:
+        """Returns the rows whose normalized name contains query as a substring"""
+        if len(query) < 3:  # Too short for trigrams; a plain scan is cheap enough for 1-2 characters
+            return {row for row, normalized in enumerate(self.normalized) if query in normalized}
+
+        candidates = None
+        # Intersect the shortest posting lists first to keep the candidate set small
+        for trigram in sorted(trigrams(query), key=lambda t: len(self.trigram_index.get(t, ()))):
+            rows = self.trigram_index.get(trigram)
+            if not rows:
+                return set()
+            candidates = set(rows) if candidates is None else candidates.intersection(rows)
+            if not candidates:
+                return set()
+        # Trigrams can all be present without being contiguous, so verify the candidates
+        return {row for row in candidates if query in self.normalized[row]}
+
+    def _tier(self, row: int, query: str, words: list) -> int:
+        """Relevance tier of a candidate row for the given normalized query"""
+        normalized = self.normalized[row]
+        if normalized == query:
+            return EXACT
+        if normalized.startswith(query):
+            return STARTS_WITH
+        name_tokens = normalized.split()
+        if all(any(token.startswith(word) for token in name_tokens) for word in words):
+            return WORD_PREFIX
+        return SUBSTRING
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Finds the games matching query, ranked by relevance tier and then by popularity
+
+        Args:
+            query (`str`): (Partial) game name provided by the user
+            limit (`int`): Maximum number of matches to return
+
+        Returns:
+            matches (`list`): List of `Match` tuples, best match first. Empty if nothing matches.
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+        words = query.split()
+
+        # Candidates: every query word is a prefix of a name token ...
+        candidates = None
+        for word in words:
+            rows = self._rows_with_token_prefix(word)
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                break
+        # ... or the query is a substring of the name
+        candidates = (candidates or set()) | self._rows_containing(query)
+
+        tiers = {row: self._tier(row, query, words) for row in candidates}
+        ranked = sorted(candidates, key=lambda row: (tiers[row], -self.popularity[row], len(self.normalized[row])))
+        return [Match(self.game_ids[row], self.names[row], self.clusters[row], self.popularity[row], tiers[row])
+                for row in ranked[:limit]]
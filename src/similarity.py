@@ -0,0 +1,152 @@
+"""This module finds the games most similar to a given game in the standardized feature space of model.py
+
+Cluster recommendations return the best rated games in the same cluster, no matter how close they are to the query game,
+and never cross cluster boundaries. `SimilarityIndex` instead returns the k nearest games (Euclidean distance between
+standardized feature vectors, the same metric KMeans uses). It supports two search modes:
+1. exact: brute force over all games, one block of queries at a time with a single matrix multiply per block
+2. approximate: the KMeans centroids act as coarse partitions (an inverted file index). A query only scans the games
+   in the `nprobe` clusters whose centroids are closest to it, trading a little recall for much less work.
+
+The index is saved next to the model as a compressed .npz file, and `recall_at_k()` measures how many of the exact
+neighbours the approximate search finds (see benchmarks/similarity_benchmark.py).
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+# Number of queries scored against the whole feature matrix at once in exact search; bounds memory to block * n floats
+QUERY_BLOCK_SIZE = 256
+
+
+def squared_distances(queries: np.ndarray, X: np.ndarray, X_sq_norms: np.ndarray) -> np.ndarray:
+    """Squared Euclidean distances between every query and every row of X, as ||q||^2 - 2 q.x + ||x||^2"""
+    distances = X_sq_norms[np.newaxis, :] - 2 * queries @ X.T
+    distances += np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+    return np.maximum(distances, 0, out=distances)  # Rounding can make distances of (near) duplicates slightly negative
+
+
+def smallest_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest values of every row, sorted by value"""
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return np.empty((distances.shape[0], 0), dtype=np.intp)
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class SimilarityIndex:
+    """k-nearest-neighbour index over the standardized feature matrix
+
+    Args:
+        game_ids (`list`): Game id of every row of X
+        X (`np.ndarray`): Standardized feature matrix (games x features)
+        centroids (`np.ndarray`): KMeans cluster centers (clusters x features), used as coarse partitions
+        labels (`np.ndarray`): KMeans cluster of every row of X
+    """
+
+    def __init__(self, game_ids, X: np.ndarray, centroids: np.ndarray, labels: np.ndarray):
+        self.game_ids = np.asarray([str(game_id) for game_id in game_ids], dtype=object)
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        if not len(self.game_ids) == len(self.X) == len(self.labels):
+            raise ValueError(f'Got {len(self.game_ids)} game ids, {len(self.X)} feature rows and {len(self.labels)} labels')
+
+        self.row_of = {game_id: row for row, game_id in enumerate(self.game_ids)}
+        self.X_sq_norms = np.einsum('ij,ij->i', self.X, self.X)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        # cluster -> rows in that cluster (the inverted lists of the coarse partitions)
+        order = np.argsort(self.labels, kind='stable')
+        boundaries = np.searchsorted(self.labels[order], np.arange(len(self.centroids) + 1))
+        self.partitions = [order[start:end] for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    @classmethod
+    def from_kmeans(cls, game_ids, X: np.ndarray, kmeans):
+        """Builds the index from the feature matrix and a fitted sklearn KMeans model"""
+        return cls(game_ids, X, kmeans.cluster_centers_, kmeans.labels_)
+
+    def save(self, filepath: str):
+        """Saves the index as a compressed .npz file"""
+        np.savez_compressed(filepath, game_ids=self.game_ids.astype(str), X=self.X, centroids=self.centroids,
+                            labels=self.labels)
+        logger.info(f'Saved similarity index over {len(self)} games to {filepath}')
+
+    @classmethod
+    def load(cls, filepath: str):
+        """Loads an index saved with save()"""
+        with np.load(filepath) as data:
+            index = cls(data['game_ids'].tolist(), data['X'], data['centroids'], data['labels'])
+        logger.info(f'Loaded similarity index over {len(index)} games from {filepath}')
+        return index
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int = None) -> tuple:
+        """Finds the k nearest games to each query vector
+
+        Args:
+            queries (`np.ndarray`): Standardized feature vectors (queries x features)
+            k (`int`): Number of neighbours per query
+            nprobe (`int`): Number of closest partitions to scan per query. None or 0 (or >= the number of clusters) searches exactly
+
+        Returns:
+            (rows, distances): both queries x k arrays, nearest first. Rows are -1 (and distances inf) where fewer
+            than k games were scanned
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        rows = np.full((len(queries), k), -1, dtype=np.intp)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        if not nprobe or nprobe >= len(self.centroids):
+            for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+                block = squared_distances(queries[start:start + QUERY_BLOCK_SIZE], self.X, self.X_sq_norms)
+                nearest = smallest_k(block, k)
+                rows[start:start + len(block), :nearest.shape[1]] = nearest
+                distances[start:start + len(block), :nearest.shape[1]] = np.take_along_axis(block, nearest, axis=1)
+        else:
+            probes = smallest_k(squared_distances(queries, self.centroids, self.centroid_sq_norms), nprobe)
+            for i, (query, clusters) in enumerate(zip(queries, probes)):
+                candidates = np.concatenate([self.partitions[cluster] for cluster in clusters])
+                candidate_distances = squared_distances(query[np.newaxis, :], self.X[candidates],
+                                                        self.X_sq_norms[candidates])
+                nearest = smallest_k(candidate_distances, k)[0]
+                rows[i, :len(nearest)] = candidates[nearest]
+                distances[i, :len(nearest)] = candidate_distances[0, nearest]
+
+        return rows, np.sqrt(distances)
+
+    def neighbours(self, game_ids, k: int, nprobe: int = None) -> dict:
+        """Returns the k most similar games for each of the given games (excluding the game itself)
+
+        Args:
+            game_ids (`list`): Ids of the query games; unknown ids are left out of the result
+            k (`int`): Number of similar games per query game
+            nprobe (`int`): See search()
+
+        Returns:
+            neighbours (`dict`): {game_id: [(similar game_id, distance), ...]}, most similar first
+        """
+        game_ids = [str(game_id) for game_id in game_ids if str(game_id) in self.row_of]
+        query_rows = np.array([self.row_of[game_id] for game_id in game_ids], dtype=np.intp)
+        rows, distances = self.search(self.X[query_rows], k + 1, nprobe)
+
+        neighbours = {}
+        for game_id, query_row, game_rows, game_distances in zip(game_ids, query_rows, rows, distances):
+            neighbours[game_id] = [(self.game_ids[row], float(distance))
+                                   for row, distance in zip(game_rows, game_distances)
+                                   if row != -1 and row != query_row][:k]
+        return neighbours
+
+
+def recall_at_k(index: SimilarityIndex, queries: np.ndarray, k: int, nprobe: int) -> float:
+    """Fraction of the exact k nearest neighbours that the approximate search with nprobe partitions finds"""
+    exact_rows, _ = index.search(queries, k)
+    approximate_rows, _ = index.search(queries, k, nprobe)
+    found = sum(len(np.intersect1d(exact, approximate[approximate != -1]))
+                for exact, approximate in zip(exact_rows, approximate_rows))
+    return found / exact_rows.size if exact_rows.size else 1.0
@@ -0,0 +1,280 @@
+"""This module moves files and objects between the local disk and S3 for upload.py, download.py and the pipeline
+
+Every transfer goes through one S3 client per process (boto3 clients are thread safe and keep a connection pool,
+creating a new one per call costs a round of credential and endpoint resolution) and a TransferConfig tuned for the
+multi-MB data snapshots: files above MULTIPART_THRESHOLD are split into MULTIPART_CHUNKSIZE parts that are transferred
+MAX_CONCURRENCY at a time.
+
+open_object() streams an object instead of downloading it to a file first, decompressing gzip (.gz) or zstd (.zst)
+objects on the fly, and read_json() parses such a stream straight into the raw games data:
+
+    games = read_json('my-bucket', 'games.json.gz')
+
+Data snapshots (config.yml upload/download with `snapshot: true`) are stored zstd compressed and content addressed:
+
+    snapshots/<sha256 of the uncompressed file>.zst    the compressed file, never modified
+    <key>.manifest.json                                 which snapshot <key> currently is: sha256, sizes, time
+
+upload_snapshot() only uploads a snapshot whose hash isn't on S3 yet, and download_snapshot() only downloads one when
+the local file's hash differs from the manifest, so unchanged data costs a HEAD/GET of the small manifest instead of
+a transfer of the whole file.
+
+S3_ENDPOINT_URL points the client at an S3 compatible server (MinIO, LocalStack), e.g. for local tests:
+
+    S3_ENDPOINT_URL=http://localhost:9000 python run.py ...
+
+boto3 and zstandard are imported on first use, so importing this module is cheap.
+"""
+
+import datetime
+import functools
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+from src.hashing import file_sha256
+
+logger = logging.getLogger(__file__)
+
+# Transfer settings of upload_file() and download_file(); see boto3.s3.transfer.TransferConfig
+MULTIPART_THRESHOLD = 16 * 2 ** 20  # Files larger than this (bytes) are transferred in parts
+MULTIPART_CHUNKSIZE = 16 * 2 ** 20  # Size of each part (bytes)
+MAX_CONCURRENCY = 10  # Parts transferred at once, each on its own thread and connection
+
+# Content addressed snapshots: SNAPSHOT_PREFIX<sha256>.zst, compressed at SNAPSHOT_LEVEL (zstd levels go from 1 to 22)
+SNAPSHOT_PREFIX = 'snapshots/'
+SNAPSHOT_LEVEL = 9
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Compression of an object, guessed from the extension of its key
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The S3 client shared by every transfer of the process (at S3_ENDPOINT_URL if that's set)"""
+    import boto3
+    from botocore.config import Config
+
+    # One pooled connection per concurrent part, and retries with backoff on throttling
+    config = Config(max_pool_connections=max(10, MAX_CONCURRENCY), retries={'max_attempts': 5, 'mode': 'standard'})
+    client = boto3.client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None, config=config)
+    logger.debug('Connected to S3')
+    return client
+
+
+@functools.lru_cache(maxsize=None)
+def get_transfer_config():
+    """The multipart TransferConfig of upload_file() and download_file()"""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE,
+                          max_concurrency=MAX_CONCURRENCY, use_threads=True)
+
+
+def parse_s3_url(url: str) -> tuple:
+    """Splits 's3://bucket/path/to/key' into ('bucket', 'path/to/key')"""
+    if not url.startswith('s3://') or '/' not in url[len('s3://'):]:
+        raise ValueError(f'{url} is not an S3 URL of the form s3://bucket/key')
+    bucket_name, key = url[len('s3://'):].split('/', 1)
+    return bucket_name, key
+
+
+def upload_file(local_filepath: str, bucket_name: str, key: str, extra_args: dict = None):
+    """Uploads a local file to S3, in parallel parts if it's larger than MULTIPART_THRESHOLD
+
+    Args:
+        local_filepath (`str`): The location of the file to be uploaded
+        bucket_name (`str`): The S3 bucket to upload to
+        key (`str`): The name of the file on S3
+        extra_args (`dict`): Extra arguments of the upload, e.g. {'ContentEncoding': 'gzip'}
+    """
+    get_client().upload_file(local_filepath, bucket_name, key, ExtraArgs=extra_args, Config=get_transfer_config())
+    logger.debug(f'Uploaded {local_filepath} to s3://{bucket_name}/{key}')
+
+
+def download_file(bucket_name: str, key: str, local_filepath: str):
+    """Downloads an object from S3 to a local file, in parallel ranged parts if it's larger than MULTIPART_THRESHOLD
+
+    Args:
+        bucket_name (`str`): The S3 bucket to download from
+        key (`str`): The name of the file on S3
+        local_filepath (`str`): The path to download the file to
+    """
+    get_client().download_file(bucket_name, key, local_filepath, Config=get_transfer_config())
+    logger.debug(f'Downloaded s3://{bucket_name}/{key} to {local_filepath}')
+
+
+def object_etag(bucket_name: str, key: str) -> str:
+    """ETag of an object, which changes whenever the object is replaced"""
+    return get_client().head_object(Bucket=bucket_name, Key=key)['ETag']
+
+
+def decompress_stream(stream, compression: str = None):
+    """Wraps a binary stream in a reader that decompresses it as it is read
+
+    Args:
+        stream: Binary file-like object with a read() method, e.g. the Body of an S3 object
+        compression (`str`): 'gzip', 'zstd' or None (the stream isn't compressed)
+
+    Returns:
+        A binary file-like object of the decompressed bytes
+    """
+    if compression is None:
+        return stream
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading zstd compressed data needs the zstandard package: pip install zstandard')
+        # read_across_frames: objects written in several frames are read to the end
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    raise ValueError(f"Unknown compression {compression}; expected one of {sorted(COMPRESSION_EXTENSIONS.values())} or None")
+
+
+def guess_compression(key: str, content_encoding: str = None):
+    """Compression of an object from the extension of its key, or else its ContentEncoding; None if uncompressed"""
+    extension = os.path.splitext(key)[1].lower()
+    if extension in COMPRESSION_EXTENSIONS:
+        return COMPRESSION_EXTENSIONS[extension]
+    if content_encoding in COMPRESSION_EXTENSIONS.values():
+        return content_encoding
+    return None
+
+
+def open_object(bucket_name: str, key: str, compression: str = 'auto'):
+    """Opens an S3 object for streaming reads, decompressing it on the fly; nothing is written to disk
+
+    Args:
+        bucket_name (`str`): The S3 bucket the object is in
+        key (`str`): The name of the object on S3
+        compression (`str`): 'gzip', 'zstd', None, or 'auto' to guess it from the key and ContentEncoding
+
+    Returns:
+        A binary file-like object of the (decompressed) object; close it when done
+    """
+    response = get_client().get_object(Bucket=bucket_name, Key=key)
+    if compression == 'auto':
+        compression = guess_compression(key, response.get('ContentEncoding'))
+    logger.debug(f'Streaming s3://{bucket_name}/{key} (compression: {compression})')
+    return decompress_stream(response['Body'], compression)
+
+
+def read_json(bucket_name: str, key: str, compression: str = 'auto'):
+    """Parses a (gzip/zstd compressed) JSON object on S3 as it streams in, without a temporary file"""
+    with open_object(bucket_name, key, compression) as stream:
+        return json.load(io.TextIOWrapper(stream, encoding='utf-8'))
+
+
+def object_exists(bucket_name: str, key: str) -> bool:
+    """Whether an object exists, from a HEAD request"""
+    from botocore.exceptions import ClientError
+
+    try:
+        get_client().head_object(Bucket=bucket_name, Key=key)
+        return True
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def read_manifest(bucket_name: str, key: str) -> dict:
+    """The snapshot manifest of key (which snapshot it currently is), or None if key was never uploaded as a snapshot"""
+    try:
+        body = get_client().get_object(Bucket=bucket_name, Key=key + MANIFEST_SUFFIX)['Body']
+    except get_client().exceptions.NoSuchKey:
+        return None
+    return json.loads(body.read())
+
+
+def upload_snapshot(local_filepath: str, bucket_name: str, key: str) -> tuple:
+    """Uploads a local file as the current snapshot of key, unless a snapshot with the same content is already on S3
+
+    The file is zstd compressed while it is uploaded (no temporary file) to SNAPSHOT_PREFIX<sha256>.zst, then the
+    manifest <key>.manifest.json is pointed at it. Identical content is only ever uploaded once, whichever key it was
+    uploaded under; the manifest isn't rewritten if it already points at the snapshot.
+
+    Args:
+        local_filepath (`str`): The location of the file to be uploaded
+        bucket_name (`str`): The S3 bucket to upload to
+        key (`str`): The name of the data on S3, e.g. 'games.json'
+
+    Returns:
+        (manifest, uploaded): The manifest of key, and whether the snapshot had to be uploaded
+    """
+    import zstandard
+
+    sha256 = file_sha256(local_filepath)
+    snapshot_key = f'{SNAPSHOT_PREFIX}{sha256}.zst'
+    uploaded = not object_exists(bucket_name, snapshot_key)
+    if uploaded:
+        with open(local_filepath, 'rb') as f:
+            compressed = zstandard.ZstdCompressor(level=SNAPSHOT_LEVEL, threads=-1).stream_reader(f)
+            get_client().upload_fileobj(compressed, bucket_name, snapshot_key, Config=get_transfer_config(),
+                                        ExtraArgs={'Metadata': {'sha256': sha256}})
+        logger.info(f'Uploaded {local_filepath} to s3://{bucket_name}/{snapshot_key}')
+    else:
+        logger.info(f'Snapshot {sha256[:12]} of {local_filepath} is already on S3, skipped the upload')
+
+    manifest = read_manifest(bucket_name, key) or {}
+    if manifest.get('sha256') != sha256:
+        manifest = {'sha256': sha256, 'snapshot_key': snapshot_key, 'compression': 'zstd',
+                    'size': os.path.getsize(local_filepath),
+                    'compressed_size': get_client().head_object(Bucket=bucket_name, Key=snapshot_key)['ContentLength'],
+                    'uploaded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')}
+        get_client().put_object(Bucket=bucket_name, Key=key + MANIFEST_SUFFIX, Body=json.dumps(manifest, indent=2),
+                                ContentType='application/json')
+        logger.info(f"s3://{bucket_name}/{key} is now snapshot {sha256[:12]} "
+                    f"({manifest['size'] / 2 ** 20:.1f} MB, {manifest['compressed_size'] / 2 ** 20:.1f} MB compressed)")
+    return manifest, uploaded
+
+
+def download_snapshot(bucket_name: str, key: str, local_filepath: str) -> tuple:
+    """Downloads the current snapshot of key to local_filepath, unless the local file already has its content
+
+    The snapshot is decompressed while it streams in, written next to local_filepath and checked against the
+    manifest's hash before it replaces local_filepath, so an interrupted or corrupt download never leaves a partial file.
+    If key has no manifest yet (it was uploaded as a plain file), the plain object key is downloaded instead.
+
+    Args:
+        bucket_name (`str`): The S3 bucket to download from
+        key (`str`): The name of the data on S3, e.g. 'games.json'
+        local_filepath (`str`): The path to download the file to
+
+    Returns:
+        (manifest, downloaded): The manifest of key (None for a plain file), and whether anything was downloaded
+    """
+    manifest = read_manifest(bucket_name, key)
+    if manifest is None:
+        logger.warning(f's3://{bucket_name}/{key} has no snapshot manifest, downloading the plain file instead')
+        download_file(bucket_name, key, local_filepath)
+        return None, True
+    if os.path.exists(local_filepath) and file_sha256(local_filepath) == manifest['sha256']:
+        logger.info(f"{local_filepath} is already snapshot {manifest['sha256'][:12]} of {key}, skipped the download")
+        return manifest, False
+
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(local_filepath))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.download-', delete=False) as tmp:
+        try:
+            with open_object(bucket_name, manifest['snapshot_key'], manifest.get('compression', 'zstd')) as stream:
+                for chunk in iter(lambda: stream.read(1 << 20), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            tmp.close()
+            if digest.hexdigest() != manifest['sha256']:
+                raise ValueError(f"Snapshot {manifest['snapshot_key']} doesn't match the sha256 of the manifest of {key}")
+            os.replace(tmp.name, local_filepath)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+    logger.info(f"Downloaded snapshot {manifest['sha256'][:12]} of {key} to {local_filepath}")
+    return manifest, True
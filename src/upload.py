@@ -4,40 +4,42 @@ You can pass the local filepath of the file you want to upload via the [-lfp --l
 Otherwise default: data/external/games.json
 """
 
-import boto3
 import argparse
 import logging
 import logging.config
 import yaml
 
+from src import storage
+
 # todo: Exception Handling
 
 logging_config = './config/logging/local.conf'
 try:
-    logging.config.fileConfig(logging_config)
+    logging.config.fileConfig(logging_config, disable_existing_loggers=False)
 except:
     logging.basicConfig(format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                         datefmt='%m/%d/%Y %I:%M:%S %p',
                         level=logging.DEBUG)
 logger = logging.getLogger('upload.py')
 
-def upload_file_to_bucket(bucket_name, local_filepath, key):
+def upload_file_to_bucket(bucket_name, local_filepath, key, snapshot=False):
     '''Upload file to S3 bucket with specified key
 
+    Large files are uploaded in parallel parts with the shared client of storage.py
+
     Args:
         bucket_name (`str`): The S3 bucket to upload to
         local_filepath (`str`): The location of the file to be uploaded
         key (`str`): The name of the file on S3
+        snapshot (`bool`): Upload the file as a zstd compressed, content addressed snapshot of key (skipped if the
+            same content is already on S3) instead of to key itself; see storage.upload_snapshot()
     '''
-    # Connect to S3
-    s3 = boto3.resource('s3')
-    logger.debug('Connected to S3')
-    # Connect to Bucket # Note that all buckets have unique names so we don't need the 's3://' part
-    bucket = s3.Bucket(bucket_name)
-    logger.debug(f'Connected to {bucket_name}')
-    # Upload to Bucket
+    # Upload to Bucket # Note that all buckets have unique names so we don't need the 's3://' part
     try:
-        bucket.upload_file(local_filepath, key)
+        if snapshot:
+            storage.upload_snapshot(local_filepath, bucket_name, key)
+        else:
+            storage.upload_file(local_filepath, bucket_name, key)
         logger.info(f'Successfully uploaded {local_filepath} to S3 bucket')
     except Exception as err:
         logger.error(f'Failed to upload {local_filepath} with error: {err}')
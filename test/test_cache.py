@@ -0,0 +1,61 @@
+"""
+This module contains unit tests for the LRU/TTL cache used by the Flask app in cache.py
+"""
+
+import time
+
+import pytest
+
+from src.cache import TTLCache
+
+
+# Happy path - second lookup is served from the cache
+def test_get_or_compute_hit():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    assert cache.get_or_compute(('cluster', 1), lambda: calls.append(1) or 'games') == 'games'
+    assert cache.get_or_compute(('cluster', 1), lambda: calls.append(1) or 'games') == 'games'
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+# Happy path - least recently used entry is evicted
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+# Happy path - entries expire after the TTL
+def test_ttl_expiry():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+# Unhappy path - exceptions are propagated and not cached
+def test_get_or_compute_exception_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    with pytest.raises(IndexError):
+        cache.get_or_compute('missing', lambda: [][0])
+    assert len(cache) == 0
+
+
+# Unhappy path - maxsize 0 disables caching
+def test_disabled_cache():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set('a', 1)
+
+    assert cache.get('a') is None
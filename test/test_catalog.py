@@ -0,0 +1,88 @@
+"""
+This module contains unit tests for the in-memory serving catalog in catalog.py
+"""
+
+import json
+import os
+
+import pytest
+
+from src.catalog import Catalog, ReloadingCatalog
+from src.ranking import load_ranking_weights
+
+GAMES = [{'id': 13, 'name': 'Catan', 'thumbnail': None, 'description': 'Trade', 'year': 1995, 'min_age': 10,
+          'number_of_user_ratings': 90000, 'average_user_rating': 7.2, 'average_user_weight_rating': 2.3,
+          'bayes_average': 7.0, 'number_of_users_own': 100000, 'cluster': 1},
+         {'id': 822, 'name': 'Carcassonne', 'thumbnail': None, 'description': 'Tiles', 'year': 2000, 'min_age': 8,
+          'number_of_user_ratings': 90000, 'average_user_rating': 7.4, 'average_user_weight_rating': 1.9,
+          'bayes_average': 7.3, 'number_of_users_own': 110000, 'cluster': 1},
+         {'id': 9209, 'name': 'Ticket to Ride', 'thumbnail': None, 'description': 'Trains', 'year': None, 'min_age': 8,
+          'number_of_user_ratings': 70000, 'average_user_rating': 7.5, 'average_user_weight_rating': 1.8,
+          'bayes_average': 7.4, 'number_of_users_own': 90000, 'cluster': 2}]
+
+
+def _write(filepath, games):
+    with open(filepath, 'w') as json_file:
+        json.dump(games, json_file)
+
+
+# Happy path - all three query types
+def test_catalog_queries(tmp_path):
+    filepath = str(tmp_path / 'games_clustered.json')
+    _write(filepath, GAMES)
+    catalog = Catalog.from_json(filepath)
+
+    assert catalog.cluster_of_game_id('13') == 1
+    assert catalog.cluster_of_game_name('ticket') == 2
+    assert [game['game_id'] for game in catalog.top_games_in_cluster(1, 10)] == ['822', '13']
+    # Snapshots without scores are scored with the default ranking weights, which favour bayes_average and popularity
+    assert [game['game_id'] for game in catalog.top_games(2)] == ['822', '9209']
+    # Missing integers come back as None rather than NaN
+    assert catalog.games_by_ids(['9209'])[0]['year_published'] is None
+    assert catalog.games_by_ids(['9209'])[0]['min_age'] == 8
+
+
+# Happy path - snapshots are ranked with the ranking weights of config.yml, like ingest.py ranks the database
+def test_catalog_ranking_weights(tmp_path):
+    filepath = str(tmp_path / 'games_clustered.json')
+    _write(filepath, GAMES)
+    config_path = tmp_path / 'config.yml'
+    config_path.write_text('ranking:\n  rating: 1.0\n')
+    catalog = ReloadingCatalog.from_json(filepath, check_seconds=0, weights=load_ranking_weights(str(config_path)))
+
+    assert [game['game_id'] for game in catalog.get().top_games(3)] == ['9209', '822', '13']
+
+
+# Unhappy path - unknown game id, name and cluster
+def test_catalog_missing():
+    catalog = Catalog([])
+
+    with pytest.raises(KeyError):
+        catalog.cluster_of_game_id('1')
+    with pytest.raises(LookupError):
+        catalog.cluster_of_game_name('Catan')
+    assert catalog.top_games_in_cluster(1, 10) == []
+
+
+# Happy path - a new snapshot is picked up without restarting
+def test_reloading_catalog(tmp_path):
+    filepath = str(tmp_path / 'games_clustered.json')
+    _write(filepath, GAMES[:1])
+    catalog = ReloadingCatalog.from_json(filepath, check_seconds=0)
+    assert len(catalog.get()) == 1
+
+    _write(filepath, GAMES)
+    os.utime(filepath, ns=(0, 0))  # Make sure the modification time changes even on coarse filesystem clocks
+    assert len(catalog.get()) == 3
+
+
+# Unhappy path - a broken snapshot keeps the previous catalog
+def test_reloading_catalog_bad_snapshot(tmp_path):
+    filepath = str(tmp_path / 'games_clustered.json')
+    _write(filepath, GAMES)
+    catalog = ReloadingCatalog.from_json(filepath, check_seconds=0)
+    assert len(catalog.get()) == 3
+
+    with open(filepath, 'w') as json_file:
+        json_file.write('[{"id": ')
+    assert len(catalog.get()) == 3
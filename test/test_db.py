@@ -0,0 +1,51 @@
+"""
+This module contains unit tests for the shared engine factory and pool instrumentation in db.py
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ArgumentError
+
+from src.db import engine_options, instrument_engine, pool_stats, pool_status, get_engine, InstrumentedQueuePool
+
+
+# Happy path - queue pool settings for MySQL, defaults for SQLite
+def test_engine_options():
+    mysql_options = engine_options('mysql+pymysql://user:pw@host:3306/db', pool_size=3, max_overflow=2,
+                                   pool_recycle=60, pool_pre_ping=True)
+    sqlite_options = engine_options('sqlite:///data/boardgames.db')
+
+    assert mysql_options['poolclass'] is InstrumentedQueuePool
+    assert mysql_options['pool_size'] == 3
+    assert mysql_options['max_overflow'] == 2
+    assert mysql_options['pool_recycle'] == 60
+    assert 'pool_size' not in sqlite_options
+
+
+# Happy path - checkouts, waits and new connections are counted
+def test_instrumented_pool(tmp_path):
+    engine = instrument_engine(create_engine(f'sqlite:///{tmp_path}/test.db', poolclass=InstrumentedQueuePool,
+                                             pool_size=1, max_overflow=0))
+    before = pool_stats.as_dict()
+    for _ in range(3):
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+    after = pool_status(engine)
+
+    assert after['checkouts'] - before['checkouts'] == 3
+    assert after['connects'] - before['connects'] == 1  # The pooled connection is reused
+    assert after['wait_seconds_histogram']['+Inf'] - before['wait_seconds_histogram']['+Inf'] == 3
+    assert after['size'] == 1
+
+
+# Happy path - the same engine is shared for the same connection string
+def test_get_engine_shared(tmp_path):
+    engine_string = f'sqlite:///{tmp_path}/test.db'
+
+    assert get_engine(engine_string) is get_engine(engine_string)
+
+
+# Unhappy path - empty connection string
+def test_get_engine_empty_string():
+    with pytest.raises(ArgumentError):
+        get_engine('')
@@ -3,18 +3,20 @@ This module contains 12 unit tests for the 6 functions that create features from
 There is 1 happy and one unhappy path tested for each function.
 """
 
+import numpy as np
 import pandas as pd
 import pytest
 import json
 
 from src.featurize import load_unfeaturized_data, expand_feature, one_hot_encode, collapse_one_hot_encoded, merge_original_with_collapsed, extract_stats
+from src.featurize import compact_dtypes
 
 
 # Happy path for load_unfeaturized_data()
-def test_load_unfeaturized_data():
+def test_load_unfeaturized_data(tmp_path):
 
     data = {'key1': [1,2,3], 'key2':[4,5,6]}
-    filepath = 'data/test.json'
+    filepath = str(tmp_path / 'test.json')
 
     with open(filepath, "w") as write_file:
         json.dump(data, write_file)
@@ -215,4 +217,16 @@ def test_extract_stats_missing_stats_column():
 
     # Should return the same df, checking that all columns match
     for col in correct_result.columns:
-        assert list(correct_result[col]) == list(extract_stats(df)[col])
\ No newline at end of file
+        assert list(correct_result[col]) == list(extract_stats(df)[col])
+
+# Happy path - one-hot columns are uint8 flags, ids int32 and repeated strings categorical; values are unchanged
+def test_compact_dtypes():
+    df = pd.DataFrame({'id': [174430, 123456, 1], 'name': ['a', 'b', 'c'], 'year': [2017, 1995, 2020],
+                       'categories': [['x', 'y'], ['y'], ['x']]})
+    collapsed = collapse_one_hot_encoded(one_hot_encode(expand_feature(df, 'categories'), 'categories'), 3)
+    compact = compact_dtypes(df.merge(collapsed, on='id').assign(kind=['card', 'card', 'card']))
+
+    assert compact['id'].dtype == np.int32 and compact['year'].dtype == np.uint16
+    assert (compact[['categories_x', 'categories_y']].dtypes == np.uint8).all()
+    assert isinstance(compact['kind'].dtype, pd.CategoricalDtype) and not isinstance(compact['name'].dtype, pd.CategoricalDtype)
+    assert list(compact['categories_x']) == [1, 0, 1] and list(compact['id']) == [174430, 123456, 1]
@@ -0,0 +1,53 @@
+"""
+This module contains unit tests for the filtered top N queries over the in-memory catalog in filters.py
+"""
+
+import pytest
+
+from src.catalog import Catalog
+from src.filters import parse_filters
+
+
+def make_catalog():
+    # Scores decrease with the game id, so game 1 is the best match in every cluster
+    return Catalog([{'game_id': str(i), 'name': f'Game {i}', 'score': -i, 'cluster': i % 2,
+                     'min_age': 6 + i % 8, 'year_published': 1990 + i, 'average_user_rating_weight': 1 + i / 10}
+                    for i in range(1, 31)] +
+                   [{'game_id': '99', 'name': 'No age', 'score': 100, 'cluster': 1, 'min_age': None,
+                     'year_published': 2000, 'average_user_rating_weight': 2.0}])
+
+
+# Happy path - filtered top N within a cluster matches the exact predicates, best score first
+def test_filtered_top_games_in_cluster():
+    catalog = make_catalog()
+    filters = parse_filters({'age': '10', 'max_complexity': '2.55', 'min_year': '1993'})
+    games = catalog.top_games_in_cluster(1, 10, filters=filters)
+
+    assert [game['game_id'] for game in games] == ['3', '9', '11']
+    assert all(game['min_age'] <= 10 and game['average_user_rating_weight'] <= 2.55 for game in games)
+    # Pagination skips matches, not candidates
+    assert [game['game_id'] for game in catalog.top_games_in_cluster(1, 2, offset=1, filters=filters)] == ['9', '11']
+
+
+# Happy path - no filters returns the plain top N and filters work across the whole catalog
+def test_unfiltered_and_catalog_wide():
+    catalog = make_catalog()
+
+    assert catalog.top_games_in_cluster(1, 3, filters={}) == catalog.top_games_in_cluster(1, 3)
+    assert [game['game_id'] for game in catalog.top_games(3, parse_filters({'min_year': 2018}))] == ['28', '29', '30']
+
+
+# Unhappy path - games with a missing value never match, empty ranges and unknown clusters return nothing
+def test_no_matches():
+    catalog = make_catalog()
+
+    assert '99' not in [game['game_id'] for game in catalog.top_games_in_cluster(1, 50, filters={'min_age': (None, 20)})]
+    assert catalog.top_games_in_cluster(1, 10, filters=parse_filters({'min_year': 2010, 'max_year': 2000})) == []
+    assert catalog.top_games_in_cluster(7, 10, filters=parse_filters({'age': 10})) == []
+
+
+# Unhappy path - non-numeric filter values are rejected
+def test_parse_filters_invalid():
+    assert parse_filters({'age': '', 'game_id': '13'}) == {}
+    with pytest.raises(ValueError):
+        parse_filters({'max_complexity': 'easy'})
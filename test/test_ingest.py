@@ -0,0 +1,102 @@
+"""
+This module contains unit tests for building the materialized top N games per cluster in ingest.py
+"""
+
+import subprocess
+import sys
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from ingest import Base, Boardgame, ClusterTopGame, get_session, ingest_games, rank_cluster_top_games
+
+
+def _game(game_id, cluster, score):
+    return {'game_id': game_id, 'name': f'Game {game_id}', 'thumbnail': None, 'description': None,
+            'year_published': 2000, 'min_age': 10, 'average_user_rating': 8.0,
+            'average_user_rating_weight': 2.5, 'number_of_users_own': 100, 'cluster': cluster, 'score': score}
+
+
+def _raw_game(game_id, cluster):
+    return {'id': game_id, 'name': f'Game {game_id}', 'image': None, 'thumbnail': None, 'artists': [], 'designers': [],
+            'year': 2000, 'description': 'A game', 'categories': ['Card Game'], 'mechanics': [], 'min_age': 10,
+            'publishers': [], 'number_of_user_weight_ratings': 50, 'average_user_weight_rating': 2.5,
+            'number_of_user_ratings': 100, 'average_user_rating': 7.5, 'bayes_average': 7.0,
+            'number_of_users_own': 300, 'cluster': cluster}
+
+
+# Happy path for rank_cluster_top_games()
+def test_rank_cluster_top_games():
+    games = [_game('1', 0, 7.0), _game('2', 0, 9.0), _game('3', 0, None), _game('4', 0, 8.0), _game('5', 1, 6.0)]
+
+    top_games = rank_cluster_top_games(games, top_n=3)
+    cluster_0 = [(game['rank'], game['game_id']) for game in top_games if game['cluster'] == 0]
+    cluster_1 = [(game['rank'], game['game_id']) for game in top_games if game['cluster'] == 1]
+
+    assert cluster_0 == [(1, '2'), (2, '4'), (3, '1')]
+    assert cluster_1 == [(1, '5')]
+
+
+# Unhappy path - games without a cluster are not materialized
+def test_rank_cluster_top_games_missing_cluster():
+    games = [_game('1', None, 7.0)]
+
+    assert rank_cluster_top_games(games, top_n=10) == []
+
+
+# Happy path - the clustered games DataFrame is ingested without a json round trip, missing values become NULL, and a
+# truncating rerun replaces the games
+def test_ingest_games_from_frame(tmp_path):
+    raw = _raw_game('1', 0)
+    games = pd.DataFrame([raw, {**raw, 'id': '2', 'name': 'Game 2', 'cluster': 1, 'min_age': float('nan')}])
+    session = get_session(engine_string=f"sqlite:///{tmp_path / 'boardgames.db'}")
+    Base.metadata.create_all(session.get_bind())
+
+    ingest_games(session, games, top_n=5)
+    assert session.query(Boardgame).count() == 2
+    assert session.query(Boardgame).filter_by(game_id='2').one().min_age is None
+    assert session.query(ClusterTopGame).count() == 2
+
+    ingest_games(session, games.iloc[:1], top_n=5, truncate=True)
+    assert [game.game_id for game in session.query(Boardgame)] == ['1']
+    session.close()
+
+
+# Happy path - a database created before cluster_top_games and data_version existed gets them when games are ingested
+def test_ingest_games_into_old_database(tmp_path):
+    session = get_session(engine_string=f"sqlite:///{tmp_path / 'boardgames.db'}")
+    Boardgame.__table__.create(session.get_bind())
+
+    ingest_games(session, [_raw_game('1', 0)], top_n=5, truncate=True)
+    assert session.query(ClusterTopGame).count() == 1
+    session.close()
+
+
+# Happy path - a boardgames table created before the ranking score existed gets the new columns and index
+def test_migrate_adds_missing_columns(tmp_path):
+    session = get_session(engine_string=f"sqlite:///{tmp_path / 'boardgames.db'}")
+    session.execute(text('CREATE TABLE boardgames (game_id VARCHAR(100) PRIMARY KEY, name VARCHAR(200) NOT NULL, '
+                         'image VARCHAR(150), thumbnail VARCHAR(100), description TEXT, year_published INTEGER, '
+                         'min_age INTEGER, number_of_ratings INTEGER, average_user_rating FLOAT, '
+                         'number_of_ratings_weight INTEGER, average_user_rating_weight FLOAT, bayes_average FLOAT, '
+                         'number_of_users_own INTEGER, cluster INTEGER)'))
+    session.commit()
+
+    ingest_games(session, [_raw_game('1', 0), _raw_game('2', 0)], top_n=5)
+    columns = {column['name'] for column in inspect(session.get_bind()).get_columns('boardgames')}
+    assert {'score', 'centroid_distance'} <= columns
+    assert session.query(Boardgame).filter(Boardgame.score.isnot(None)).count() == 2
+    assert 'ix_boardgames_cluster_score' in {index['name'] for index in inspect(session.get_bind()).get_indexes('boardgames')}
+    session.close()
+
+
+# Happy path - the schema, ingest.py and storage.py import without the heavy pipeline dependencies, and the app without
+# ingest.py
+def test_light_imports():
+    check = ("import sys; import {module}; "
+             "print(sorted(name for name in {heavy} if name in sys.modules))")
+    heavy = ['numpy', 'pandas', 'sklearn', 'boto3', 'yaml', 'ingest']
+    for module, allowed in (('src.schema', []), ('ingest', ['ingest']), ('src.storage', []), ('app', ['numpy'])):
+        result = subprocess.run([sys.executable, '-c', check.format(module=module, heavy=heavy)],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip().splitlines()[-1] == str(allowed), module
@@ -0,0 +1,83 @@
+"""
+This module contains unit tests for the Prometheus request metrics in metrics.py
+"""
+
+import json
+import os
+
+from src import metrics
+from src.metrics import MetricsRegistry, MultiprocessCollector, render
+
+
+# Happy path - histograms are exposed with cumulative buckets, sum and count, counters with their labels
+def test_render_histograms_and_counters():
+    registry = MetricsRegistry()
+    for seconds in (0.002, 0.02, 3.0):
+        registry.observe('http_request_duration_seconds', seconds, {'route': '/add', 'method': 'POST', 'status': '200'})
+    registry.inc('recommendation_queries_total', {'route': '/add', 'query': 'game_id'}, 2)
+
+    text = render([registry.snapshot([lambda: [('cache_entries', {}, 5)]])])
+    labels = 'method="POST",route="/add",status="200"'
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.0025"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.025"}} 2' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f'http_request_duration_seconds_count{{{labels}}} 3' in text
+    assert 'recommendation_queries_total{query="game_id",route="/add"} 2' in text
+    assert f'cache_entries{{pid="{os.getpid()}"}} 5' in text
+
+
+# Happy path - snapshots of several workers are merged: counters are summed, gauges are reported per live worker
+def test_multiprocess_merge(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', MetricsRegistry())
+    metrics.start_request()
+    metrics.finish_request('/add', 'POST', 200, 0.01, 'game_name')
+    collector = MultiprocessCollector(str(tmp_path), collectors=[lambda: [('cache_hits_total', {}, 3),
+                                                                          ('cache_entries', {}, 7)]])
+    collector.flush()
+    exited_worker = {'pid': 2 ** 22 + 1, 'counters': [['recommendation_queries_total', {'route': '/add', 'query': 'game_name'}, 4],
+                                                      ['cache_hits_total', {}, 1]],
+                     'histograms': [], 'gauges': [['cache_entries', {}, 100]]}
+    (tmp_path / f"metrics-{exited_worker['pid']}.json").write_text(json.dumps(exited_worker))
+
+    text = render(collector.snapshots())
+    assert 'recommendation_queries_total{query="game_name",route="/add"} 5' in text
+    assert 'cache_hits_total 4' in text
+    assert f'cache_entries{{pid="{os.getpid()}"}} 7' in text and 'cache_entries{pid="4194305"}' not in text
+    assert 'http_request_db_seconds_count{route="/add"} 1' in text
+
+
+# Happy path - snapshots of exited workers are folded into one file, so the directory doesn't grow with recycled workers
+def test_multiprocess_exited_workers_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', MetricsRegistry())
+    metrics.start_request()
+    metrics.finish_request('/add', 'POST', 200, 0.01, 'game_name')
+    collector = MultiprocessCollector(str(tmp_path))
+    collector.flush()
+    for pid in (2 ** 22 + 1, 2 ** 22 + 2):
+        exited_worker = {'pid': pid, 'counters': [['recommendation_queries_total', {'route': '/add', 'query': 'game_name'}, 2]],
+                         'histograms': [['http_request_db_seconds', {'route': '/add'}, [1] + [0] * 12, 0.001, 1]],
+                         'gauges': []}
+        (tmp_path / f'metrics-{pid}.json').write_text(json.dumps(exited_worker))
+
+        text = render(collector.snapshots())
+        assert sorted(p.name for p in tmp_path.glob('metrics-*.json')) == [f'metrics-{os.getpid()}.json',
+                                                                           metrics.EXITED_SNAPSHOT]
+    assert render(collector.snapshots()) == text
+    assert 'recommendation_queries_total{query="game_name",route="/add"} 5' in text
+    assert 'http_request_db_seconds_count{route="/add"} 3' in text
+    assert 'http_request_db_seconds_bucket{route="/add",le="0.001"} 3' in text
+
+
+# Unhappy path - unreadable snapshot files are skipped and errors are counted
+def test_corrupt_snapshot_and_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', MetricsRegistry())
+    metrics.finish_request('/', 'GET', 200, 0.01, error=True)
+    metrics.finish_request('/api/similar', 'GET', 503, 0.01)
+    (tmp_path / 'metrics-1.json').write_text('{not json')
+    collector = MultiprocessCollector(str(tmp_path))
+    collector.flush()
+
+    text = render(collector.snapshots())
+    assert 'http_request_errors_total{route="/"} 1' in text
+    assert 'http_request_errors_total{route="/api/similar"} 1' in text
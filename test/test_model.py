@@ -8,15 +8,19 @@ import pytest
 import json
 import sklearn.cluster
 from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
 
 from src.model import load_featurized_data, extract_features, standardize_features, fit_kmeans, model_predict, evaluate_silhouette
+from src.model import fit_standardizer, warm_start, changed_clusters
+from src.model import write_feature_matrix, fit_standardizer_out_of_core, fit_minibatch_kmeans, centroid_distances
+from src.model_bundle import ModelBundle
 
 
 # Happy path for load_featurized_data()
-def test_load_featurized_data():
+def test_load_featurized_data(tmp_path):
 
     data = {'key1': [1,2,3], 'key2':[4,5,6]}
-    filepath = 'data/test.json'
+    filepath = str(tmp_path / 'test.json')
 
     with open(filepath, "w") as write_file:
         json.dump(data, write_file)
@@ -80,6 +84,14 @@ def test_standardize_features_empty_df():
         assert list(df[col]) == list(extract_features(df)[col])
 
 
+# Unhappy path - features that can't be standardized raise instead of returning a frame without a scaler
+def test_fit_standardizer_empty_df():
+    with pytest.raises(ValueError):
+        fit_standardizer(pd.DataFrame({'col1': [], 'col2': []}))
+    with pytest.raises(ValueError):
+        standardize_features(pd.DataFrame({'col1': [], 'col2': []}))
+
+
 # Happy path
 def test_fit_kmeans_type():
     X = [[1, 2], [2, 3], [3, 4]]
@@ -96,6 +108,75 @@ def test_fit_kmeans_bad_seed():
         fit_kmeans(X, k, bad_seed)
     assert pytest_error.type == SystemExit
 
+
+def clustered_features(n_games=300, n_clusters=5, seed=40):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=5, size=(n_clusters, 3))
+    return pd.DataFrame(centers[rng.integers(n_clusters, size=n_games)] + rng.normal(size=(n_games, 3)),
+                        columns=['a', 'b', 'c'])
+
+
+# Happy path - a warm started retrain on slightly changed data with a new feature column keeps the cluster ids
+def test_warm_start_keeps_cluster_ids(tmp_path):
+    df = clustered_features()
+    X, scaler = fit_standardizer(df)
+    model = fit_kmeans(X, 5, 28)
+    ModelBundle.from_fit(model, scaler, df.columns).save(str(tmp_path))
+
+    updated = df.assign(d=0.0)
+    updated.loc[:9, ['a', 'b', 'c']] += 0.1
+    X_updated, scaler_updated = fit_standardizer(updated)
+    init, previous_labels = warm_start(str(tmp_path), updated, scaler_updated, 5)
+    retrained = fit_kmeans(X_updated, 5, 28, init=init)
+
+    assert init.shape == (5, 4)
+    np.testing.assert_array_equal(previous_labels, model.labels_)
+    assert changed_clusters(previous_labels, retrained.labels_) == 0
+    assert retrained.n_iter_ <= 2
+
+
+# Happy path - the float32 feature matrix gives the same clusters as the float64 one, with centroids within tolerance
+def test_float32_features_match_float64():
+    df = clustered_features(n_games=1000).assign(flag=np.arange(1000) % 2).astype({'flag': np.uint8})
+    X32, scaler32 = fit_standardizer(df)
+    X64, scaler64 = fit_standardizer(df, dtype=np.float64)
+    model32, model64 = fit_kmeans(X32, 5, 28), fit_kmeans(X64, 5, 28)
+
+    assert X32.dtype == np.float32 and X64.dtype == np.float64
+    np.testing.assert_allclose(scaler32.mean_, scaler64.mean_, rtol=1e-6)
+    np.testing.assert_array_equal(model32.labels_, model64.labels_)
+    np.testing.assert_allclose(model32.cluster_centers_, model64.cluster_centers_, atol=1e-4)
+
+
+# Happy path - standardizing a memory mapped matrix in chunks matches the in-memory scaler, and MiniBatchKMeans on it
+# finds (nearly) the same clusters as KMeans
+def test_out_of_core_matches_in_memory(tmp_path):
+    df = clustered_features(n_games=1000)
+    X, scaler = fit_standardizer(df)
+    raw_X = write_feature_matrix(df, str(tmp_path / 'features.npy'), chunk_size=128)
+    X_out_of_core, scaler_out_of_core = fit_standardizer_out_of_core(raw_X, str(tmp_path / 'X.npy'), chunk_size=128)
+
+    assert isinstance(X_out_of_core, np.memmap) and X_out_of_core.dtype == np.float32
+    np.testing.assert_allclose(scaler_out_of_core.mean_, scaler.mean_, rtol=1e-6)
+    np.testing.assert_allclose(scaler_out_of_core.scale_, scaler.scale_, rtol=1e-6)
+    np.testing.assert_allclose(X_out_of_core, X, atol=1e-5)
+
+    model = fit_minibatch_kmeans(X_out_of_core, 5, 28, batch_size=256)
+    assert adjusted_rand_score(model.labels_, fit_kmeans(X, 5, 28).labels_) > 0.95
+    np.testing.assert_allclose(centroid_distances(X_out_of_core, model, chunk_size=128),
+                               np.linalg.norm(X_out_of_core - model.cluster_centers_[model.labels_], axis=1), rtol=1e-5)
+
+
+# Unhappy path - a missing previous model or one with another k means a cold start
+def test_warm_start_falls_back_to_cold_start(tmp_path):
+    df = clustered_features()
+    X, scaler = fit_standardizer(df)
+    ModelBundle.from_fit(fit_kmeans(X, 5, 28), scaler, df.columns).save(str(tmp_path))
+
+    assert warm_start(str(tmp_path / 'missing'), df, scaler, 5) == (None, None)
+    assert warm_start(str(tmp_path), df, scaler, 6) == (None, None)
+
+
 # NOTE
 # Don't need tests for model_predict() & evaluate_silhouette(),
 # because they are essentially just wrappers for sklean functions
@@ -0,0 +1,67 @@
+"""
+This module contains unit tests for saving and loading the trained model as a bundle in model_bundle.py
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.cluster import KMeans
+
+from src.model import fit_standardizer
+from src.model_bundle import ModelBundle, BUNDLE_FORMAT_VERSION, MANIFEST_FILENAME
+
+
+def make_bundle():
+    rng = np.random.default_rng(38)
+    df = pd.DataFrame(rng.normal(loc=5, scale=3, size=(200, 4)), columns=['a', 'b', 'c', 'd'])
+    X, scaler = fit_standardizer(df)
+    kmeans = KMeans(n_clusters=6, n_init=1, random_state=38).fit(X)
+    return ModelBundle.from_fit(kmeans, scaler, df.columns, {'n_games': len(df)}), kmeans, df
+
+
+# Happy path - a saved and reloaded bundle assigns the same clusters as the sklearn model, without pickle
+def test_round_trip_predicts_like_kmeans(tmp_path):
+    bundle, kmeans, df = make_bundle()
+    bundle.save(str(tmp_path / 'kmeans'))
+    loaded = ModelBundle.load(str(tmp_path / 'kmeans'))
+
+    np.testing.assert_array_equal(loaded.predict(df), kmeans.labels_)
+    assert isinstance(loaded.centroids, np.memmap)
+    assert loaded.metadata['k'] == 6 and loaded.metadata['n_games'] == 200
+    assert loaded.feature_columns == ['a', 'b', 'c', 'd']
+
+
+# Happy path - features are aligned by name: column order and extra columns don't matter, missing columns are filled
+def test_feature_alignment():
+    bundle, _, df = make_bundle()
+    shuffled = df[['d', 'b', 'a', 'c']].assign(extra=1.0)
+
+    np.testing.assert_array_equal(bundle.predict(shuffled), bundle.predict(df))
+    np.testing.assert_array_equal(bundle.predict(df.to_dict(orient='records')[:3]), bundle.predict(df.iloc[:3]))
+    np.testing.assert_array_equal(bundle.feature_matrix({'a': 1.0}), [[1.0, 0.0, 0.0, 0.0]])
+
+
+# Unhappy path - a modified array file fails the checksum check
+def test_load_corrupt_bundle(tmp_path):
+    bundle, _, _ = make_bundle()
+    bundle.save(str(tmp_path))
+    with open(tmp_path / 'centroids.npy', 'r+b') as f:
+        f.seek(-8, 2)
+        f.write(b'\x00' * 8)
+
+    with pytest.raises(ValueError):
+        ModelBundle.load(str(tmp_path))
+
+
+# Unhappy path - bundles of another format version are refused
+def test_load_other_format_version(tmp_path):
+    bundle, _, _ = make_bundle()
+    bundle.save(str(tmp_path))
+    manifest = json.loads((tmp_path / MANIFEST_FILENAME).read_text())
+    manifest['format_version'] = BUNDLE_FORMAT_VERSION + 1
+    (tmp_path / MANIFEST_FILENAME).write_text(json.dumps(manifest))
+
+    with pytest.raises(ValueError):
+        ModelBundle.load(str(tmp_path))
@@ -0,0 +1,39 @@
+"""
+This module contains unit tests for precomputing the top K similar games of every game in neighbours.py
+"""
+
+import numpy as np
+
+from src.neighbours import top_k_neighbours, neighbour_records, PrecomputedNeighbours
+
+
+# Happy path - blocked, multithreaded search matches a brute force computation and skips the game itself
+def test_top_k_neighbours():
+    X = np.random.default_rng(28).normal(size=(500, 6))
+    rows, distances = top_k_neighbours(X, k=4, block_size=64, n_jobs=3)
+
+    all_distances = ((X[:, np.newaxis, :] - X[np.newaxis, :, :]) ** 2).sum(axis=2)
+    np.fill_diagonal(all_distances, np.inf)
+    np.testing.assert_array_equal(rows, np.argsort(all_distances, axis=1)[:, :4])
+    np.testing.assert_allclose(distances, np.sqrt(np.sort(all_distances, axis=1)[:, :4]), rtol=1e-3)
+
+
+# Unhappy path - fewer games than k leaves the missing neighbours out of the records
+def test_fewer_games_than_k():
+    X = np.array([[0.0, 0.0], [1.0, 0.0], [3.0, 0.0]])
+    rows, distances = top_k_neighbours(X, k=3, block_size=2, n_jobs=1)
+    records = neighbour_records(['a', 'b', 'c'], rows, distances)
+
+    assert rows[0].tolist() == [1, 2, -1]
+    assert [(record['rank'], record['neighbour_id']) for record in records if record['game_id'] == 'a'] == [(1, 'b'), (2, 'c')]
+    assert len(records) == 6
+
+
+# Happy path - precomputed lists are served through the same interface as the similarity index
+def test_precomputed_neighbours():
+    records = [{'game_id': '1', 'rank': 2, 'neighbour_id': '3', 'distance': 0.5},
+               {'game_id': '1', 'rank': 1, 'neighbour_id': '2', 'distance': 0.1}]
+    neighbours = PrecomputedNeighbours(records)
+
+    assert neighbours.neighbours([1, 'unknown'], k=5) == {'1': [('2', 0.1), ('3', 0.5)]}
+    assert neighbours.neighbours(['1'], k=1) == {'1': [('2', 0.1)]}
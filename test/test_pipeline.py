@@ -0,0 +1,110 @@
+"""
+This module contains unit tests for the cached DAG pipeline runner in pipeline.py
+"""
+
+import threading
+
+import pytest
+
+from src.pipeline import Pipeline, Stage
+
+
+def make_stages(calls, scale=2, target=None):
+    """Three stages: load -> double -> describe, recording every function call in calls"""
+    def load():
+        calls.append('load')
+        return [1, 2, 3]
+
+    def double(numbers, scale):
+        calls.append('double')
+        return [scale * number for number in numbers]
+
+    def describe(doubled):
+        calls.append('describe')
+        if target:
+            with open(target, 'w') as f:
+                f.write(str(doubled))
+        return sum(doubled), len(doubled)
+
+    return [Stage('describe', describe, inputs=['doubled'], outputs=['total', 'count'], targets=[target] if target else []),
+            Stage('load', load, outputs=['numbers']),
+            Stage('double', double, inputs=['numbers'], outputs=['doubled'], params={'scale': scale})]
+
+
+# Happy path - stages run in dependency order, and a second run loads every output from the cache
+def test_run_and_cache(tmp_path):
+    calls = []
+    values = Pipeline(make_stages(calls), cache_dir=str(tmp_path)).run()
+    assert calls == ['load', 'double', 'describe']
+    assert values['total'] == 12 and values['count'] == 3
+
+    calls.clear()
+    pipeline = Pipeline(make_stages(calls), cache_dir=str(tmp_path))
+    assert pipeline.run()['total'] == 12
+    assert calls == []
+    assert [timing['status'] for timing in pipeline.timings] == ['cached'] * 3
+    assert 'total (wall)' in pipeline.summary()
+
+
+# Happy path - changing a param reruns that stage and everything downstream only; forced stages and stages with a
+# missing target rerun as well
+def test_invalidation(tmp_path):
+    calls = []
+    target = tmp_path / 'described.txt'
+    Pipeline(make_stages(calls, target=str(target)), cache_dir=str(tmp_path / 'cache')).run()
+
+    calls.clear()
+    assert Pipeline(make_stages(calls, scale=3, target=str(target)), cache_dir=str(tmp_path / 'cache')).run()['total'] == 18
+    assert calls == ['double', 'describe']
+
+    calls.clear()
+    Pipeline(make_stages(calls, scale=3, target=str(target)), cache_dir=str(tmp_path / 'cache')).run(force=['load'])
+    assert calls == ['load']
+
+    calls.clear()
+    target.unlink()
+    Pipeline(make_stages(calls, scale=3, target=str(target)), cache_dir=str(tmp_path / 'cache')).run()
+    assert calls == ['describe']
+    assert target.exists()
+
+
+# Happy path - independent stages run concurrently
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait_for_other():
+        barrier.wait()  # Times out (BrokenBarrierError) unless both stages run at the same time
+        return True
+
+    stages = [Stage('a', wait_for_other, outputs=['a']), Stage('b', wait_for_other, outputs=['b'])]
+    assert Pipeline(stages, n_jobs=2).run() == {'a': True, 'b': True}
+
+
+# Unhappy path - inputs nobody produces, cycles and unknown forced stages are rejected
+def test_invalid_pipelines():
+    with pytest.raises(ValueError):
+        Pipeline([Stage('a', lambda missing: 1, inputs=['missing'], outputs=['a'])])
+    with pytest.raises(ValueError):
+        Pipeline([Stage('a', lambda b: 1, inputs=['b'], outputs=['a']), Stage('b', lambda a: 1, inputs=['a'], outputs=['b'])])
+    with pytest.raises(ValueError):
+        Pipeline(make_stages([])).run(force=['unknown'])
+
+
+# Happy path - background stages run on the writer thread and run() waits for them before returning
+def test_background_stages(tmp_path):
+    threads = {}
+
+    def load():
+        threads['load'] = threading.current_thread().name
+        return [1, 2, 3]
+
+    def checkpoint(numbers):
+        threads['checkpoint'] = threading.current_thread().name
+        (tmp_path / 'numbers.txt').write_text(str(numbers))
+
+    stages = [Stage('load', load, outputs=['numbers']),
+              Stage('checkpoint', checkpoint, inputs=['numbers'], targets=[str(tmp_path / 'numbers.txt')], background=True)]
+    Pipeline(stages, cache_dir=str(tmp_path / 'cache')).run()
+    assert (tmp_path / 'numbers.txt').read_text() == '[1, 2, 3]'
+    assert threads['checkpoint'].startswith('pipeline-writer') and not threads['load'].startswith('pipeline-writer')
+    assert len(list((tmp_path / 'cache').iterdir())) == 2
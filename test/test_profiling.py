@@ -0,0 +1,60 @@
+"""
+This module contains unit tests for the per stage time/memory measurements and run reports in profiling.py
+"""
+
+import json
+import pstats
+
+from src import profiling
+from src.profiling import StageRecorder, profiled, regressions, stage, write_report
+
+
+# Happy path - stages are measured and aggregated by name, with the rows set inside the block
+def test_stage_records_measurements():
+    recorder = StageRecorder()
+    for _ in range(2):
+        with stage('sum', stage_recorder=recorder) as metrics:
+            metrics['rows'] = len([sum(range(10000))] * 5)
+
+    stats = recorder.as_dict()['sum']
+    assert stats['calls'] == 2 and stats['rows'] == 10
+    assert stats['wall_seconds'] >= stats['max_wall_seconds'] > 0
+    assert stats['cpu_seconds'] >= 0 and stats['peak_rss_mb'] > 0
+    assert metrics['wall_seconds'] > 0
+
+
+# Happy path - the decorator counts the returned rows and dumps a cProfile profile per stage
+def test_profiled_dumps_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    profiling.recorder.clear()
+
+    @profiled('make_rows')
+    def make_rows(n):
+        return [{'id': i} for i in range(n)]
+
+    assert len(make_rows(7)) == 7
+    assert profiling.recorder.as_dict()['make_rows']['rows'] == 7
+    assert pstats.Stats(str(tmp_path / 'make_rows.prof')).total_calls > 0
+
+
+# Happy path - the report is saved as JSON and stages that got slower than in the previous report are flagged
+def test_report_and_regressions(tmp_path):
+    recorder = StageRecorder()
+    recorder.record('fit', wall_seconds=1.0, cpu_seconds=1.0, peak_rss_mb=100.0, rss_growth_mb=10.0, rows=100)
+    path = tmp_path / 'report.json'
+    previous = write_report(str(path), {'k': 20}, stage_recorder=recorder)
+    assert json.loads(path.read_text())['stages']['fit']['rows'] == 100
+
+    recorder.record('fit', wall_seconds=1.0, cpu_seconds=0.1, peak_rss_mb=100.0, rss_growth_mb=10.0)
+    current = write_report(str(path), stage_recorder=recorder)
+    assert regressions(previous, current) == ['fit: wall_seconds went from 1.00s to 2.00s (+100%)']
+    assert regressions(current, previous) == []
+
+
+# Unhappy path - stages too short to compare and stages missing from the previous report are not flagged
+def test_regressions_ignore_noise():
+    previous = {'stages': {'quick': {'wall_seconds': 0.01, 'cpu_seconds': 0.01, 'peak_rss_mb': None}}}
+    current = {'stages': {'quick': {'wall_seconds': 0.1, 'cpu_seconds': 0.1, 'peak_rss_mb': 50.0},
+                          'new': {'wall_seconds': 10.0, 'cpu_seconds': 10.0, 'peak_rss_mb': 50.0}}}
+    assert regressions(previous, current) == []
+    assert regressions(None, current) == []
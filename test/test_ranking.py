@@ -0,0 +1,41 @@
+"""
+This module contains unit tests for the blended ranking score in ranking.py
+"""
+
+import numpy as np
+import pytest
+
+from src.ranking import score_games, standardize
+
+
+def _game(bayes_average, rating, owners, year=2010, distance=1.0):
+    return {'bayes_average': bayes_average, 'average_user_rating': rating, 'number_of_users_own': owners,
+            'year_published': year, 'centroid_distance': distance}
+
+
+# Happy path - a popular classic outranks an obscure game with a few perfect ratings
+def test_classic_outranks_obscure_game():
+    games = [_game(bayes_average=5.6, rating=10.0, owners=3),
+             _game(bayes_average=7.3, rating=7.4, owners=110000),
+             _game(bayes_average=6.5, rating=7.0, owners=5000)]
+    scores = score_games(games)
+
+    assert np.argmax(scores) == 1
+    assert np.argmin(scores) == 0
+    # Rating only would put the obscure game first
+    assert np.argmax(score_games(games, {'rating': 1.0})) == 0
+
+
+# Happy path - missing values count as the average and don't break the score
+def test_missing_values():
+    z = standardize([1.0, None, 3.0])
+    scores = score_games([_game(None, None, None, None, None), _game(7.0, 7.0, 100, -2200, 0.5)])
+
+    np.testing.assert_allclose(z, [-1.0, 0.0, 1.0])
+    assert np.isfinite(scores).all()
+
+
+# Unhappy path - misspelled weights are rejected instead of silently ignored
+def test_unknown_component():
+    with pytest.raises(ValueError):
+        score_games([_game(7.0, 7.0, 100)], {'popularty': 1.0})
@@ -0,0 +1,57 @@
+"""
+This module contains unit tests for the JSON API request handling shared by app.py and asgi.py in recommend.py
+"""
+
+from src.catalog import Catalog
+from src.recommend import recommendations, batch_recommendations
+
+CONFIG = {'MAX_ROWS_SHOW': 2, 'API_MAX_PER_PAGE': 10, 'API_MAX_BATCH_SIZE': 3}
+
+
+def make_catalog():
+    return Catalog([{'game_id': str(i), 'name': f'Game {i}', 'average_user_rating': float(i),
+                     'number_of_users_own': i, 'cluster': i % 2} for i in range(1, 6)])
+
+
+# Happy path - games are paginated and the last page has no next page
+def test_recommendations_pages():
+    catalog = make_catalog()
+    first, status = recommendations(catalog, {'game_id': '1'}, CONFIG)
+    last, _ = recommendations(catalog, {'cluster_id': '1', 'page': '2'}, CONFIG)
+
+    assert status == 200
+    assert first['cluster'] == 1
+    assert [game['game_id'] for game in first['games']] == ['5', '3']
+    assert first['next_page'] == 2
+    assert [game['game_id'] for game in last['games']] == ['1']
+    assert last['next_page'] is None
+
+
+# Unhappy path - unknown game, bad cluster id and bad page size
+def test_recommendations_errors():
+    catalog = make_catalog()
+
+    assert recommendations(catalog, {'game_id': '42'}, CONFIG)[1] == 404
+    assert recommendations(catalog, {'cluster_id': 'abc'}, CONFIG)[1] == 400
+    assert recommendations(catalog, {'game_id': '1', 'per_page': '11'}, CONFIG)[1] == 400
+    assert recommendations(catalog, {}, CONFIG)[1] == 400
+    # A game that wasn't clustered has nothing to recommend
+    unclustered = Catalog([{'game_id': '7', 'name': 'Game 7', 'cluster': None}])
+    assert recommendations(unclustered, {'game_id': '7'}, CONFIG)[1] == 404
+
+
+# Happy path - each distinct cluster is returned once and unknown ids are reported as missing
+def test_batch_recommendations():
+    payload, status = batch_recommendations(make_catalog(), {'game_ids': ['1', '3', '42']}, CONFIG)
+
+    assert status == 200
+    assert payload['clusters'] == {'1': 1, '3': 1}
+    assert payload['missing'] == ['42']
+    assert list(payload['recommendations']) == ['1']
+
+
+# Unhappy path - empty or oversized batches are rejected
+def test_batch_recommendations_invalid():
+    assert batch_recommendations(make_catalog(), {'game_ids': []}, CONFIG)[1] == 400
+    assert batch_recommendations(make_catalog(), {'game_ids': ['1', '2', '3', '4']}, CONFIG)[1] == 400
+    assert batch_recommendations(make_catalog(), None, CONFIG)[1] == 400
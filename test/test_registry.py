@@ -0,0 +1,69 @@
+"""
+This module contains unit tests for the versioned model/data registry in registry.py
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from src.catalog import ReloadingCatalog
+from src.model_bundle import ModelBundle
+from src.registry import ModelRegistry
+
+
+def make_artifacts(tmp_path, name, cluster):
+    """Saves a tiny model bundle and clustered data snapshot in which every game is in the given cluster"""
+    bundle = ModelBundle(np.zeros((1, 2)), np.zeros(2), np.ones(2), ['a', 'b'], {'k': 1, 'seed': 0, 'silhouette_score': 0.5})
+    bundle.save(str(tmp_path / name / 'kmeans'))
+    games = [{'id': str(game_id), 'name': f'Game {game_id}', 'cluster': cluster, 'score': float(game_id)}
+             for game_id in range(3)]
+    data_path = tmp_path / name / 'games_clustered.json'
+    data_path.write_text(json.dumps(games))
+    return {'model': str(tmp_path / name / 'kmeans'), 'data': str(data_path)}
+
+
+# Happy path - versions are content addressed and carry the model metadata
+def test_register_is_content_addressed(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    artifacts = make_artifacts(tmp_path, 'run1', cluster=1)
+    version = registry.register(artifacts, {'note': 'first'})
+
+    assert registry.register(artifacts) == version
+    assert registry.register(make_artifacts(tmp_path, 'run2', cluster=2)) != version
+    metadata = registry.metadata(version)
+    assert metadata['k'] == 1 and metadata['silhouette_score'] == 0.5 and metadata['note'] == 'first'
+    assert len(registry.versions()) == 2
+    assert registry.active() is None
+
+
+# Happy path - activating and rolling back switch the catalog a running app serves, and rollbacks walk back in history
+def test_activate_rollback_and_reload(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    first = registry.register(make_artifacts(tmp_path, 'run1', cluster=1))
+    second = registry.register(make_artifacts(tmp_path, 'run2', cluster=2))
+    third = registry.register(make_artifacts(tmp_path, 'run3', cluster=3))
+    catalog = ReloadingCatalog.from_registry(registry, check_seconds=0)
+
+    registry.activate(first)
+    assert catalog.get().cluster_of_game_id('0') == 1
+    registry.activate(second)
+    registry.activate(third)
+    assert catalog.get().cluster_of_game_id('0') == 3
+
+    assert registry.rollback() == second
+    assert catalog.get().cluster_of_game_id('0') == 2
+    assert registry.rollback() == first
+    assert ReloadingCatalog.from_registry(registry, pinned=third).get().cluster_of_game_id('0') == 3
+
+
+# Unhappy path - unknown versions can't be activated and there is nothing to roll back to without history
+def test_activate_unknown_version(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+
+    with pytest.raises(LookupError):
+        registry.activate('unknown')
+    with pytest.raises(LookupError):
+        registry.rollback()
+    with pytest.raises(ValueError):
+        registry.register({'data': str(tmp_path / 'games_clustered.json')})
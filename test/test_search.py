@@ -0,0 +1,71 @@
+"""
+This module contains unit tests for the name search index in search.py
+"""
+
+from src.search import NameIndex, normalize_name, EXACT, STARTS_WITH, WORD_PREFIX, SUBSTRING
+
+GAMES = [('13', 'Catan', 1, 100000),
+         ('27710', 'Catan Dice Game', 1, 10000),
+         ('9209', 'Ticket to Ride', 2, 90000),
+         ('14996', 'Ticket to Ride: Europe', 2, 60000),
+         ('161936', 'Pandemic Legacy: Season 1', 3, 50000),
+         ('30549', 'Pandemic', 3, 120000),
+         ('822', 'Carcassonne', 4, 110000),
+         ('4098', 'Age of Steam', 5, 9000)]
+
+
+# Happy path for normalize_name()
+def test_normalize_name():
+    assert normalize_name('Pandemic Legacy: Season 1') == 'pandemic legacy season 1'
+    assert normalize_name('  Café   Révolution!  ') == 'cafe revolution'
+
+
+# Unhappy path for normalize_name()
+def test_normalize_name_empty():
+    assert normalize_name(None) == ''
+    assert normalize_name('') == ''
+
+
+# Happy path - exact match outranks more popular partial matches
+def test_search_exact_match_first():
+    index = NameIndex(GAMES)
+    matches = index.search('pandemic')
+
+    assert matches[0].game_id == '30549'
+    assert matches[0].tier == EXACT
+    assert matches[1].game_id == '161936'
+    assert matches[1].tier == STARTS_WITH
+
+
+# Happy path - prefix of any word, ties broken by popularity
+def test_search_word_prefix_ranked_by_popularity():
+    index = NameIndex(GAMES)
+    matches = index.search('ride tick')
+
+    assert [match.game_id for match in matches] == ['9209', '14996']
+    assert all(match.tier == WORD_PREFIX for match in matches)
+
+
+# Happy path - substring inside a word, which LIKE '%...%' used to cover
+def test_search_substring():
+    index = NameIndex(GAMES)
+    matches = index.search('assonn')
+
+    assert len(matches) == 1
+    assert matches[0].cluster == 4
+    assert matches[0].tier == SUBSTRING
+
+
+# Happy path - limit is respected
+def test_search_limit():
+    index = NameIndex(GAMES)
+
+    assert len(index.search('a', limit=3)) == 3
+
+
+# Unhappy path - no matches or empty query
+def test_search_no_match():
+    index = NameIndex(GAMES)
+
+    assert index.search('Gloomhaven') == []
+    assert index.search('   ') == []
@@ -0,0 +1,55 @@
+"""
+This module contains unit tests for the "games like this one" nearest neighbour index in similarity.py
+"""
+
+import numpy as np
+import pytest
+from sklearn.cluster import KMeans
+
+from src.similarity import SimilarityIndex, recall_at_k
+
+
+def make_index(n_games=300, n_features=8, n_clusters=10):
+    rng = np.random.default_rng(28)
+    X = rng.normal(size=(n_games, n_features))
+    kmeans = KMeans(n_clusters=n_clusters, n_init=1, random_state=28).fit(X)
+    return SimilarityIndex.from_kmeans(range(n_games), X, kmeans), X
+
+
+# Happy path - exact search matches a brute force computation, nearest first
+def test_exact_search():
+    index, X = make_index()
+    rows, distances = index.search(X[:5], k=4)
+    expected = np.argsort(((X[:5, np.newaxis, :] - X[np.newaxis, :, :]) ** 2).sum(axis=2), axis=1)[:, :4]
+
+    np.testing.assert_array_equal(rows, expected)
+    assert (np.diff(distances, axis=1) >= 0).all()
+    np.testing.assert_allclose(distances[:, 0], 0, atol=1e-2)  # float32 rounding
+
+
+# Happy path - scanning more partitions never lowers recall, and scanning all of them is exact
+def test_approximate_recall():
+    index, X = make_index()
+    recalls = [recall_at_k(index, X[:50], 5, nprobe) for nprobe in (1, 3, 10)]
+
+    assert 0 < recalls[0] <= recalls[1] <= recalls[2]
+    assert recalls[2] == 1.0
+
+
+# Happy path - neighbours exclude the query game and skip unknown ids; the index survives a save/load round trip
+def test_neighbours_and_persistence(tmp_path):
+    index, _ = make_index()
+    filepath = str(tmp_path / 'similarity.npz')
+    index.save(filepath)
+    neighbours = SimilarityIndex.load(filepath).neighbours(['0', 'unknown'], k=3, nprobe=2)
+
+    assert list(neighbours) == ['0']
+    assert len(neighbours['0']) == 3
+    assert '0' not in [game_id for game_id, _ in neighbours['0']]
+    assert neighbours['0'] == index.neighbours(['0'], k=3, nprobe=2)['0']
+
+
+# Unhappy path - game ids, features and labels must line up
+def test_mismatched_inputs():
+    with pytest.raises(ValueError):
+        SimilarityIndex(['1', '2'], np.zeros((3, 2)), np.zeros((1, 2)), np.zeros(3))
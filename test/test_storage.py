@@ -0,0 +1,121 @@
+"""
+This module contains unit tests for the S3 transfers and streaming reads in storage.py
+
+The S3 tests run against moto's in-process S3 stand-in and are skipped if moto isn't installed
+"""
+
+import gzip
+import io
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src import storage
+
+GAMES = [{'id': 1, 'name': 'Catan', 'categories': ['Negotiation']}, {'id': 2, 'name': 'Carcassonne', 'categories': []}]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """A bucket in moto's S3 stand-in, reached through storage's shared client"""
+    moto = pytest.importorskip('moto')
+    for variable, value in [('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                            ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        monkeypatch.setenv(variable, value)
+    monkeypatch.delenv('S3_ENDPOINT_URL', raising=False)
+    with moto.mock_aws():
+        storage.get_client.cache_clear()
+        storage.get_client().create_bucket(Bucket='games-bucket')
+        yield storage.get_client()
+    storage.get_client.cache_clear()
+    storage.get_transfer_config.cache_clear()
+
+
+# Happy path - gzip and zstd streams are decompressed as they are read, uncompressed streams are passed through
+def test_decompress_stream():
+    raw = json.dumps(GAMES).encode()
+    assert json.load(storage.decompress_stream(io.BytesIO(gzip.compress(raw)), 'gzip')) == GAMES
+    assert storage.decompress_stream(io.BytesIO(raw), None).read() == raw
+    assert storage.guess_compression('games.json.gz') == 'gzip'
+    assert storage.guess_compression('games.json.zst') == 'zstd'
+    assert storage.guess_compression('games.json', content_encoding='gzip') == 'gzip'
+    assert storage.guess_compression('games.json') is None
+
+    zstandard = pytest.importorskip('zstandard')
+    assert json.load(storage.decompress_stream(io.BytesIO(zstandard.ZstdCompressor().compress(raw)), 'zstd')) == GAMES
+
+
+# Happy path - files above the multipart threshold round trip in parts, compressed objects are streamed into json
+def test_multipart_round_trip_and_streaming(s3, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'MULTIPART_THRESHOLD', 5 * 2 ** 20)
+    monkeypatch.setattr(storage, 'MULTIPART_CHUNKSIZE', 5 * 2 ** 20)
+    storage.get_transfer_config.cache_clear()
+    source = tmp_path / 'games.json'
+    source.write_bytes(json.dumps(GAMES * 100000).encode())
+    parts = -(-source.stat().st_size // storage.MULTIPART_CHUNKSIZE)
+
+    storage.upload_file(str(source), 'games-bucket', 'games.json')
+    storage.download_file('games-bucket', 'games.json', str(tmp_path / 'downloaded.json'))
+    assert (tmp_path / 'downloaded.json').read_bytes() == source.read_bytes()
+    assert storage.object_etag('games-bucket', 'games.json').endswith(f'-{parts}"')  # ETag of a multipart upload
+
+    s3.put_object(Bucket='games-bucket', Key='games.json.gz', Body=gzip.compress(json.dumps(GAMES).encode()))
+    assert storage.read_json('games-bucket', 'games.json.gz') == GAMES
+
+
+# Unhappy path - malformed S3 URLs, unknown compressions and missing objects raise
+def test_invalid_inputs(s3):
+    with pytest.raises(ValueError):
+        storage.parse_s3_url('games-bucket/games.json')
+    assert storage.parse_s3_url('s3://games-bucket/raw/games.json') == ('games-bucket', 'raw/games.json')
+    with pytest.raises(ValueError):
+        storage.decompress_stream(io.BytesIO(b''), 'lz4')
+    with pytest.raises(s3.exceptions.NoSuchKey):
+        storage.read_json('games-bucket', 'missing.json')
+
+
+# Happy path - unchanged data is neither uploaded nor downloaded again, the snapshot is compressed and content addressed
+def test_snapshot_skips_unchanged_transfers(s3, tmp_path):
+    pytest.importorskip('zstandard')
+    source = tmp_path / 'games.json'
+    source.write_text(json.dumps(GAMES * 1000))
+    local = tmp_path / 'data' / 'games.json'
+
+    manifest, uploaded = storage.upload_snapshot(str(source), 'games-bucket', 'games.json')
+    assert uploaded and manifest['snapshot_key'] == f"snapshots/{manifest['sha256']}.zst"
+    assert manifest['compressed_size'] < manifest['size'] / 10
+    assert storage.upload_snapshot(str(source), 'games-bucket', 'games.json') == (manifest, False)
+    assert storage.upload_snapshot(str(source), 'games-bucket', 'copy.json')[1] is False  # Same content, other key
+
+    assert storage.download_snapshot('games-bucket', 'games.json', str(local)) == (manifest, True)
+    assert local.read_bytes() == source.read_bytes()
+    assert storage.download_snapshot('games-bucket', 'games.json', str(local)) == (manifest, False)
+
+    source.write_text(json.dumps(GAMES))
+    new_manifest, uploaded = storage.upload_snapshot(str(source), 'games-bucket', 'games.json')
+    assert uploaded and new_manifest['sha256'] != manifest['sha256']
+    assert storage.download_snapshot('games-bucket', 'games.json', str(local))[1]
+    assert json.loads(local.read_text()) == GAMES
+    assert storage.read_json('games-bucket', new_manifest['snapshot_key']) == GAMES
+
+
+# Unhappy path - a snapshot that doesn't match its manifest's hash leaves the local file untouched, and without a
+# manifest the plain file is downloaded (which raises if it doesn't exist either)
+def test_snapshot_corrupt_or_missing(s3, tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    source = tmp_path / 'games.json'
+    source.write_text(json.dumps(GAMES))
+    manifest, _ = storage.upload_snapshot(str(source), 'games-bucket', 'games.json')
+    s3.put_object(Bucket='games-bucket', Key=manifest['snapshot_key'], Body=zstandard.ZstdCompressor().compress(b'[]'))
+    local = tmp_path / 'local.json'
+    local.write_text('old')
+
+    with pytest.raises(ValueError):
+        storage.download_snapshot('games-bucket', 'games.json', str(local))
+    assert local.read_text() == 'old' and sorted(p.name for p in tmp_path.iterdir()) == ['games.json', 'local.json']
+    s3.put_object(Bucket='games-bucket', Key='plain.json', Body=json.dumps(GAMES).encode())
+    assert storage.download_snapshot('games-bucket', 'plain.json', str(local)) == (None, True)
+    assert json.loads(local.read_text()) == GAMES
+    with pytest.raises(ClientError):
+        storage.download_snapshot('games-bucket', 'missing.json', str(local))